@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import queue
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+
+from camera import Camera
+from color import encode_ppm
+from denoise import denoise_framebuffer
+from hittable import Hittable
+from main import random_world
+from scene import Scene
+from session import RenderSession
+from temporal import TemporalAccumulator
+from vector import Point3, Vector3
+
+
+class Keyframe:
+
+    def __init__(
+        self,
+        time: float,  # Position of the keyframe on the path, in any increasing unit
+        lookfrom: Point3,
+        lookat: Point3,
+        vfov: float = 20,
+        focus_dist: float = 10,
+    ):
+        self.time = time
+        self.lookfrom = lookfrom
+        self.lookat = lookat
+        self.vfov = vfov
+        self.focus_dist = focus_dist
+
+
+class CameraPath:
+    '''Camera fly-through linearly interpolated between keyframes.'''
+
+    def __init__(self, keyframes: list[Keyframe]):
+        if not keyframes:
+            raise ValueError('A camera path needs at least one keyframe')
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe.time)
+        self.times = [keyframe.time for keyframe in self.keyframes]
+
+    def camera_at(self, t: float, **camera_kwargs) -> Camera:
+        '''Returns the camera at path time t, clamped to the first and last keyframes.'''
+        k = bisect.bisect_right(self.times, t)
+        a = self.keyframes[max(k - 1, 0)]
+        b = self.keyframes[min(k, len(self.keyframes) - 1)]
+        s = 0 if b.time == a.time else (t - a.time) / (b.time - a.time)
+        s = min(max(s, 0), 1)
+        return Camera(
+            lookfrom=(1 - s) * a.lookfrom + s * b.lookfrom,
+            lookat=(1 - s) * a.lookat + s * b.lookat,
+            vfov=(1 - s) * a.vfov + s * b.vfov,
+            focus_dist=(1 - s) * a.focus_dist + s * b.focus_dist,
+            **camera_kwargs,
+        )
+
+    def cameras(self, frames: int, **camera_kwargs) -> list[Camera]:
+        '''Returns `frames` cameras evenly spaced in time from the first to the last keyframe.'''
+        if frames == 1:
+            return [self.camera_at(self.times[0], **camera_kwargs)]
+        step = (self.times[-1] - self.times[0]) / (frames - 1)
+        return [self.camera_at(self.times[0] + n * step, **camera_kwargs) for n in range(frames)]
+
+
+def _stage(inbox: queue.Queue, outbox: queue.Queue | None, work: Callable, errors: list):
+    '''Runs `work` on every inbox item until None, forwarding the results and the final None.'''
+    while (item := inbox.get()) is not None:
+        if errors:
+            continue  # Keep draining so that upstream stages never block on a dead pipeline
+        try:
+            result = work(*item)
+        except Exception as e:
+            errors.append(e)
+            continue
+        if outbox is not None:
+            outbox.put(result)
+    if outbox is not None:
+        outbox.put(None)
+
+
+def render_animation(
+    world: Hittable | Scene,
+    path: CameraPath,
+    frames: int,
+    out_dir: Path = Path('frames'),
+    max_workers: int | None = None,
+    pipelined: bool = True,
+    temporal_spp: int | None = None,
+    **camera_kwargs,
+) -> float:
+    '''
+    Renders `frames` frames along a camera path into out_dir/frame_0000.ppm, ...
+    and returns the achieved frames per minute.
+
+    The scene is lowered once and every frame is traced by the same RenderSession. When
+    pipelined, frame N + 1 is traced while frame N is encoded to binary PPM and frame N - 1 is
+    written to disk. Otherwise each frame is traced and written as ASCII PPM in turn.
+    With `temporal_spp`, frames after the first trace that many new samples per pixel on top of
+    the reprojected samples of the previous frames, see TemporalAccumulator.
+    '''
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cameras = path.cameras(frames, **camera_kwargs)
+
+    with RenderSession(world, max_workers) as session:
+        start_perf_counter_ns = time.perf_counter_ns()
+        temporal = (
+            TemporalAccumulator(temporal_spp, executor=session.executor)
+            if temporal_spp is not None
+            else None
+        )
+
+        if not pipelined:
+            for n, camera in enumerate(cameras):
+                if temporal is not None:
+                    framebuffer = temporal.render(camera, session.scene)
+                    camera.write_image(framebuffer, out_dir / f'frame_{n:04d}.ppm')
+                else:
+                    session.render(camera, out_dir / f'frame_{n:04d}.ppm')
+        else:
+            encode_queue: queue.Queue = queue.Queue(maxsize=1)
+            write_queue: queue.Queue = queue.Queue(maxsize=1)
+            errors: list[Exception] = []
+
+            def encode(n: int, framebuffer: np.ndarray) -> tuple[int, bytes]:
+                if cameras[n].denoise:
+                    framebuffer = denoise_framebuffer(framebuffer)
+                return n, encode_ppm(framebuffer)
+
+            def write(n: int, data: bytes):
+                (out_dir / f'frame_{n:04d}.ppm').write_bytes(data)
+
+            stages = [
+                threading.Thread(target=_stage, args=(encode_queue, write_queue, encode, errors)),
+                threading.Thread(target=_stage, args=(write_queue, None, write, errors)),
+            ]
+            for stage in stages:
+                stage.start()
+
+            # One framebuffer being traced, one queued and one being encoded: a framebuffer is
+            # only traced into again once the encoder has taken the frame queued after it.
+            framebuffers = [cameras[0].new_framebuffer() for _ in range(3)]
+            try:
+                for n, camera in enumerate(cameras):
+                    if errors:
+                        break
+                    if temporal is not None:
+                        # A new framebuffer per frame, kept as the history of the next one
+                        encode_queue.put((n, temporal.render(camera, session.scene)))
+                        continue
+                    job = session.render(camera, framebuffer=framebuffers[n % 3])
+                    encode_queue.put((n, job.framebuffer))
+            finally:
+                encode_queue.put(None)
+                for stage in stages:
+                    stage.join()
+            if errors:
+                raise errors[0]
+
+        total_s = (time.perf_counter_ns() - start_perf_counter_ns) / 1e9
+
+    frames_per_minute = frames / total_s * 60
+    logging.info(
+        'Rendered %d frames in %.2fs, %.1f frames/min (%s)',
+        frames,
+        total_s,
+        frames_per_minute,
+        'pipelined' if pipelined else 'serial',
+    )
+    return frames_per_minute
+
+
+def main():
+    temporal_spp = None
+    if len(sys.argv) == 1:
+        out_dir, frames = Path('frames'), 24
+    elif len(sys.argv) in (3, 4):
+        out_dir, frames = Path(sys.argv[1]), int(sys.argv[2])
+        if len(sys.argv) == 4:
+            temporal_spp = int(sys.argv[3])
+    else:
+        print('Help: python animation.py frames_dir frame_count [temporal_spp]')
+        return
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+    path = CameraPath(
+        [
+            Keyframe(0, Point3(13, 2, 3), Point3(0, 0, 0), vfov=20, focus_dist=10),
+            Keyframe(1, Point3(3, 2, 13), Point3(0, 0, 0), vfov=25, focus_dist=10),
+            Keyframe(2, Point3(-13, 3, 3), Point3(0, 1, 0), vfov=20, focus_dist=13),
+        ]
+    )
+    render_animation(
+        random_world(),
+        path,
+        frames,
+        out_dir,
+        temporal_spp=temporal_spp,
+        aspect_ratio=16 / 9,
+        image_width=320,
+        samples_per_pixel=10,
+        max_depth=5,
+        vup=Vector3(0, 1, 0),
+        defocus_angle=0.6,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+from __future__ import annotations
+
+import logging
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from animation import CameraPath, Keyframe, render_animation
+from camera import SAMPLERS, Camera
+from denoise import denoise_framebuffer
+from hittable_list import HittableList
+from jit import njit, warm_up
+from kernel import CH_RAYS, CH_SAMPLES, _camera_ray, _pixel_sample, _strata, sample_block
+from main import random_scene_chunks, random_world
+from sampler import GROUP_BOUNCE, hash_pixel, sample_group
+from scene import Scene
+from vector import Point3, Vector3
+
+
+def benchmark_camera(**kwargs) -> Camera:
+    '''Returns a small camera framing the main.py scene, with keyword overrides.'''
+    settings = {
+        'aspect_ratio': 16 / 9,
+        'image_width': 96,
+        'samples_per_pixel': 16,
+        'max_depth': 5,
+        'vfov': 20,
+        'lookfrom': Point3(13, 2, 3),
+        'lookat': Point3(0, 0, 0),
+        'vup': Vector3(0, 1, 0),
+        'defocus_angle': 0.6,
+        'focus_dist': 10,
+    }
+    settings.update(kwargs)
+    return Camera(**settings)
+
+
+def benchmark_scene(seed: int = 0) -> Scene:
+    random.seed(seed)
+    return Scene.from_hittable(random_world())
+
+
+def render_frame(camera: Camera, scene: Scene) -> np.ndarray:
+    '''Renders all tiles of a frame in the calling thread.'''
+    framebuffer = camera.new_framebuffer()
+    for x0, y0, x1, y1 in camera.tiles():
+        framebuffer[y0:y1, x0:x1] = camera.render_tile(scene, x0, y0, x1, y1)
+    return framebuffer
+
+
+def rmse(framebuffer: np.ndarray, reference: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((framebuffer[..., :3] - reference[..., :3]) ** 2)))
+
+
+def bench_sampling():
+    '''Error versus spp of the random and stratified samplers against a 1024 spp reference.'''
+    scene = benchmark_scene()
+    reference = render_frame(benchmark_camera(samples_per_pixel=1024), scene)
+    print(f'{"spp":>6} {"random":>10} {"stratified":>11} {"time ratio":>11}')
+    for spp in (4, 16, 64, 256):
+        errors = {}
+        times = {}
+        for sampler in ('random', 'stratified'):
+            camera = benchmark_camera(samples_per_pixel=spp, sampler=sampler)
+            start = time.perf_counter()
+            errors[sampler] = rmse(render_frame(camera, scene), reference)
+            times[sampler] = time.perf_counter() - start
+        print(
+            f'{spp:>6} {errors["random"]:>10.5f} {errors["stratified"]:>11.5f} '
+            f'{times["stratified"] / times["random"]:>11.2f}'
+        )
+
+
+def bench_qmc():
+    '''Samples per pixel each sampler needs to match the error of the random sampler.'''
+    scene = benchmark_scene()
+    reference = render_frame(benchmark_camera(samples_per_pixel=2048), scene)
+    spps = (8, 12, 16, 24, 32, 48, 64, 96)
+    for target_spp in (16, 64):
+        camera = benchmark_camera(samples_per_pixel=target_spp)
+        target = rmse(render_frame(camera, scene), reference)
+        print(f'random at {target_spp} spp: rmse {target:.5f}')
+        for sampler in ('stratified', 'sobol', 'halton'):
+            errors = [
+                rmse(
+                    render_frame(benchmark_camera(samples_per_pixel=spp, sampler=sampler), scene),
+                    reference,
+                )
+                for spp in spps
+            ]
+            matching = next((spp for spp, error in zip(spps, errors) if error <= target), None)
+            print(
+                f'  {sampler:>10}: matches at {matching} spp '
+                + ' '.join(f'{spp}:{error:.5f}' for spp, error in zip(spps, errors))
+            )
+
+
+def bench_roulette():
+    '''
+    Path length, ray throughput and error of fixed-depth paths versus Russian roulette. The
+    last column is the time to reach the same error, relative to the first row (variance times
+    render time).
+    '''
+    scene = benchmark_scene()
+    reference = render_frame(benchmark_camera(samples_per_pixel=1024, max_depth=50), scene)
+    print(
+        f'{"paths":>16} {"rays/path":>10} {"rays/s":>9} {"paths/s":>9} {"rmse":>8} '
+        f'{"time to rmse":>13}'
+    )
+    baseline = None
+    for name, max_depth, rr_depth in (
+        ('max_depth 5', 5, 5),
+        ('max_depth 50', 50, 50),
+        ('roulette from 5', 50, 5),
+        ('roulette from 4', 50, 4),
+        ('roulette from 3', 50, 3),
+        ('roulette from 2', 50, 2),
+        ('roulette from 1', 50, 1),
+    ):
+        camera = benchmark_camera(samples_per_pixel=64, max_depth=max_depth, rr_depth=rr_depth)
+        elapsed = np.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            framebuffer = render_frame(camera, scene)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        rays = framebuffer[..., CH_RAYS].sum()
+        paths = framebuffer[..., CH_SAMPLES].sum()
+        error = rmse(framebuffer, reference)
+        cost = error**2 * elapsed
+        baseline = baseline if baseline is not None else cost
+        print(
+            f'{name:>16} {rays / paths:>10.3f} {rays / elapsed:>9.0f} {paths / elapsed:>9.0f} '
+            f'{error:>8.5f} {cost / baseline:>13.2f}'
+        )
+
+
+def bench_sample_blocks():
+    '''
+    Time per pixel of drawing the sample values of the Python object path with one njit call per
+    camera sample and bounce, versus one sample_block call per pixel, next to the time the
+    object path takes to trace the pixel.
+    '''
+    camera = benchmark_camera(max_depth=50)
+    random.seed(0)
+    world = random_world()
+    scene = Scene.from_hittable(world)
+    rays = render_frame(camera, scene)[..., CH_RAYS].astype(np.int64)
+    spp = camera.samples_per_pixel
+    pixels = [(i, j) for j in range(camera.image_height) for i in range(camera.image_width)]
+    perm = np.arange(_strata(spp) ** 2)
+
+    print(f'{"sampler":>10} {"per call":>10} {"block":>10} {"trace":>10}  (us per pixel)')
+    for name in ('random', 'sobol'):
+        sampler = SAMPLERS[name]
+        sample_block(sampler, 0, 0, spp, 1 + camera.max_depth)
+
+        start = time.perf_counter()
+        for i, j in pixels:
+            pixel_seed = hash_pixel(camera.seed, i, j)
+            for s in range(spp):
+                _pixel_sample(sampler, 0, perm, pixel_seed, s)
+            for k in range(rays[j, i]):  # The bounce groups of the traced rays
+                sample_group(sampler, pixel_seed, k % spp, GROUP_BOUNCE + k // spp)
+        per_call = (time.perf_counter() - start) / len(pixels)
+
+        start = time.perf_counter()
+        for i, j in pixels:
+            sample_block(sampler, hash_pixel(camera.seed, i, j), 0, spp, 1 + camera.max_depth)
+        block = (time.perf_counter() - start) / len(pixels)
+
+        traced = pixels[:: len(pixels) // 8]
+        object_camera = benchmark_camera(max_depth=50, sampler=name)
+        for i, j in traced:  # Compiles the material functions on first hit
+            object_camera.render_pixel(i, j, world)
+        start = time.perf_counter()
+        for i, j in traced:
+            object_camera.render_pixel(i, j, world)
+        trace = (time.perf_counter() - start) / len(traced)
+
+        print(f'{name:>10} {per_call * 1e6:>10.1f} {block * 1e6:>10.1f} {trace * 1e6:>10.0f}')
+
+
+@njit
+def _camera_rays(cam: np.ndarray, width: int, height: int, spp: int, seed: int) -> float:
+    """Draws the camera samples and rays of a frame as render_tile_kernel does, traces none"""
+    checksum = 0.0
+    perm = np.arange(1)
+    for j in range(height):
+        for i in range(width):
+            pixel_seed = hash_pixel(seed, i, j)
+            for s in range(spp):
+                px, py, lx, ly = _pixel_sample(0, 0, perm, pixel_seed, s)
+                ox, oy, oz, dx, dy, dz = _camera_ray(cam, i, j, px, py, lx, ly)
+                checksum += ox + dx
+    return checksum
+
+
+def bench_ray_generation():
+    '''
+    Share of the frame time spent making camera rays: Camera.get_ray in the Python object path,
+    and the camera samples and rays of the compiled kernel.
+    '''
+    camera = benchmark_camera(max_depth=50)
+    random.seed(0)
+    world = random_world()
+    scene = Scene.from_hittable(world)
+    pixels = [
+        (i, j) for j in range(0, camera.image_height, 7) for i in range(0, camera.image_width, 7)
+    ]
+    blocks = [
+        camera.sample_block(hash_pixel(camera.seed, i, j), camera.samples_per_pixel)
+        for i, j in pixels
+    ]
+    camera.render_pixel(*pixels[0], world)  # Compiles the material functions on first hit
+
+    start = time.perf_counter()
+    for i, j in pixels:
+        camera.render_pixel(i, j, world)
+    frame_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for (i, j), block in zip(pixels, blocks):
+        for sample in block:
+            camera.get_ray(i, j, sample[0])
+    rays_s = time.perf_counter() - start
+    print(f'{"path":>7} {"frame s":>8} {"rays s":>8} {"share":>6} {"us/ray":>7}')
+    ray_us = rays_s / len(pixels) / camera.samples_per_pixel * 1e6
+    print(f'{"object":>7} {frame_s:>8.3f} {rays_s:>8.3f} {rays_s / frame_s:>6.1%} {ray_us:>7.2f}')
+
+    args = camera.params, camera.image_width, camera.image_height, camera.samples_per_pixel, 0
+    _camera_rays(*args)
+    frame_s = rays_s = np.inf
+    for _ in range(5):
+        start = time.perf_counter()
+        render_frame(camera, scene)
+        frame_s = min(frame_s, time.perf_counter() - start)
+        start = time.perf_counter()
+        _camera_rays(*args)
+        rays_s = min(rays_s, time.perf_counter() - start)
+    ray_us = rays_s / camera.image_width / camera.image_height / camera.samples_per_pixel * 1e6
+    print(f'{"kernel":>7} {frame_s:>8.3f} {rays_s:>8.3f} {rays_s / frame_s:>6.1%} {ray_us:>7.2f}')
+
+
+def bench_denoise():
+    '''
+    Error and time of raw and denoised frames versus spp. The raw error falls as 1 / sqrt(spp), so
+    a denoised frame is worth (raw / denoised)^2 times its spp, the last column.
+    '''
+    scene = benchmark_scene()
+    reference = render_frame(benchmark_camera(samples_per_pixel=1024), scene)
+    denoise_framebuffer(render_frame(benchmark_camera(samples_per_pixel=1), scene))
+    print(
+        f'{"spp":>6} {"raw rmse":>9} {"render s":>9} {"denoised":>9} {"filter s":>9} '
+        f'{"worth spp":>10}'
+    )
+    for spp in (1, 2, 4, 8, 16, 32, 64):
+        camera = benchmark_camera(samples_per_pixel=spp)
+        start = time.perf_counter()
+        framebuffer = render_frame(camera, scene)
+        render_s = time.perf_counter() - start
+        start = time.perf_counter()
+        denoised = denoise_framebuffer(framebuffer)
+        filter_s = time.perf_counter() - start
+        raw_error = rmse(framebuffer, reference)
+        error = rmse(denoised, reference)
+        print(
+            f'{spp:>6} {raw_error:>9.5f} {render_s:>9.3f} {error:>9.5f} {filter_s:>9.3f} '
+            f'{spp * (raw_error / error) ** 2:>10.1f}'
+        )
+
+
+def bench_splitting():
+    '''
+    Error and time of plain spp increases versus path splitting at the first bounce, with defocus
+    blur on. The last column is the time to reach the same error relative to the first row
+    (variance times render time), below 1 where a configuration converges faster.
+    '''
+    scene = benchmark_scene()
+    reference = render_frame(benchmark_camera(samples_per_pixel=1024, max_depth=50), scene)
+    print(
+        f'{"spp":>4} {"splits":>36} {"rays/path":>10} {"time s":>7} {"rmse":>8} '
+        f'{"time to rmse":>13}'
+    )
+    baseline = None
+    for spp, splits in (
+        (16, {}),
+        (32, {}),
+        (64, {}),
+        (16, {'lambertian': 2}),
+        (16, {'lambertian': 4}),
+        (16, {'metal': 4}),
+        (16, {'lambertian': 2, 'metal': 4}),
+        (16, {'lambertian': 4, 'metal': 4, 'dielectric': 4}),
+        (4, {'lambertian': 4, 'metal': 4, 'dielectric': 4}),
+    ):
+        camera = benchmark_camera(samples_per_pixel=spp, max_depth=50, splits=splits)
+        render_frame(camera, scene)
+        elapsed = np.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            framebuffer = render_frame(camera, scene)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        rays = framebuffer[..., CH_RAYS].sum()
+        paths = framebuffer[..., CH_SAMPLES].sum()
+        error = rmse(framebuffer, reference)
+        cost = error**2 * elapsed
+        baseline = baseline if baseline is not None else cost
+        name = ', '.join(f'{material} {count}' for material, count in splits.items()) or '-'
+        print(
+            f'{spp:>4} {name:>36} {rays / paths:>10.3f} {elapsed:>7.3f} {error:>8.5f} '
+            f'{cost / baseline:>13.2f}'
+        )
+
+
+# Child process of bench_startup: a 1 spp frame of the benchmark camera from a cold start
+_STARTUP_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+from jit import warm_up
+from benchmark import benchmark_camera, benchmark_scene, render_frame
+import_s, compile_s = warm_up()
+render_start = time.perf_counter()
+render_frame(benchmark_camera(samples_per_pixel=1), benchmark_scene())
+end = time.perf_counter()
+print(import_s, compile_s, end - render_start, end - start, 'numba' in sys.modules)
+'''
+
+
+def bench_startup():
+    '''
+    Import, compile and render times of fresh processes rendering one small frame: with numba and
+    an empty compilation cache, with numba loading what that left on disk, and with the NumPy
+    engine, which must not import numba at all.
+    '''
+    print(
+        f'{"engine":>6} {"cache":>6} {"import s":>9} {"compile s":>10} {"render s":>9} '
+        f'{"total s":>8} {"numba":>6}'
+    )
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for engine, cache in (('numba', 'cold'), ('numba', 'warm'), ('numpy', '-')):
+            env = dict(os.environ, PYRAYTRACING_CACHE_DIR=cache_dir, PYRAYTRACING_ENGINE=engine)
+            output = subprocess.run(
+                [sys.executable, '-c', _STARTUP_SCRIPT],
+                cwd=Path(__file__).parent,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            *times, numba = output.split()
+            import_s, compile_s, render_s, total_s = map(float, times)
+            print(
+                f'{engine:>6} {cache:>6} {import_s:>9.3f} {compile_s:>10.3f} {render_s:>9.3f} '
+                f'{total_s:>8.3f} {numba:>6}'
+            )
+
+
+def bench_scene_load():
+    '''
+    Seconds to get the scene arrays of worlds of n spheres: unpickling the object graph and
+    lowering it, loading an .npz of the arrays, and mapping a binary scene file.
+    '''
+    random.seed(0)
+    spheres = random_world().hittables
+    spheres_data = pickle.dumps(spheres)
+    print(
+        f'{"spheres":>9} {"unpickle s":>11} {"lower s":>8} {"npz s":>8} {"mmap s":>8} '
+        f'{"file MB":>8}'
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        npz_file = Path(tmp_dir) / 'scene.npz'
+        scene_file = Path(tmp_dir) / 'scene.bin'
+        for copies in (1, 10, 100, 2000):
+            world = HittableList()
+            # Large worlds only as arrays: repeats of the rows of the lowered main.py world
+            if copies <= 100:
+                # Distinct objects, as pickle stores repeated references once
+                world.hittables = [
+                    sphere for _ in range(copies) for sphere in pickle.loads(spheres_data)
+                ]
+                data = pickle.dumps(world)
+                start = time.perf_counter()
+                world = pickle.loads(data)
+                unpickle_s = time.perf_counter() - start
+                start = time.perf_counter()
+                scene = Scene.from_hittable(world)
+                lower_s = time.perf_counter() - start
+            else:
+                world.hittables = spheres
+                rows = Scene.from_hittable(world)
+                scene = Scene(
+                    np.tile(rows.spheres, (copies, 1)),
+                    np.tile(rows.kinds, copies),
+                    np.tile(rows.props, (copies, 1)),
+                )
+                unpickle_s = lower_s = float('nan')
+
+            np.savez(npz_file, spheres=scene.spheres, kinds=scene.kinds, props=scene.props)
+            scene.save(scene_file)
+            start = time.perf_counter()
+            with np.load(npz_file) as arrays:
+                Scene(arrays['spheres'], arrays['kinds'], arrays['props'])
+            npz_s = time.perf_counter() - start
+            start = time.perf_counter()
+            loaded = Scene.load(scene_file)
+            mmap_s = time.perf_counter() - start
+            assert np.array_equal(loaded.spheres, scene.spheres)
+            print(
+                f'{len(scene):>9} {unpickle_s:>11.4f} {lower_s:>8.4f} {npz_s:>8.4f} '
+                f'{mmap_s:>8.5f} {scene_file.stat().st_size / 1e6:>8.1f}'
+            )
+
+
+def bench_generate():
+    '''
+    Seconds and peak traced memory of generating random sphere fields of growing extent straight
+    into a binary scene file, next to building and lowering the main.py world.
+    '''
+    print(f'{"extent":>7} {"spheres":>9} {"seconds":>8} {"peak MB":>8}')
+    tracemalloc.start()
+    start = time.perf_counter()
+    n = len(Scene.from_hittable(random_world()))
+    elapsed_s = time.perf_counter() - start
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    print(f'{"objects":>7} {n:>9} {elapsed_s:>8.3f} {peak_mb:>8.1f}')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scene_file = Path(tmp_dir) / 'scene.bin'
+        for extent in (11, 158, 500, 1581):
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            n = Scene.save_chunks(scene_file, random_scene_chunks(extent, seed=0))
+            elapsed_s = time.perf_counter() - start
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            print(f'{extent:>7} {n:>9} {elapsed_s:>8.3f} {peak_mb:>8.1f}')
+    tracemalloc.stop()
+
+
+def bench_animation():
+    '''
+    Frames per minute of render_animation along the same camera path, serial (trace, then write
+    ASCII PPM, frame after frame) and pipelined (binary PPM encoded and written while the next
+    frame is traced), best of 3 runs each.
+    '''
+    scene = benchmark_scene()
+    path = CameraPath(
+        [
+            Keyframe(0, Point3(13, 2, 3), Point3(0, 0, 0), vfov=20, focus_dist=10),
+            Keyframe(1, Point3(3, 2, 13), Point3(0, 0, 0), vfov=25, focus_dist=10),
+        ]
+    )
+    camera_kwargs = {
+        'aspect_ratio': 16 / 9,
+        'image_width': 320,
+        'samples_per_pixel': 2,
+        'max_depth': 5,
+        'vup': Vector3(0, 1, 0),
+        'defocus_angle': 0.6,
+    }
+    print(f'{"mode":>9} {"fpm":>8} {"speedup":>8}')
+    serial_fpm = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pipelined in (False, True):
+            fpm = max(
+                render_animation(
+                    scene, path, 12, Path(tmp_dir), pipelined=pipelined, **camera_kwargs
+                )
+                for _ in range(3)
+            )
+            serial_fpm = serial_fpm if serial_fpm is not None else fpm
+            mode = 'pipelined' if pipelined else 'serial'
+            print(f'{mode:>9} {fpm:>8.1f} {fpm / serial_fpm:>8.2f}')
+
+
+BENCHMARKS = {
+    'sampling': bench_sampling,
+    'qmc': bench_qmc,
+    'roulette': bench_roulette,
+    'blocks': bench_sample_blocks,
+    'denoise': bench_denoise,
+    'splitting': bench_splitting,
+    'startup': bench_startup,
+    'scene': bench_scene_load,
+    'generate': bench_generate,
+    'raygen': bench_ray_generation,
+    'animation': bench_animation,
+}
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in BENCHMARKS:
+        print(f'Help: python benchmark.py {{{",".join(BENCHMARKS)}}}')
+        return
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.WARNING)
+    warm_up()
+    BENCHMARKS[sys.argv[1]]()
+
+
+if __name__ == '__main__':
+    main()
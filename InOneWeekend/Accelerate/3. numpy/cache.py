@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from camera import Camera, Checkpoint
+from hittable import Hittable
+from jit import cache_root, source_digest, warm_up
+from main import random_world
+from scene import Scene
+from vector import Point3, Vector3
+
+# Camera settings that do not change the traced framebuffer: the sample count is stored in the
+# entry instead, and denoising and aux buffers only change the files written from it. The
+# engine is keyed, as the two only agree up to rounding and a top-up must not mix their samples.
+# The adaptive settings only count with a tolerance.
+_UNKEYED_SETTINGS = ('samples_per_pixel', 'denoise', 'aux')
+_ADAPTIVE_SETTINGS = ('min_spp', 'max_spp')
+
+
+class RenderCache:
+    '''
+    Content-addressed store of rendered framebuffers on disk.
+
+    An entry is the Checkpoint of a finished render, named by a digest of the scene arrays, the
+    camera settings (sampler, seed and engine included) and the renderer sources. A request for
+    at least as many samples per pixel as the entry holds is traced only for the missing sample
+    numbers, which are merged into it. Entries are evicted least recently used first once the
+    directory exceeds `max_bytes`.
+    '''
+
+    def __init__(
+        self,
+        directory: Path | None = None,  # Default: renders/ under the jit cache root
+        max_bytes: int = 1 << 30,  # Size of the entries kept on disk
+    ):
+        self.directory = directory if directory is not None else cache_root() / 'renders'
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0  # Requests served from an entry without tracing
+        self.top_ups = 0  # Requests that traced only the samples missing from an entry
+        self.misses = 0  # Requests traced from scratch
+
+    def __repr__(self) -> str:
+        return (
+            f'RenderCache({self.directory}, hits = {self.hits}, top-ups = {self.top_ups}, '
+            f'misses = {self.misses})'
+        )
+
+    @staticmethod
+    def key(camera: Camera, scene: Scene) -> str:
+        '''Returns the hex digest naming the entries of a camera and a scene.'''
+        digest = hashlib.sha256(source_digest().encode('ascii'))
+        unkeyed = _UNKEYED_SETTINGS
+        if camera.tolerance <= 0:
+            unkeyed += _ADAPTIVE_SETTINGS
+        settings = {
+            name: value for name, value in camera.settings().items() if name not in unkeyed
+        }
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        for array in (scene.spheres, scene.kinds, scene.props):
+            digest.update(f'{array.dtype.str}{array.shape}'.encode('ascii'))
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f'{key}.npz'
+
+    def render(
+        self,
+        camera: Camera,
+        world: Hittable | Scene,
+        image_file: Path | None = None,
+        max_workers: int | None = None,
+    ) -> np.ndarray:
+        '''
+        Returns the framebuffer of the camera render of a world, and writes its image unless
+        `image_file` is None, tracing only the samples per pixel that its entry lacks. An entry
+        with more samples than asked for is returned as it is.
+        '''
+
+        scene = Scene.from_hittable(world)
+        path = self.path(self.key(camera, scene))
+        try:
+            checkpoint = Checkpoint.load(path)
+        except FileNotFoundError:
+            checkpoint = None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            # A truncated or corrupt entry, say of a crashed writer, is rendered again
+            logging.warning('Unreadable render cache entry %s: %s', path.name, e)
+            path.unlink(missing_ok=True)
+            checkpoint = None
+
+        if checkpoint is not None and checkpoint.tile_spp.min() >= camera.samples_per_pixel:
+            with self.lock:
+                self.hits += 1
+            os.utime(path)  # Recently used
+            logging.info('Render cache hit, %d spp', checkpoint.tile_spp.min())
+            if image_file is not None:
+                camera.write_image(checkpoint.framebuffer, image_file)
+            return checkpoint.framebuffer
+
+        if checkpoint is not None:
+            with self.lock:
+                self.top_ups += 1
+            logging.info(
+                'Render cache top-up from %d to %d spp',
+                checkpoint.tile_spp.min(),
+                camera.samples_per_pixel,
+            )
+            checkpoint.settings = camera.settings()
+        else:
+            with self.lock:
+                self.misses += 1
+            checkpoint = camera.new_checkpoint(scene)
+        framebuffer = camera.render_checkpoint(checkpoint, image_file, max_workers)
+
+        checkpoint.save(path)
+        self.evict()
+        return framebuffer
+
+    def evict(self):
+        '''Deletes the least recently used entries until the cache fits in max_bytes.'''
+        entries = []
+        for path in self.directory.glob('*.npz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            logging.info('Render cache evicted %s', path.name)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    warm_up()
+    world = random_world()
+    cache = RenderCache()
+    for samples_per_pixel in (4, 4, 10):
+        cam = Camera(
+            aspect_ratio=16 / 9,
+            image_width=320,
+            samples_per_pixel=samples_per_pixel,
+            max_depth=50,
+            vfov=20,
+            lookfrom=Point3(13, 2, 3),
+            lookat=Point3(0, 0, 0),
+            vup=Vector3(0, 1, 0),
+            defocus_angle=0.6,
+            focus_dist=10,
+        )
+        start_perf_counter_ns = time.perf_counter_ns()
+        cache.render(cam, world, Path('image.ppm'))
+        elapsed_s = (time.perf_counter_ns() - start_perf_counter_ns) / 1e9
+        logging.info('%d spp in %.2fs: %s', samples_per_pixel, elapsed_s, cache)
+
+
+if __name__ == '__main__':
+    main()
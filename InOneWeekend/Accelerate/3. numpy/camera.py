@@ -1,25 +1,263 @@
 from __future__ import annotations
 
+import asyncio
+import collections
 import concurrent.futures
+import copy
+import io
+import json
 import logging
+import os
 import queue
 import threading
 import time
+from collections.abc import AsyncIterator, Callable
 from pathlib import Path
 
 import numpy as np
-from numba import njit
 
-from color import Color, write_color
+from color import Color, write_color, write_image
+from denoise import denoise_framebuffer
 from hittable import HitRecord, Hittable
 from interval import Interval
+from jit import ENGINE, ENGINES, enable, njit
+from kernel import (
+    CAM_CENTER,
+    CAM_DEFOCUS_ANGLE,
+    CAM_DEFOCUS_U,
+    CAM_DEFOCUS_V,
+    CAM_DELTA_U,
+    CAM_DELTA_V,
+    CAM_PIXEL00,
+    CAM_SIZE,
+    CH_ALBEDO,
+    CH_COLOR,
+    CH_INV_DEPTH,
+    CH_MOMENT2,
+    CH_NORMAL,
+    CH_OBJECT,
+    CH_RAYS,
+    CH_SAMPLES,
+    CHANNELS,
+    MEAN_CHANNELS,
+    TRACE_COLUMNS,
+    _concentric_disk,
+    render_tile_kernel,
+    sample_block,
+)
 from ray import Ray
-from vector import Point3, Vector3, cross, random_in_unit_disk, unit_vector
+from sampler import (
+    SAMPLER_HALTON,
+    SAMPLER_RANDOM,
+    SAMPLER_SOBOL,
+    SAMPLER_STRATIFIED,
+    hash_pixel,
+)
+from scene import DIELECTRIC, LAMBERTIAN, METAL, Scene
+from vector import Point3, Vector3, cross, unit_vector
+from vectorized import render_tile_vectorized
 
-RNG = np.random.default_rng()
 
+# Trace of render_tile, which has no rows so that the kernels do not record the ray segments
+NO_TRACE = np.empty((0, TRACE_COLUMNS), dtype=np.float32)
+NO_TRACE_COUNT = np.zeros(1, dtype=np.int64)
+# Rows render_tile_traced starts with for each sample, which a typical path of a camera ray
+# and a few bounces fits; a tile of longer paths is traced again at its exact size
+_TRACE_ROWS_PER_SAMPLE = 4
 
-@njit
+SAMPLERS = {
+    'random': SAMPLER_RANDOM,
+    'stratified': SAMPLER_STRATIFIED,
+    'sobol': SAMPLER_SOBOL,
+    'halton': SAMPLER_HALTON,
+}
+
+MATERIALS = {
+    'lambertian': LAMBERTIAN,
+    'metal': METAL,
+    'dielectric': DIELECTRIC,
+}
+
+
+def write_atomic(path: Path, write: Callable, binary: bool = False, sync: bool = False):
+    '''
+    Calls write(f) on a temporary file that then replaces `path`,
+    so readers never see a partially written file. With `sync` the data reaches the disk before
+    the rename, so that even a machine crash leaves either the old file or the new one.
+    '''
+
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    with tmp_path.open('wb' if binary else 'w', encoding=None if binary else 'UTF-8') as f:
+        write(f)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def aux_buffers(framebuffer: np.ndarray) -> dict[str, np.ndarray]:
+    '''
+    Compact arrays of the first-hit channels of a framebuffer: float16 albedo and normal,
+    float32 depth (inf where no sample hit) and int32 object index (-1 where none did).
+    '''
+
+    inv_depth = framebuffer[..., CH_INV_DEPTH].astype(np.float32)
+    depth = np.full(inv_depth.shape, np.inf, dtype=np.float32)
+    np.divide(1.0, inv_depth, out=depth, where=inv_depth > 0)
+    return {
+        'albedo': framebuffer[..., CH_ALBEDO : CH_ALBEDO + 3].astype(np.float16),
+        'normal': framebuffer[..., CH_NORMAL : CH_NORMAL + 3].astype(np.float16),
+        'depth': depth,
+        'object': framebuffer[..., CH_OBJECT].astype(np.int32),
+    }
+
+
+def merge_samples(region: np.ndarray, pixels: np.ndarray):
+    '''
+    Adds newly traced samples of some pixels to their framebuffer region: the mean channels
+    become the sample-weighted means of both, the sample and ray counts add up and the object
+    index keeps the earlier hit.
+    '''
+
+    counts = region[..., CH_SAMPLES : CH_SAMPLES + 1]
+    samples = pixels[..., CH_SAMPLES : CH_SAMPLES + 1]
+    total = counts + samples
+    region[..., MEAN_CHANNELS] = (
+        region[..., MEAN_CHANNELS] * counts + pixels[..., MEAN_CHANNELS] * samples
+    ) / total
+    region[..., CH_SAMPLES] = total[..., 0]
+    region[..., CH_RAYS] += pixels[..., CH_RAYS]
+    missed = region[..., CH_OBJECT] < 0
+    region[..., CH_OBJECT][missed] = pixels[..., CH_OBJECT][missed]
+
+
+class Checkpoint:
+    '''
+    Resumable state of a tile render, saved by Camera.render_concurrent and continued by
+    Camera.resume.
+
+    The tile kernels draw every random value from the streams of the seed, the pixel and the
+    sample number, so the camera settings and the next sample number of each tile are the whole
+    sampler state: tracing a tile from there on draws the samples an uninterrupted render would.
+    '''
+
+    def __init__(
+        self,
+        settings: dict,
+        scene: Scene,
+        framebuffer: np.ndarray,
+        tile_spp: np.ndarray,
+        next_samples: np.ndarray,
+    ):
+        self.settings = settings  # Camera.settings() of the render
+        self.scene = scene  # Scene arrays, the world itself is not saved
+        self.framebuffer = framebuffer  # Averaged channels, per-pixel counts in CH_SAMPLES
+        self.tile_spp = tile_spp  # (tiles,) samples per pixel traced, adaptive budgets included
+        self.next_samples = next_samples  # (tiles,) first sample number not traced yet
+
+    def save(self, path: Path):
+        '''Writes the checkpoint as an .npz file that atomically replaces any older one.'''
+        arrays = {
+            'settings': np.array(json.dumps(self.settings)),
+            'spheres': self.scene.spheres,
+            'kinds': self.scene.kinds,
+            'props': self.scene.props,
+            'framebuffer': self.framebuffer,
+            'tile_spp': self.tile_spp,
+            'next_samples': self.next_samples,
+        }
+        write_atomic(path, lambda f: np.savez(f, **arrays), binary=True, sync=True)
+
+    @classmethod
+    def load(cls, path: Path) -> Checkpoint:
+        with np.load(path) as arrays:
+            return cls(
+                json.loads(str(arrays['settings'])),
+                Scene(arrays['spheres'], arrays['kinds'], arrays['props']),
+                arrays['framebuffer'],
+                arrays['tile_spp'],
+                arrays['next_samples'],
+            )
+
+
+class RenderEstimate:
+    '''
+    Predicted cost of a render, measured by Camera.estimate.
+
+    The time of a tile on an engine is its cost per ray, timed on whole tiles so that the
+    overheads of a render_tile call count at about their share, times the rays the tile is
+    expected to trace at the camera samples_per_pixel. The confidence intervals combine the
+    sampling errors of the ray counts and of the cost per ray; they do not cover a machine
+    busier or idler than during the pass. Adaptive renders are predicted at their full budget.
+    '''
+
+    def __init__(
+        self,
+        tiles: list[tuple[int, int, int, int]],
+        tile_rays: np.ndarray,
+        tile_rays_variance: np.ndarray,
+        costs: dict[str, tuple[float, float]],
+        materials: dict[str, tuple[float, float]],
+        estimate_s: float,
+    ):
+        self.tiles = tiles  # Camera.tiles() of the render
+        self.tile_rays = tile_rays  # (tiles,) expected rays traced by each tile
+        self.tile_rays_variance = tile_rays_variance  # (tiles,) variance of their estimates
+        self.costs = costs  # Engine name: seconds per ray and the variance of its estimate
+        # First-hit material name (or 'background'): fraction of the pixels, rays per path
+        self.materials = materials
+        self.estimate_s = estimate_s  # Time taken by the estimate pass
+
+    def __repr__(self) -> str:
+        seconds, low, high = self.seconds()
+        materials = ', '.join(
+            f'{name} {100 * share:.0f}% x {rays:.2f}'
+            for name, (share, rays) in self.materials.items()
+        )
+        return (
+            f'RenderEstimate({seconds:.1f}s in [{low:.1f}s, {high:.1f}s] on {self.engine()}, '
+            f'{self.tile_rays.sum():.3g} rays, rays per path: {materials})'
+        )
+
+    def engine(self, engine: str | None = None) -> str:
+        '''Returns the engine name, by default the first one the estimate measured.'''
+        return engine if engine is not None else next(iter(self.costs))
+
+    def tile_seconds(self, engine: str | None = None) -> np.ndarray:
+        '''Returns the (tiles,) predicted seconds of each tile on one worker.'''
+        ray_s, _ = self.costs[self.engine(engine)]
+        return ray_s * self.tile_rays
+
+    def seconds(
+        self, engine: str | None = None, workers: int | None = None
+    ) -> tuple[float, float, float]:
+        '''
+        Returns the predicted wall-clock seconds of the render on `workers` cores (by default
+        all of them) and the bounds of its 95% confidence interval. The tiles are assumed to
+        spread evenly over the workers, but the render cannot end before its slowest tile.
+        '''
+
+        workers = workers if workers is not None else os.cpu_count() or 1
+        ray_s, ray_s_variance = self.costs[self.engine(engine)]
+        rays = self.tile_rays.sum()
+        total_s = rays * ray_s
+        variance = rays**2 * ray_s_variance + ray_s**2 * self.tile_rays_variance.sum()
+        margin_s = 1.96 * np.sqrt(max(variance, 0.0))
+        slowest_s = self.tile_seconds(engine).max()
+        seconds = max(total_s / workers, slowest_s)
+        low = max((total_s - margin_s) / workers, 0.0)
+        high = max((total_s + margin_s) / workers, slowest_s)
+        return float(seconds), float(min(low, seconds)), float(high)
+
+    def order(self) -> list[int]:
+        '''
+        Returns the tile indices slowest first, the order that balances workers best. It is the
+        same on every engine, as the tiles only differ in their rays.
+        '''
+        return np.argsort(-self.tile_rays, kind='stable').tolist()
+
+
+@njit(signatures=('(float64[::1],)',))
 def _background_color_optimized(unit_direction: np.ndarray) -> tuple[float, float, float]:
     """Optimized background color calculation"""
     a = 0.5 * (unit_direction[1] + 1.0)
@@ -38,23 +276,61 @@ class Camera:
         image_width: int = 100,  # Rendered image width in pixel count
         samples_per_pixel: int = 10,  # Count of random samples for each pixel
         max_depth: int = 10,  # Maximum number of ray bounces into scene
+        rr_depth: int = 5,  # Bounces before paths may end by Russian roulette
         vfov: float = 90,  # Vertical view angle (field of view)
         lookfrom: Point3 | None = None,  # Point camera is looking from
         lookat: Point3 | None = None,  # Point camera is looking at
         vup: Vector3 | None = None,  # Camera-relative "up" direction
         defocus_angle: float = 0,  # Variation angle of rays through each pixel
         focus_dist: float = 10,  # Distance from camera lookfrom point to plane of perfect focus
+        tile_size: int = 16,  # Edge length of the square tiles handed to render workers
+        min_spp: int = 8,  # Adaptive sampling: samples every pixel takes first
+        max_spp: int | None = None,  # Adaptive sampling: cap per pixel, default 4 * spp
+        tolerance: float = 0,  # Adaptive sampling: 95% confidence half-width to stop at, 0 is off
+        sampler: str = 'random',  # Pixel and lens sample pattern, one of SAMPLERS
+        seed: int = 0,  # Key of the random streams, equal seeds render equal images
+        denoise: bool = False,  # Filter the finished image guided by its first-hit features
+        aux: bool = False,  # Also write the first-hit buffers next to the image, e.g. image.aux.npz
+        splits: dict[str, int] | None = None,  # Paths per primary hit by material, of MATERIALS
+        engine: str | None = None,  # Tile engine, one of jit.ENGINES, default jit.ENGINE
     ):
         self.aspect_ratio = aspect_ratio
         self.image_width = image_width
         self.samples_per_pixel = samples_per_pixel
         self.max_depth = max_depth
+        self.rr_depth = rr_depth
         self.vfov = vfov
         self.lookfrom = lookfrom if lookfrom is not None else Point3()
         self.lookat = lookat if lookat is not None else Point3()
         self.vup = vup if vup is not None else Vector3()
         self.defocus_angle = defocus_angle
         self.focus_dist = focus_dist
+        self.tile_size = tile_size
+        self.min_spp = min_spp
+        self.max_spp = max_spp if max_spp is not None else 4 * samples_per_pixel
+        self.tolerance = tolerance
+        if sampler not in SAMPLERS:
+            raise ValueError(f'Unknown sampler: {sampler}')
+        self.sampler = sampler
+        self.seed = seed
+        self.denoise = denoise
+        self.aux = aux
+        for name, count in (splits or {}).items():
+            if name not in MATERIALS:
+                raise ValueError(f'Unknown material: {name}')
+            if count < 1:
+                raise ValueError(f'Split count of {name} must be at least 1: {count}')
+        self.splits = dict(splits or {})
+        # Looked up at the primary hits of the object path, the splits being fixed once the
+        # camera is constructed
+        self._split_counts = self.split_counts()
+        self._split_stride = int(self._split_counts.max())
+        if engine is not None and engine not in ENGINES:
+            raise ValueError(f'Unknown engine: {engine}')
+        self.engine = engine if engine is not None else ENGINE
+        self._object_world: Hittable | None = None  # World of the _object_ids cache
+        self._object_ids: dict[int, int] = {}
+        self._ray_tables: tuple[np.ndarray, np.ndarray] | None = None  # Cache of ray_tables()
 
         self.image_height = int(self.image_width / self.aspect_ratio)  # Rendered image height
         self.image_height = max(1, self.image_height)
@@ -96,38 +372,142 @@ class Camera:
         self.defocus_disk_u = self.u * defocus_radius  # Defocus disk horizontal radius
         self.defocus_disk_v = self.v * defocus_radius  # Defocus disk vertical radius
 
+        # Flat copy of the camera geometry for the compiled tile kernels.
+        self.params = np.empty(CAM_SIZE, dtype=np.float64)
+        self.params[CAM_CENTER : CAM_CENTER + 3] = self.center.e
+        self.params[CAM_PIXEL00 : CAM_PIXEL00 + 3] = self.pixel00_loc.e
+        self.params[CAM_DELTA_U : CAM_DELTA_U + 3] = self.pixel_delta_u.e
+        self.params[CAM_DELTA_V : CAM_DELTA_V + 3] = self.pixel_delta_v.e
+        self.params[CAM_DEFOCUS_U : CAM_DEFOCUS_U + 3] = self.defocus_disk_u.e
+        self.params[CAM_DEFOCUS_V : CAM_DEFOCUS_V + 3] = self.defocus_disk_v.e
+        self.params[CAM_DEFOCUS_ANGLE] = self.defocus_angle
+
         self.ppm_header = f'P3\n{self.image_width} {self.image_height}\n255\n'
         self.start_perf_counter_ns = time.perf_counter_ns()
 
-    def sample_square(self) -> Vector3:
-        '''Returns the vector to a random point in the [-.5,-.5]-[+.5,+.5] unit square.'''
-        x, y = RNG.uniform(-0.5, 0.5, (2))
-        return Vector3(x, y, 0)
+    def settings(self) -> dict:
+        '''Returns the constructor arguments of this camera as JSON-compatible values.'''
+        return {
+            'aspect_ratio': self.aspect_ratio,
+            'image_width': self.image_width,
+            'samples_per_pixel': self.samples_per_pixel,
+            'max_depth': self.max_depth,
+            'rr_depth': self.rr_depth,
+            'vfov': float(self.vfov),
+            'lookfrom': self.lookfrom.e.tolist(),
+            'lookat': self.lookat.e.tolist(),
+            'vup': self.vup.e.tolist(),
+            'defocus_angle': self.defocus_angle,
+            'focus_dist': float(self.focus_dist),
+            'tile_size': self.tile_size,
+            'min_spp': self.min_spp,
+            'max_spp': self.max_spp,
+            'tolerance': self.tolerance,
+            'sampler': self.sampler,
+            'seed': self.seed,
+            'denoise': self.denoise,
+            'aux': self.aux,
+            'splits': dict(self.splits),
+            'engine': self.engine,
+        }
 
-    def defocus_disk_sample(self) -> Point3:
-        '''Returns a random point in the camera defocus disk.'''
-        p = random_in_unit_disk()
-        return self.center + p.x * self.defocus_disk_u + p.y * self.defocus_disk_v
+    @classmethod
+    def from_settings(cls, settings: dict) -> Camera:
+        '''Inverse of settings().'''
+        vectors = ('lookfrom', 'lookat', 'vup')
+        return cls(
+            **{
+                name: Vector3(*value) if name in vectors else value
+                for name, value in settings.items()
+            }
+        )
 
-    def get_ray(self, i: int, j: int) -> Ray:
+    def sample_square(self, u: float, v: float) -> Vector3:
         '''
-        Construct a camera ray originating from the defocus disk and
-        directed at a randomly sampled point around the pixel location i, j.
+        Returns the vector to the point of the [-.5,-.5]-[+.5,+.5] unit square mapped from (u, v)
+        in [0, 1)^2.
         '''
+        return Vector3(u - 0.5, v - 0.5, 0)
+
+    def defocus_disk_sample(self, u: float, v: float) -> Point3:
+        '''Returns the concentric mapping of (u, v) in [0, 1)^2 onto the camera defocus disk.'''
+        x, y = _concentric_disk(u, v)
+        return Point3(self.center.e + x * self.defocus_disk_u.e + y * self.defocus_disk_v.e)
 
-        offset = self.sample_square()
-        pixel_sample = (
-            self.pixel00_loc
-            + (i + offset.x) * self.pixel_delta_u
-            + (j + offset.y) * self.pixel_delta_v
+    def sample_block(
+        self, pixel_seed: int, n: int, first_sample: int = 0, sampler: str | None = None
+    ) -> np.ndarray:
+        '''
+        Returns all sample values of n samples of a pixel from first_sample on, the values the
+        tile kernel takes from the random streams of `pixel_seed`, drawn in one call as a
+        (n, 1 + max_depth, 4) block. Row [s, 0] holds the (pixel u, pixel v, lens u, lens v)
+        coordinates in [0, 1) of sample s and row [s, 1 + k] the scatter and Russian roulette
+        values of its bounce k. The stratified sampler jitters the first samples inside the
+        cells of a sqrt(n) x sqrt(n) grid of the pixel footprint, and of the lens visited in a
+        shuffled order. The Sobol and Halton samplers take the points of their sequences
+        scrambled by `pixel_seed`.
+        '''
+        return sample_block(
+            SAMPLERS[sampler if sampler is not None else self.sampler],
+            pixel_seed,
+            first_sample,
+            n,
+            1 + self.max_depth,
         )
 
-        ray_origin = self.center if self.defocus_angle <= 0 else self.defocus_disk_sample()
-        ray_direction = pixel_sample - ray_origin
+    def split_counts(self) -> np.ndarray:
+        '''Returns the number of paths per primary hit of each material kind of the Scene.'''
+        counts = np.ones(len(MATERIALS), dtype=np.int64)
+        for name, count in self.splits.items():
+            counts[MATERIALS[name]] = count
+        return counts
 
-        return Ray(ray_origin, ray_direction)
+    def ray_tables(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns the (image_height, image_width, 3) tables of the pixel centers and of the
+        directions from the camera center to them, computed on first use and then kept with the
+        camera: they only depend on its geometry, which is fixed once it is constructed.
+        '''
+        if self._ray_tables is None:
+            j = np.arange(self.image_height)[:, np.newaxis, np.newaxis]
+            i = np.arange(self.image_width)[:, np.newaxis]
+            centers = self.pixel00_loc.e + i * self.pixel_delta_u.e + j * self.pixel_delta_v.e
+            self._ray_tables = centers, centers - self.center.e
+        return self._ray_tables
+
+    def get_ray(self, i: int, j: int, sample: np.ndarray) -> Ray:
+        '''
+        Construct a camera ray originating from the defocus disk and
+        directed at a sampled point around the pixel location i, j.
+        The `sample` row of sample_block fixes the pixel and lens points.
+        The pixel centers and directions come from ray_tables(), so a sample only adds its
+        offsets in the pixel square and on the defocus disk.
+        '''
+
+        pu, pv, lu, lv = sample
+        du, dv = pu - 0.5, pv - 0.5
+        centers, directions = self.ray_tables()
+        offset = du * self.pixel_delta_u.e + dv * self.pixel_delta_v.e
 
-    def ray_color(self, r: Ray, depth: int, world: Hittable) -> Color:
+        if self.defocus_angle <= 0:
+            return Ray(self.center, Vector3(directions[j, i] + offset))
+        ray_origin = self.defocus_disk_sample(lu, lv)
+        return Ray(ray_origin, Vector3(centers[j, i] + offset - ray_origin.e))
+
+    def ray_color(
+        self,
+        r: Ray,
+        depth: int,
+        world: Hittable,
+        bounce_samples: np.ndarray,  # Bounce rows of a sample_block sample
+        throughput: Color | None = None,  # Product of the attenuations before this ray
+        first_hit: np.ndarray | None = None,  # Framebuffer pixel summing the first-hit features
+        pixel_sample: tuple[int, int] | None = None,  # Pixel seed and sample number, to split
+    ) -> Color:
+        '''
+        Returns the color gathered along the ray r. With splits, the primary ray (depth equal to
+        max_depth) needs its `pixel_sample` to number the samples of its split paths.
+        '''
         # If we've exceeded the ray bounce limit, no more light is gathered.
         if depth <= 0:
             return Color(0, 0, 0)
@@ -135,25 +515,366 @@ class Camera:
         rec = HitRecord()
 
         if world.hit(r, Interval(0.001, np.inf), rec):
-            scattered = Ray()
-            attenuation = Color()
-            if rec.mat.scatter(r, rec, attenuation, scattered):
-                return attenuation * self.ray_color(scattered, depth - 1, world)
-            return Color(0, 0, 0)
+            if first_hit is not None and depth == self.max_depth:
+                first_hit[CH_ALBEDO : CH_ALBEDO + 3] += rec.mat.albedo.e
+                first_hit[CH_NORMAL : CH_NORMAL + 3] += rec.normal.e
+                first_hit[CH_INV_DEPTH] += 1 / (rec.t * r.direction.length())
+                if first_hit[CH_OBJECT] < 0:
+                    first_hit[CH_OBJECT] = self.object_index(world, rec.obj)
+
+            if depth == self.max_depth and self._split_stride > 1:
+                # Path splitting: the primary hit continues along `splits` paths averaged
+                # together, which take the samples s * stride to s * stride + splits - 1 with
+                # the largest split as the stride, so that no two samples share one.
+                if pixel_sample is None:
+                    raise ValueError('Path splitting needs the pixel_sample of the primary ray')
+                splits = self._split_counts[Scene.lower_material(rec.mat)[0]]
+                stride = self._split_stride
+                pixel_seed, s = pixel_sample
+                branches = self.sample_block(pixel_seed, splits, s * stride)[:, 1:]
+                color = Color(0, 0, 0)
+                for branch_samples in branches:
+                    color += self._scatter_color(r, rec, depth, world, branch_samples, throughput)
+                return color / splits
+            return self._scatter_color(r, rec, depth, world, bounce_samples, throughput)
 
         unit_direction = unit_vector(r.direction)
         r_val, g_val, b_val = _background_color_optimized(unit_direction.e)
+        if first_hit is not None and depth == self.max_depth:
+            first_hit[CH_ALBEDO : CH_ALBEDO + 3] += r_val, g_val, b_val
         return Color(r_val, g_val, b_val)
 
-    def render_pixel(self, i: int, j: int, world: Hittable) -> tuple[int, int, Color]:
+    def _scatter_color(
+        self,
+        r: Ray,
+        rec: HitRecord,
+        depth: int,
+        world: Hittable,
+        bounce_samples: np.ndarray,
+        throughput: Color | None,
+    ) -> Color:
+        '''Color gathered by scattering the ray r at its hit rec, the rest of ray_color.'''
+        scattered = Ray()
+        attenuation = Color()
+        bounce = self.max_depth - depth
+        sample = bounce_samples[bounce]
+        if not rec.mat.scatter(r, rec, attenuation, scattered, sample[:3]):
+            return Color(0, 0, 0)
+
+        throughput = attenuation * throughput if throughput is not None else attenuation
+        if bounce + 1 >= self.rr_depth:
+            # Russian roulette: the path survives with the probability of its throughput and
+            # the survivors are weighted up by its inverse, which keeps the estimate unbiased.
+            q = min(max(throughput.x, throughput.y, throughput.z), 0.95)
+            if sample[3] >= q:
+                return Color(0, 0, 0)
+            attenuation /= q
+            throughput /= q
+        return attenuation * self.ray_color(scattered, depth - 1, world, bounce_samples, throughput)
+
+    def render_pixel(
+        self, i: int, j: int, world: Hittable, pixel: np.ndarray | None = None
+    ) -> tuple[int, int, Color]:
+        '''
+        Returns j, i and the color of pixel i, j. A framebuffer `pixel` also receives the color,
+        the samples taken and the first-hit features, as render_tile writes them.
+        '''
+
         self.log_pixel(i, j)
+        if self.tolerance > 0:
+            return j, i, self.render_pixel_adaptive(i, j, world, pixel)
+        if pixel is not None:
+            self._clear_pixel(pixel)
         pixel_color = Color(0, 0, 0)
-        for _ in range(self.samples_per_pixel):
-            r = self.get_ray(i, j)
-            pixel_color += self.ray_color(r, self.max_depth, world)
+        pixel_seed = hash_pixel(self.seed, i, j)
+        block = self.sample_block(pixel_seed, self.samples_per_pixel)
+        for s, sample in enumerate(block):
+            r = self.get_ray(i, j, sample[0])
+            color = self.ray_color(
+                r, self.max_depth, world, sample[1:], first_hit=pixel, pixel_sample=(pixel_seed, s)
+            )
+            pixel_color += color
+            if pixel is not None:
+                pixel[CH_MOMENT2] += (0.2126 * color.x + 0.7152 * color.y + 0.0722 * color.z) ** 2
         pixel_color *= self.pixel_samples_scale
+        if pixel is not None:
+            self._resolve_pixel(pixel, pixel_color, self.samples_per_pixel)
         return j, i, pixel_color
 
+    def _clear_pixel(self, pixel: np.ndarray):
+        pixel[:] = 0.0
+        pixel[CH_OBJECT] = -1.0
+
+    def _resolve_pixel(self, pixel: np.ndarray, pixel_color: Color, samples: int):
+        pixel[CH_COLOR : CH_COLOR + 3] = pixel_color.e
+        pixel[CH_SAMPLES] = samples
+        pixel[CH_ALBEDO:CH_OBJECT] /= samples
+
+    def object_index(self, world: Hittable, obj: Hittable) -> int:
+        '''Index of a sphere of the world among the Scene rows, as in the CH_OBJECT channel.'''
+        if self._object_world is not world:
+            self._object_ids = {id(sphere): n for n, sphere in enumerate(Scene.flatten(world))}
+            self._object_world = world
+        return self._object_ids[id(obj)]
+
+    def render_pixel_adaptive(
+        self, i: int, j: int, world: Hittable, pixel: np.ndarray | None = None
+    ) -> Color:
+        '''
+        Samples pixel i, j until the 95% confidence half-width of its luminance mean falls below
+        the tolerance, taking between min_spp and max_spp samples.
+        '''
+
+        if pixel is not None:
+            self._clear_pixel(pixel)
+
+        pixel_color = Color(0, 0, 0)
+        pixel_seed = hash_pixel(self.seed, i, j)
+        first = min(self.min_spp, self.max_spp)
+        # Past the stratified first phase the samples are plain random, as in the tile kernel
+        later_sampler = 'random' if self.sampler == 'stratified' else self.sampler
+        block = np.concatenate(
+            [
+                self.sample_block(pixel_seed, first),
+                self.sample_block(pixel_seed, self.max_spp - first, first, later_sampler),
+            ]
+        )
+        mean = m2 = 0.0
+        n = 0
+        while n < self.max_spp:
+            sample = block[n]
+            r = self.get_ray(i, j, sample[0])
+            color = self.ray_color(
+                r, self.max_depth, world, sample[1:], first_hit=pixel, pixel_sample=(pixel_seed, n)
+            )
+            pixel_color += color
+            n += 1
+            luminance = 0.2126 * color.x + 0.7152 * color.y + 0.0722 * color.z
+            if pixel is not None:
+                pixel[CH_MOMENT2] += luminance * luminance
+            delta = luminance - mean
+            mean += delta / n
+            m2 += delta * (luminance - mean)
+            if n >= max(self.min_spp, 2) and 1.96 * np.sqrt(m2 / (n - 1) / n) <= self.tolerance:
+                break
+        pixel_color /= n
+        if pixel is not None:
+            self._resolve_pixel(pixel, pixel_color, n)
+        return pixel_color
+
+    def tiles(self) -> list[tuple[int, int, int, int]]:
+        '''Splits the image into (x0, y0, x1, y1) tiles in scanline order.'''
+        size = self.tile_size
+        return [
+            (x0, y0, min(x0 + size, self.image_width), min(y0 + size, self.image_height))
+            for y0 in range(0, self.image_height, size)
+            for x0 in range(0, self.image_width, size)
+        ]
+
+    def new_framebuffer(self) -> np.ndarray:
+        '''Returns a cleared framebuffer with all the channels written by render_tile.'''
+        framebuffer = np.zeros((self.image_height, self.image_width, CHANNELS), dtype=np.float64)
+        framebuffer[..., CH_OBJECT] = -1.0
+        return framebuffer
+
+    def new_checkpoint(self, scene: Scene) -> Checkpoint:
+        '''Returns the checkpoint of a render of the scene that has not traced any tile yet.'''
+        tiles = len(self.tiles())
+        return Checkpoint(
+            self.settings(),
+            scene,
+            self.new_framebuffer(),
+            np.zeros(tiles, dtype=np.int64),
+            np.zeros(tiles, dtype=np.int64),
+        )
+
+    def estimate(
+        self,
+        world: Hittable | Scene,
+        engines: tuple[str, ...] | None = None,
+        rows_per_tile: int = 1,
+        calibration_tiles: int = 8,
+        samples_per_pixel: int = 1,
+        max_workers: int | None = None,
+    ) -> RenderEstimate:
+        '''
+        Predicts the cost of rendering the world, by default on the camera engine, see
+        RenderEstimate. The pass traces `rows_per_tile` random rows of every tile at
+        `samples_per_pixel`, a stratified subset of the pixels whose rays per path give the
+        rays of each tile and, per first-hit material, the path lengths. Every engine then
+        traces `calibration_tiles` whole tiles spread over the image, timed for its cost per ray.
+        '''
+
+        start_perf_counter_ns = time.perf_counter_ns()
+        engines = engines if engines is not None else (self.engine,)
+        scene = Scene.from_hittable(world)
+        tiles = self.tiles()
+        estimate_camera = copy.copy(self)
+        estimate_camera.samples_per_pixel = samples_per_pixel
+        estimate_camera.tolerance = 0
+        estimate_camera.engine = engines[0]
+        rng = np.random.default_rng(self.seed)
+        rows = [
+            (t, (x0, y, x1, y + 1))
+            for t, (x0, y0, x1, y1) in enumerate(tiles)
+            for y in rng.choice(np.arange(y0, y1), min(rows_per_tile, y1 - y0), replace=False)
+        ]
+        calibration = np.unique(np.linspace(0, len(tiles) - 1, calibration_tiles).astype(np.int64))
+
+        def render_tile(tile: tuple[int, int, int, int]) -> tuple[np.ndarray, float]:
+            start_ns = time.perf_counter_ns()
+            pixels = estimate_camera.render_tile(scene, *tile)
+            return pixels, (time.perf_counter_ns() - start_ns) / 1e9
+
+        costs = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            results = list(executor.map(render_tile, [row for _, row in rows]))
+            for engine in engines:
+                estimate_camera.engine = engine
+                render_tile((0, 0, 1, 1))  # Compiled or loaded first
+                timed = list(executor.map(render_tile, [tiles[t] for t in calibration]))
+                seconds = np.array([tile_s for _, tile_s in timed])
+                rays = np.array([pixels[..., CH_RAYS].sum() for pixels, _ in timed])
+                # Ratio estimate of the seconds per ray and its variance
+                ray_s = seconds.sum() / rays.sum()
+                residual = seconds - ray_s * rays
+                variance = residual @ residual / max(len(rays) - 1, 1)
+                variance /= len(rays) * rays.mean() ** 2
+                costs[engine] = float(ray_s), float(variance)
+
+        pixels = np.concatenate([pixels[0] for pixels, _ in results])
+        rays_per_path = pixels[:, CH_RAYS] / pixels[:, CH_SAMPLES]
+        objects = pixels[:, CH_OBJECT].astype(np.int64)
+        kinds = np.where(objects >= 0, scene.kinds[np.maximum(objects, 0)].astype(np.int64), -1)
+        materials = {}
+        for name, kind in (*MATERIALS.items(), ('background', -1)):
+            hit = kinds == kind
+            if hit.any():
+                materials[name] = float(hit.mean()), float(rays_per_path[hit].mean())
+
+        # Mean rays per path of the rows of each tile, and its sampling variance from the
+        # variance of the paths around the mean of their tile
+        t = np.repeat([t for t, _ in rows], [x1 - x0 for _, (x0, _, x1, _) in rows])
+        sampled = np.bincount(t, minlength=len(tiles))
+        mean = np.bincount(t, weights=rays_per_path, minlength=len(tiles)) / sampled
+        deviation = rays_per_path - mean[t]
+        path_variance = deviation @ deviation / max(len(rays_per_path) - len(tiles), 1)
+        tile_pixels = np.array([(x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in tiles])
+        samples = tile_pixels * self.samples_per_pixel
+        estimate = RenderEstimate(
+            tiles,
+            samples * mean,
+            samples**2 * path_variance / sampled,
+            costs,
+            materials,
+            (time.perf_counter_ns() - start_perf_counter_ns) / 1e9,
+        )
+        logging.info('Estimated in %.2fs: %s', estimate.estimate_s, estimate)
+        return estimate
+
+    def render_tile(
+        self,
+        scene: Scene,
+        x0: int,
+        y0: int,
+        x1: int,
+        y1: int,
+        first_sample: int = 0,
+        frame_spp: int | None = None,
+    ) -> np.ndarray:
+        '''
+        Returns the (y1 - y0, x1 - x0, CHANNELS) averaged colors, samples taken and rays traced of
+        a tile, traced by the compiled kernel without the GIL or by the NumPy engine. The samples
+        are numbered from `first_sample`, so that successive passes over a tile draw new ones.
+        Passes that trace parts of a frame give its total `frame_spp` (default samples_per_pixel),
+        which sizes the grid of the stratified sampler, to draw the samples of a single pass.
+        '''
+        return self._trace_tile(
+            scene, x0, y0, x1, y1, first_sample, frame_spp, NO_TRACE, NO_TRACE_COUNT
+        )
+
+    def render_tile_traced(
+        self,
+        scene: Scene,
+        x0: int,
+        y0: int,
+        x1: int,
+        y1: int,
+        first_sample: int = 0,
+        frame_spp: int | None = None,
+        capacity: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns the render_tile pixels of a tile and the (rays, TRACE_COLUMNS) float32 segments
+        of all the rays traced for them: origin, direction, t of the hit (inf for a ray that
+        escapes) and the sphere hit (-1 for none). The trace starts at capacity rows, by default
+        a few per sample, and a tile whose rays overflow it is traced again at the exact size.
+        '''
+        if capacity is None:
+            first_spp = min(self.min_spp, self.max_spp) if self.tolerance > 0 else 0
+            samples = (y1 - y0) * (x1 - x0) * max(self.samples_per_pixel, first_spp)
+            capacity = samples * _TRACE_ROWS_PER_SAMPLE
+        trace = np.empty((max(capacity, 1), TRACE_COLUMNS), dtype=np.float32)
+        trace_count = np.zeros(1, dtype=np.int64)
+        pixels = self._trace_tile(
+            scene, x0, y0, x1, y1, first_sample, frame_spp, trace, trace_count
+        )
+        if trace_count[0] > len(trace):
+            # Rendering is deterministic, so the retrace gives the same pixels with all rays
+            trace = np.empty((trace_count[0], TRACE_COLUMNS), dtype=np.float32)
+            trace_count[0] = 0
+            pixels = self._trace_tile(
+                scene, x0, y0, x1, y1, first_sample, frame_spp, trace, trace_count
+            )
+        if trace_count[0] == len(trace):
+            return pixels, trace
+        return pixels, trace[: trace_count[0]].copy()
+
+    def _trace_tile(
+        self,
+        scene: Scene,
+        x0: int,
+        y0: int,
+        x1: int,
+        y1: int,
+        first_sample: int,
+        frame_spp: int | None,
+        trace: np.ndarray,
+        trace_count: np.ndarray,
+    ) -> np.ndarray:
+        '''render_tile recording the ray segments into the trace rows from trace_count[0] on.'''
+        if self.engine == 'numba':
+            enable()
+            render_tile = render_tile_kernel
+        else:
+            render_tile = render_tile_vectorized
+        pixels = np.empty((y1 - y0, x1 - x0, CHANNELS), dtype=np.float64)
+        render_tile(
+            self.params,
+            scene.spheres,
+            scene.kinds,
+            scene.props,
+            x0,
+            y0,
+            x1,
+            y1,
+            self.samples_per_pixel,
+            first_sample,
+            frame_spp if frame_spp is not None else self.samples_per_pixel,
+            self.max_depth,
+            self.rr_depth,
+            self.split_counts(),
+            self.min_spp,
+            self.max_spp,
+            float(self.tolerance),
+            SAMPLERS[self.sampler],
+            self.seed,
+            pixels,
+            trace,
+            trace_count,
+        )
+        return pixels
+
     def log_pixel(self, i: int, j: int):
         if i == 0:
             if j == 0:
@@ -177,13 +898,52 @@ class Camera:
                     s_per_line,
                 )
 
-    def log_done(self):
+    def log_tile(self, done: int, total: int):
+        elapsed_s = (time.perf_counter_ns() - self.start_perf_counter_ns) / 1e9
+        total_s = elapsed_s / done * total
+        left_s = total_s - elapsed_s
+        logging.info(
+            'Tiles remaining: %d, %02d:%02d < %02d:%02d < %02d:%02d',
+            total - done,
+            elapsed_s // 60,
+            elapsed_s % 60,
+            left_s // 60,
+            left_s % 60,
+            total_s // 60,
+            total_s % 60,
+        )
+
+    def log_done(self, framebuffer: np.ndarray | None = None):
         current_perf_counter_ns = time.perf_counter_ns()
         total_perf_counter_ns = current_perf_counter_ns - self.start_perf_counter_ns
         total_s = total_perf_counter_ns / 1e9
-        logging.info('Done. %02d:%02d', total_s // 60, total_s % 60)
+        if framebuffer is None:
+            logging.info('Done. %02d:%02d', total_s // 60, total_s % 60)
+            return
+        rays = framebuffer[..., CH_RAYS].sum()
+        logging.info(
+            'Done. %02d:%02d, %.2f rays per path, %.0f rays/s',
+            total_s // 60,
+            total_s % 60,
+            rays / max(framebuffer[..., CH_SAMPLES].sum(), 1),
+            rays / max(total_s, 1e-9),
+        )
 
     def render(self, world: Hittable, image_file: Path = Path('image.ppm')):
+        if self.engine == 'numba':
+            enable()
+        if self.denoise or self.aux:
+            # The filter and the aux buffers need the whole frame, so pixels go to a framebuffer
+            # instead of the file
+            framebuffer = self.new_framebuffer()
+            self.start_perf_counter_ns = time.perf_counter_ns()
+            for j in range(self.image_height):
+                for i in range(self.image_width):
+                    self.render_pixel(i, j, world, framebuffer[j, i])
+            self.write_image(framebuffer, image_file)
+            self.log_done()
+            return
+
         f = image_file.open('w', encoding='UTF-8')
         f.write(self.ppm_header)
 
@@ -196,24 +956,94 @@ class Camera:
         f.close()
         self.log_done()
 
+    def write_image(self, framebuffer: np.ndarray, image_file: Path):
+        '''Writes the framebuffer colors as a PPM image, denoised first if the camera denoises.'''
+
+        if self.aux:
+            # First-hit buffers, e.g. image.aux.npz
+            buffers = aux_buffers(framebuffer)
+            aux_file = image_file.with_suffix('.aux.npz')
+            write_atomic(aux_file, lambda f: np.savez(f, **buffers), binary=True)
+
+        if self.denoise:
+            framebuffer = denoise_framebuffer(framebuffer)
+
+        def write(f: io.TextIOWrapper):
+            f.write(self.ppm_header)
+            write_image(framebuffer, f)
+
+        write_atomic(image_file, write)
+
+        if self.tolerance > 0:
+            # Samples-used map of adaptive sampling, e.g. image.samples.npy
+            samples = framebuffer[..., CH_SAMPLES].astype(np.uint32)
+            samples_file = image_file.with_suffix('.samples.npy')
+            write_atomic(samples_file, lambda f: np.save(f, samples), binary=True)
+
+    def render_geometry(
+        self,
+        world: Hittable | Scene,
+        image_file: Path = Path('image.ppm'),
+        max_workers: int | None = None,
+    ) -> np.ndarray:
+        '''
+        Layout preview: traces only the primary ray of one sample per pixel, writes the first-hit
+        albedo lit from above as the image, with the aux buffers, and returns the framebuffer.
+        '''
+
+        scene = Scene.from_hittable(world)
+        geometry_camera = copy.copy(self)
+        geometry_camera.samples_per_pixel = 1
+        geometry_camera.max_depth = 1
+        geometry_camera.tolerance = 0
+        geometry_camera.denoise = False
+        geometry_camera.aux = True
+        framebuffer = self.new_framebuffer()
+
+        self.start_perf_counter_ns = time.perf_counter_ns()
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {
+                executor.submit(geometry_camera.render_tile, scene, *tile): tile
+                for tile in self.tiles()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                x0, y0, x1, y1 = futures[future]
+                framebuffer[y0:y1, x0:x1] = future.result()
+
+        hit = framebuffer[..., CH_INV_DEPTH] > 0
+        light = np.where(hit, 0.5 + 0.5 * framebuffer[..., CH_NORMAL + 1], 1.0)
+        albedo = framebuffer[..., CH_ALBEDO : CH_ALBEDO + 3]
+        framebuffer[..., CH_COLOR : CH_COLOR + 3] = albedo * light[..., np.newaxis]
+        geometry_camera.write_image(framebuffer, image_file)
+        self.log_done(framebuffer)
+        return framebuffer
+
     def render_threading(
-        self, world: Hittable, image_file: Path = Path('image.ppm'), num_threads: int = 4
+        self, world: Hittable | Scene, image_file: Path = Path('image.ppm'), num_threads: int = 4
     ):
-        task_queue: queue.Queue[tuple[int, int]] = queue.Queue()
-        result_queue: queue.Queue[tuple[int, int, Color]] = queue.Queue()
+        scene = Scene.from_hittable(world)
+        framebuffer = self.new_framebuffer()
+        task_queue: queue.Queue[tuple[int, int, int, int]] = queue.Queue()
+        tiles = self.tiles()
+        done = 0
+        done_lock = threading.Lock()
 
         def renderer():
+            nonlocal done
             while True:
                 try:
-                    j, i = task_queue.get(timeout=1)
+                    x0, y0, x1, y1 = task_queue.get(timeout=1)
                 except queue.Empty:
                     break
-                result_queue.put(self.render_pixel(i, j, world))
+                # Tiles never overlap, so workers write their own framebuffer region directly.
+                framebuffer[y0:y1, x0:x1] = self.render_tile(scene, x0, y0, x1, y1)
+                with done_lock:
+                    done += 1
+                    self.log_tile(done, len(tiles))
                 task_queue.task_done()
 
-        for j in range(self.image_height):
-            for i in range(self.image_width):
-                task_queue.put((j, i))
+        for tile in tiles:
+            task_queue.put(tile)
 
         threads = [threading.Thread(target=renderer, daemon=True) for _ in range(num_threads)]
         self.start_perf_counter_ns = time.perf_counter_ns()
@@ -224,36 +1054,298 @@ class Camera:
         for thread in threads:
             thread.join()
 
-        j_i_pixel_colors = []
-        while not result_queue.empty():
-            j_i_pixel_colors.append(result_queue.get())
-        j_i_pixel_colors.sort()
+        self.write_image(framebuffer, image_file)
+        self.log_done(framebuffer)
 
-        with image_file.open('w', encoding='UTF-8') as f:
-            f.write(self.ppm_header)
-            for *_, pixel_color in j_i_pixel_colors:
-                write_color(pixel_color, f)
+    def render_concurrent(
+        self,
+        world: Hittable | Scene,
+        image_file: Path = Path('image.ppm'),
+        max_workers: int | None = None,
+        checkpoint_file: Path | None = None,
+        checkpoint_interval: float = 300,
+        estimate: RenderEstimate | None = None,
+    ) -> np.ndarray:
+        '''
+        Traces the tiles on a thread pool, writes the image and returns the framebuffer. With a
+        `checkpoint_file`, the finished tiles are saved there every `checkpoint_interval` seconds,
+        when the render fails and when it is done, for Camera.resume. With an `estimate` of the
+        render, the slowest tiles are started first.
+        '''
 
-        self.log_done()
+        checkpoint = self.new_checkpoint(Scene.from_hittable(world))
+        return self.render_checkpoint(
+            checkpoint, image_file, max_workers, checkpoint_file, checkpoint_interval, estimate
+        )
+
+    @classmethod
+    def resume(
+        cls,
+        checkpoint_file: Path,
+        image_file: Path = Path('image.ppm'),
+        samples_per_pixel: int | None = None,
+        max_workers: int | None = None,
+        checkpoint_interval: float = 300,
+    ) -> np.ndarray:
+        '''
+        Continues the render saved in a checkpoint file by render_concurrent, tracing the tiles
+        it had not finished, and updates the checkpoint as it goes. With more `samples_per_pixel`
+        than the saved render, every tile takes the missing samples on top of the ones it has.
+        '''
+
+        checkpoint = Checkpoint.load(checkpoint_file)
+        settings = dict(checkpoint.settings)
+        if samples_per_pixel is not None:
+            settings['samples_per_pixel'] = samples_per_pixel
+        camera = cls.from_settings(settings)
+        checkpoint.settings = camera.settings()
+        logging.info(
+            'Resuming %s: %d of %d tiles have %d spp',
+            checkpoint_file,
+            np.count_nonzero(checkpoint.tile_spp >= camera.samples_per_pixel),
+            len(checkpoint.tile_spp),
+            camera.samples_per_pixel,
+        )
+        return camera.render_checkpoint(
+            checkpoint, image_file, max_workers, checkpoint_file, checkpoint_interval
+        )
+
+    def render_checkpoint(
+        self,
+        checkpoint: Checkpoint,
+        image_file: Path | None = None,
+        max_workers: int | None = None,
+        checkpoint_file: Path | None = None,
+        checkpoint_interval: float = 300,
+        estimate: RenderEstimate | None = None,
+    ) -> np.ndarray:
+        '''
+        Traces the tiles of a checkpoint short of samples_per_pixel into its framebuffer, see
+        render_concurrent, and writes the image unless `image_file` is None.
+        '''
+
+        scene = checkpoint.scene
+        framebuffer = checkpoint.framebuffer
+        tile_spp = checkpoint.tile_spp
+        next_samples = checkpoint.next_samples
+        tiles = self.tiles()
+
+        def render_tile(t: int) -> np.ndarray:
+            camera = self
+            if tile_spp[t]:
+                camera = copy.copy(self)
+                camera.samples_per_pixel -= int(tile_spp[t])
+            # Stratified over the full samples_per_pixel, the grid cells a tile took stay taken
+            return camera.render_tile(
+                scene, *tiles[t], int(next_samples[t]), self.samples_per_pixel
+            )
 
-    def render_concurrent(
-        self, world: Hittable, image_file: Path = Path('image.ppm'), max_workers: int | None = None
-    ):
         self.start_perf_counter_ns = time.perf_counter_ns()
-        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
-            futures = [
-                executor.submit(self.render_pixel, i, j, world)
-                for j in range(self.image_height)
-                for i in range(self.image_width)
-            ]
-            j_i_pixel_colors = [
-                future.result() for future in concurrent.futures.as_completed(futures)
-            ]
+        last_checkpoint_ns = self.start_perf_counter_ns
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        try:
+            order = estimate.order() if estimate is not None else range(len(tiles))
+            futures = {
+                executor.submit(render_tile, t): t
+                for t in order
+                if tile_spp[t] < self.samples_per_pixel
+            }
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                t = futures[future]
+                x0, y0, x1, y1 = tiles[t]
+                pixels = future.result()
+                if tile_spp[t]:
+                    merge_samples(framebuffer[y0:y1, x0:x1], pixels)
+                else:
+                    framebuffer[y0:y1, x0:x1] = pixels
+                tile_spp[t] = self.samples_per_pixel
+                # Adaptive pixels take unequal counts: later samples start past the largest one
+                next_samples[t] += int(pixels[..., CH_SAMPLES].max())
+                self.log_tile(done, len(futures))
 
-        j_i_pixel_colors.sort()
-        with image_file.open('w', encoding='UTF-8') as f:
-            f.write(self.ppm_header)
-            for *_, pixel_color in j_i_pixel_colors:
-                write_color(pixel_color, f)
+                now_ns = time.perf_counter_ns()
+                if (
+                    checkpoint_file is not None
+                    and now_ns - last_checkpoint_ns >= checkpoint_interval * 1e9
+                ):
+                    checkpoint.save(checkpoint_file)
+                    last_checkpoint_ns = now_ns
+        except BaseException:
+            # Only this thread updates the checkpoint, so it is consistent whatever went wrong,
+            # and a failure to save it must not hide what did
+            if checkpoint_file is not None:
+                try:
+                    checkpoint.save(checkpoint_file)
+                except OSError as error:
+                    logging.error('Could not save checkpoint %s: %s', checkpoint_file, error)
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+        if checkpoint_file is not None:
+            checkpoint.save(checkpoint_file)
+
+        if image_file is not None:
+            self.write_image(framebuffer, image_file)
+        self.log_done(framebuffer)
+        return framebuffer
+
+    async def render_async(
+        self,
+        world: Hittable | Scene,
+        max_workers: int | None = None,
+        max_pending: int | None = None,
+        executor: concurrent.futures.Executor | None = None,
+    ) -> AsyncIterator[tuple[tuple[int, int, int, int], np.ndarray]]:
+        '''
+        Yields ((x0, y0, x1, y1), pixels) as tiles complete, tracing them off the event loop.
+        At most `max_pending` tiles are in flight, so a slow consumer pauses the render.
+        When the camera denoises, a last item holds the whole denoised frame.
+        '''
+
+        loop = asyncio.get_running_loop()
+        own_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        if max_pending is None:
+            max_pending = 2 * (max_workers or os.cpu_count() or 1)
+
+        tiles = iter(self.tiles())
+        pending: dict[asyncio.Future, tuple[int, int, int, int]] = {}
+        framebuffer = self.new_framebuffer() if self.denoise else None
+        try:
+            scene = await loop.run_in_executor(executor, Scene.from_hittable, world)
+            self.start_perf_counter_ns = time.perf_counter_ns()
+            while True:
+                for tile in tiles:
+                    future = loop.run_in_executor(executor, self.render_tile, scene, *tile)
+                    pending[future] = tile
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    (x0, y0, x1, y1), pixels = pending.pop(future), future.result()
+                    if framebuffer is not None:
+                        framebuffer[y0:y1, x0:x1] = pixels
+                    yield (x0, y0, x1, y1), pixels
+
+            if framebuffer is not None:
+                denoised = await loop.run_in_executor(executor, denoise_framebuffer, framebuffer)
+                yield (0, 0, self.image_width, self.image_height), denoised
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False, cancel_futures=True)
 
         self.log_done()
+
+    def render_progressive(
+        self,
+        world: Hittable | Scene,
+        image_file: Path = Path('image.ppm'),
+        time_budget: float | None = None,
+        target_spp: int | None = None,
+        write_interval: float = 5,
+        max_workers: int | None = None,
+    ) -> np.ndarray:
+        '''
+        Renders the whole frame one sample per pixel at a time into a float accumulation buffer
+        until `time_budget` seconds have passed or `target_spp` passes are done (by default the
+        camera samples_per_pixel when neither is given). The current image replaces image_file
+        atomically every `write_interval` seconds. Pass n traces sample number n of every pixel,
+        so n passes draw the same samples as a render with n samples per pixel. The stratified
+        sampler lays its grid out for target_spp samples, or the camera samples_per_pixel
+        without one.
+
+        Tiles are only handed to idle workers, so at the deadline no new tile starts and the
+        budget is overrun by at most the time one worker takes to trace one tile pass, or by the
+        first pass if it takes longer than the budget: it always completes, so that no pixel is
+        left without a sample. The tiles of the unfinished passes that completed are kept, so
+        every pixel is the mean of the samples it actually received.
+        '''
+
+        if time_budget is None and target_spp is None:
+            target_spp = self.samples_per_pixel
+        frame_spp = target_spp if target_spp is not None else self.samples_per_pixel
+        scene = Scene.from_hittable(world)
+        tiles = self.tiles()
+        # Sample-weighted sums of the mean channels (colors and first-hit features), sample
+        # counts and ray counts
+        accumulation = self.new_framebuffer()
+
+        pass_camera = copy.copy(self)
+        pass_camera.samples_per_pixel = 1
+        pass_camera.tolerance = 0
+
+        self.start_perf_counter_ns = time.perf_counter_ns()
+        deadline_ns = (
+            self.start_perf_counter_ns + int(time_budget * 1e9) if time_budget is not None else None
+        )
+        last_write_ns = self.start_perf_counter_ns
+        passes = 0
+
+        def resolve() -> np.ndarray:
+            framebuffer = accumulation.copy()
+            counts = np.maximum(accumulation[..., CH_SAMPLES : CH_SAMPLES + 1], 1)
+            framebuffer[..., MEAN_CHANNELS] /= counts
+            return framebuffer
+
+        workers = max_workers or os.cpu_count() or 1
+        # Tile passes are numbered pass-major: tile pass k is tile k % len(tiles) of pass
+        # k // len(tiles)
+        last = target_spp * len(tiles) if target_spp is not None else None
+        submitted = 0
+        pending: dict[concurrent.futures.Future, tuple[int, tuple[int, int, int, int]]] = {}
+        completed = collections.Counter()  # Tiles done per pass
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+        try:
+            while True:
+                deadline_hit = deadline_ns is not None and time.perf_counter_ns() >= deadline_ns
+                while len(pending) < workers and (last is None or submitted < last):
+                    n, t = divmod(submitted, len(tiles))
+                    if deadline_hit and n > 0:
+                        break
+                    future = executor.submit(
+                        pass_camera.render_tile, scene, *tiles[t], n, frame_spp
+                    )
+                    pending[future] = n, tiles[t]
+                    submitted += 1
+                if not pending:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    n, (x0, y0, x1, y1) = pending.pop(future)
+                    pixels = future.result()
+                    samples = pixels[..., CH_SAMPLES : CH_SAMPLES + 1]
+                    region = accumulation[y0:y1, x0:x1]
+                    region[..., MEAN_CHANNELS] += pixels[..., MEAN_CHANNELS] * samples
+                    region[..., CH_SAMPLES] += samples[..., 0]
+                    missed = region[..., CH_OBJECT] < 0  # No earlier pass hit a sphere
+                    region[..., CH_OBJECT][missed] = pixels[..., CH_OBJECT][missed]
+                    region[..., CH_RAYS] += pixels[..., CH_RAYS]
+                    completed[n] += 1
+
+                while completed[passes] == len(tiles):
+                    passes += 1
+                    elapsed_s = (time.perf_counter_ns() - self.start_perf_counter_ns) / 1e9
+                    logging.info('Pass %d done, %02d:%02d', passes, elapsed_s // 60, elapsed_s % 60)
+                now_ns = time.perf_counter_ns()
+                if now_ns - last_write_ns >= write_interval * 1e9:
+                    self.write_image(resolve(), image_file)
+                    last_write_ns = now_ns
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        framebuffer = resolve()
+        self.write_image(framebuffer, image_file)
+        logging.info(
+            '%d full passes, %.2f spp on average', passes, accumulation[..., CH_SAMPLES].mean()
+        )
+        self.log_done(accumulation)
+        return framebuffer
@@ -34,3 +34,24 @@ def write_color(pixel_color: Color, f: io.TextIOWrapper):
 
     # Write out the pixel color components.
     f.write(f'{rbyte} {gbyte} {bbyte}\n')
+
+
+def to_bytes(framebuffer: np.ndarray) -> np.ndarray:
+    '''Vectorized color-to-byte conversion of write_color over a framebuffer of linear colors.'''
+    # Apply a linear to gamma transform for gamma 2
+    gamma = np.sqrt(np.maximum(framebuffer[..., :3], 0))
+
+    # Translate the [0,1] component values to the byte range [0,255].
+    intensity = Interval(0, 0.999)
+    return (255.999 * intensity.clamp(gamma)).astype(np.uint8)
+
+
+def write_image(framebuffer: np.ndarray, f: io.TextIOWrapper):
+    '''Writes the pixel rows of a (height, width, 3) framebuffer as ASCII PPM body lines.'''
+    np.savetxt(f, to_bytes(framebuffer).reshape(-1, 3), fmt='%d')
+
+
+def encode_ppm(framebuffer: np.ndarray) -> bytes:
+    '''Returns a complete binary (P6) PPM file of a (height, width, 3) framebuffer.'''
+    height, width, _ = framebuffer.shape
+    return f'P6\n{width} {height}\n255\n'.encode('ascii') + to_bytes(framebuffer).tobytes()
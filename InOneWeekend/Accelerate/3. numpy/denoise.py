@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import numpy as np
+
+from jit import njit
+from kernel import CH_ALBEDO, CH_COLOR, CH_INV_DEPTH, CH_MOMENT2, CH_NORMAL, CH_SAMPLES
+
+# Edge-avoiding a-trous wavelet filter (Dammertz et al. 2010) with the variance-guided luminance
+# weight of SVGF (Schied et al. 2017). Each pass convolves the image with a 5x5 B3-spline kernel
+# whose taps are 2^pass pixels apart, weighted down across normal, depth and luminance edges.
+# The filter runs on the irradiance (color over first-hit albedo), so that texture and material
+# edges come back sharp when the albedo is multiplied in again. The guides are the first-hit
+# features the tile kernels average over the same samples as the color.
+
+_B3 = np.array([1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16])
+
+
+@njit(nogil=True)
+def _luminance(r: float, g: float, b: float) -> float:
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+@njit(nogil=True, signatures=('(float64[:, ::1], float64[:, ::1])',))
+def _box_filter(values: np.ndarray, out: np.ndarray):
+    """Mean over the 3x3 neighborhood of each pixel"""
+    height, width = values.shape
+    for y in range(height):
+        for x in range(width):
+            total = 0.0
+            n = 0
+            for yy in range(max(y - 1, 0), min(y + 2, height)):
+                for xx in range(max(x - 1, 0), min(x + 2, width)):
+                    total += values[yy, xx]
+                    n += 1
+            out[y, x] = total / n
+
+
+@njit(
+    nogil=True,
+    signatures=(
+        '(float64[:, :, ::1], float64[:, ::1], float64[:, :, ::1], float64[:, ::1],'
+        ' float64[:, :, ::1], int64, float64, float64, float64, float64[:, :, ::1],'
+        ' float64[:, ::1])',
+    ),
+)
+def _atrous_pass(
+    irradiance: np.ndarray,
+    variance: np.ndarray,
+    normal: np.ndarray,
+    depth: np.ndarray,
+    depth_gradient: np.ndarray,
+    step: int,
+    sigma_color: float,
+    sigma_normal: float,
+    sigma_depth: float,
+    out_irradiance: np.ndarray,
+    out_variance: np.ndarray,
+):
+    """One a-trous pass with taps `step` pixels apart, filtering the variance alongside"""
+    height, width = irradiance.shape[:2]
+    for y in range(height):
+        for x in range(width):
+            zp = depth[y, x]
+            lp = _luminance(irradiance[y, x, 0], irradiance[y, x, 1], irradiance[y, x, 2])
+            color_scale = sigma_color * np.sqrt(variance[y, x]) + 1e-6
+            r = g = b = var = total = 0.0
+            for ky in range(5):
+                yy = y + (ky - 2) * step
+                if yy < 0 or yy >= height:
+                    continue
+                for kx in range(5):
+                    xx = x + (kx - 2) * step
+                    if xx < 0 or xx >= width:
+                        continue
+                    zq = depth[yy, xx]
+                    if ky == 2 and kx == 2:
+                        w = 1.0
+                    elif np.isinf(zp) or np.isinf(zq):
+                        if not (np.isinf(zp) and np.isinf(zq)):
+                            continue  # Sky against geometry
+                        w = 1.0
+                    else:
+                        # Mean normals shorten where a pixel covers an edge
+                        cos_normal = (
+                            normal[y, x, 0] * normal[yy, xx, 0]
+                            + normal[y, x, 1] * normal[yy, xx, 1]
+                            + normal[y, x, 2] * normal[yy, xx, 2]
+                        )
+                        w = max(cos_normal, 0.0) ** sigma_normal
+                        # Depth difference relative to the one expected along the local plane
+                        expected = abs(
+                            depth_gradient[y, x, 0] * (kx - 2) * step
+                            + depth_gradient[y, x, 1] * (ky - 2) * step
+                        )
+                        w *= np.exp(-abs(zp - zq) / (sigma_depth * expected + 1e-3 * zp))
+                    q = irradiance[yy, xx]
+                    w *= np.exp(-abs(lp - _luminance(q[0], q[1], q[2])) / color_scale)
+                    w *= _B3[ky] * _B3[kx]
+                    r += w * q[0]
+                    g += w * q[1]
+                    b += w * q[2]
+                    var += w * w * variance[yy, xx]
+                    total += w
+            out_irradiance[y, x, 0] = r / total
+            out_irradiance[y, x, 1] = g / total
+            out_irradiance[y, x, 2] = b / total
+            out_variance[y, x] = var / (total * total)
+
+
+def denoise_framebuffer(
+    framebuffer: np.ndarray,
+    passes: int = 3,
+    sigma_color: float = 4.0,
+    sigma_normal: float = 16.0,
+    sigma_depth: float = 1.0,
+) -> np.ndarray:
+    '''
+    Returns a copy of the framebuffer with its color channels filtered by `passes` a-trous passes
+    guided by its first-hit albedo, normal and depth channels. Larger sigmas blur more across
+    luminance, normal (an exponent, so smaller blurs more) and depth edges.
+    '''
+
+    albedo = np.maximum(framebuffer[..., CH_ALBEDO : CH_ALBEDO + 3], 1e-3)
+    irradiance = framebuffer[..., CH_COLOR : CH_COLOR + 3] / albedo
+
+    # Variance of the luminance mean of each pixel from its samples, scaled like the irradiance
+    # and smoothed over 3x3 pixels, as a single pixel estimate is noisy itself. Pixels with a
+    # single sample fall back to the variance of the irradiance over their neighborhood.
+    weights = np.array([0.2126, 0.7152, 0.0722])
+    luminance = framebuffer[..., CH_COLOR : CH_COLOR + 3] @ weights
+    samples = framebuffer[..., CH_SAMPLES]
+    variance = np.maximum(framebuffer[..., CH_MOMENT2] - luminance**2, 0)
+    variance /= np.maximum(samples - 1, 1) * np.maximum(albedo @ weights, 1e-3) ** 2
+    _box_filter(variance.copy(), variance)
+    if (samples < 2).any():
+        irradiance_luminance = irradiance @ weights
+        mean = np.empty_like(variance)
+        mean_sq = np.empty_like(variance)
+        _box_filter(irradiance_luminance, mean)
+        _box_filter(irradiance_luminance**2, mean_sq)
+        variance = np.where(samples < 2, np.maximum(mean_sq - mean**2, 0), variance)
+
+    normal = np.ascontiguousarray(framebuffer[..., CH_NORMAL : CH_NORMAL + 3])
+    inv_depth = framebuffer[..., CH_INV_DEPTH]
+    hit = inv_depth > 0
+    depth = np.full(inv_depth.shape, np.inf)
+    np.divide(1.0, inv_depth, out=depth, where=hit)
+    depth_gradient = np.stack(np.gradient(np.where(hit, depth, 0.0), axis=(1, 0)), axis=-1)
+    depth_gradient[~hit] = 0.0
+
+    out_irradiance = np.empty_like(irradiance)
+    out_variance = np.empty_like(variance)
+    for n in range(passes):
+        _atrous_pass(
+            irradiance,
+            variance,
+            normal,
+            depth,
+            depth_gradient,
+            1 << n,
+            float(sigma_color),
+            float(sigma_normal),
+            float(sigma_depth),
+            out_irradiance,
+            out_variance,
+        )
+        irradiance, out_irradiance = out_irradiance, irradiance
+        variance, out_variance = out_variance, variance
+
+    denoised = framebuffer.copy()
+    denoised[..., CH_COLOR : CH_COLOR + 3] = irradiance * albedo
+    return denoised
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import collections
+import itertools
+import json
+import logging
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from camera import Camera, RenderEstimate
+from hittable import Hittable
+from jit import warm_up
+from kernel import CHANNELS
+from main import random_world
+from scene import Scene
+from vector import Point3, Vector3
+
+# Wire format: every message is a 4-byte big-endian length, a JSON header of that length and
+# header['size'] bytes of binary payload (the binary scene file or the pixels of a tile).
+_LENGTH = struct.Struct('!I')
+_MAX_HEADER = 1 << 16  # Bytes of a JSON header the coordinator accepts
+
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b''):
+    data = json.dumps(dict(header, size=len(payload))).encode('utf-8')
+    sock.sendall(_LENGTH.pack(len(data)) + data + payload)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock: socket.socket, max_size: int | None = None) -> tuple[dict, bytes]:
+    '''
+    Returns the header and payload of the next message. With a `max_size`, the header and
+    payload sizes are checked before they are read and a ValueError rejects larger ones.
+    '''
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    if max_size is not None and length > _MAX_HEADER:
+        raise ValueError(f'Header of {length} bytes')
+    header = json.loads(_recv_exact(sock, length))
+    if not isinstance(header, dict):
+        raise ValueError(f'Header is not an object: {header!r}')
+    size = header['size']
+    if not isinstance(size, int) or size < 0 or (max_size is not None and size > max_size):
+        raise ValueError(f'Payload of {size!r} bytes')
+    return header, _recv_exact(sock, size)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    server: _Server
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        leases: set[int] = set()  # Leases held by this connection
+        coordinator.connect()
+        try:
+            while True:
+                header, payload = _recv(self.request, coordinator.max_payload)
+                if header['type'] == 'hello':
+                    _send(
+                        self.request,
+                        {'type': 'scene', 'camera': coordinator.camera.settings()},
+                        coordinator.scene_bytes,
+                    )
+                elif header['type'] == 'lease':
+                    reply = coordinator.lease()
+                    if reply['type'] == 'tile':
+                        leases.add(reply['lease'])
+                    _send(self.request, reply)
+                elif header['type'] == 'result':
+                    coordinator.complete(header['lease'], header['tile'], payload)
+                    leases.discard(header['lease'])
+                    _send(self.request, {'type': 'ok'})
+                else:
+                    raise ValueError(f'Unknown message type: {header["type"]!r}')
+        except (ConnectionError, OSError, struct.error):
+            pass
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as error:
+            # A malformed message drops the connection, its leases go back to the queue
+            logging.warning('Closing %s:%d after a bad message: %s', *self.client_address, error)
+        finally:
+            # A dead worker's tiles go back to the queue without waiting for the lease timeout.
+            coordinator.release(leases)
+            coordinator.disconnect()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], coordinator: Coordinator):
+        super().__init__(address, _Handler)
+        self.coordinator = coordinator
+
+
+class Coordinator:
+    '''
+    Serves the tiles of one frame to farm workers over TCP and assembles their results.
+
+    The scene is serialized once and sent to each worker on connect. Tiles are leased to one
+    worker at a time; a lease that is not completed within `lease_timeout` seconds, or whose
+    worker disconnects, is handed out again. With an `estimate` of the render, the slowest tiles
+    are leased first. Once the frame is complete, every worker that asks for a lease is told it
+    is done, and the server closes when they have all disconnected.
+    '''
+
+    def __init__(
+        self,
+        world: Hittable | Scene,
+        camera: Camera,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        lease_timeout: float = 60,
+        estimate: RenderEstimate | None = None,
+    ):
+        self.camera = camera
+        self.scene_bytes = Scene.from_hittable(world).to_bytes()
+        self.lease_timeout = lease_timeout
+        self.framebuffer = camera.new_framebuffer()
+
+        self.lock = threading.Lock()
+        tiles = camera.tiles()
+        self.tiles = set(tiles)
+        # Bytes of the pixels of the largest tile, the largest message a worker sends
+        self.max_payload = max((y1 - y0) * (x1 - x0) for x0, y0, x1, y1 in tiles) * CHANNELS * 8
+        if estimate is not None:
+            tiles = [tiles[t] for t in estimate.order()]
+        self.pending = collections.deque(tiles)
+        self.total = len(self.pending)
+        self.leases: dict[int, tuple[tuple[int, int, int, int], float]] = {}
+        self.done: set[tuple[int, int, int, int]] = set()
+        self.lease_ids = itertools.count()
+        self.finished = threading.Event()
+        self.connections = 0  # Open worker connections
+        self.disconnected = threading.Condition(self.lock)
+
+        self.server = _Server((host, port), self)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.server.server_address[:2]
+
+    def lease(self) -> dict:
+        '''Returns the next tile message for a worker, or a wait / done message.'''
+        with self.lock:
+            now = time.monotonic()
+            for lease_id, (tile, deadline) in list(self.leases.items()):
+                if deadline < now:
+                    logging.warning('Lease %d of tile %s timed out', lease_id, tile)
+                    del self.leases[lease_id]
+                    self.pending.append(tile)
+
+            while self.pending:
+                tile = self.pending.popleft()
+                if tile in self.done:
+                    continue
+                lease_id = next(self.lease_ids)
+                self.leases[lease_id] = tile, now + self.lease_timeout
+                return {'type': 'tile', 'lease': lease_id, 'tile': tile}
+
+            if self.finished.is_set():
+                return {'type': 'done'}
+            return {'type': 'wait', 'delay': min(1.0, self.lease_timeout / 4)}
+
+    def complete(self, lease_id: int, tile: list[int], payload: bytes):
+        '''
+        Stores the pixels of a leased tile. A ValueError rejects a tile that is not one of the
+        frame, or a payload that is not its pixels.
+        '''
+        if not isinstance(tile, list) or tuple(tile) not in self.tiles:
+            raise ValueError(f'Unknown tile: {tile!r}')
+        x0, y0, x1, y1 = tile
+        if len(payload) != (y1 - y0) * (x1 - x0) * CHANNELS * 8:
+            raise ValueError(f'Payload of {len(payload)} bytes for tile {tile}')
+        with self.lock:
+            self.leases.pop(lease_id, None)
+            if (x0, y0, x1, y1) in self.done:
+                return  # A reassigned tile finished twice
+            pixels = np.frombuffer(payload, dtype=np.float64).reshape(y1 - y0, x1 - x0, CHANNELS)
+            self.framebuffer[y0:y1, x0:x1] = pixels
+            self.done.add((x0, y0, x1, y1))
+            self.camera.log_tile(len(self.done), self.total)
+            if len(self.done) == self.total:
+                self.finished.set()
+
+    def connect(self):
+        with self.lock:
+            self.connections += 1
+
+    def disconnect(self):
+        with self.lock:
+            self.connections -= 1
+            self.disconnected.notify_all()
+
+    def release(self, lease_ids: set[int]):
+        with self.lock:
+            for lease_id in lease_ids:
+                lease = self.leases.pop(lease_id, None)
+                if lease is not None:
+                    logging.warning('Worker of tile %s disconnected', lease[0])
+                    self.pending.appendleft(lease[0])
+
+    def render(self, image_file: Path | None = None) -> np.ndarray:
+        '''Serves tiles until the frame is complete and returns its framebuffer.'''
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.camera.start_perf_counter_ns = time.perf_counter_ns()
+        thread.start()
+        logging.info('Coordinator listening on %s:%d', *self.address)
+        try:
+            self.finished.wait()
+            # Waiting workers ask for a lease again within their delay and get their done message.
+            # A worker still on a reassigned tile is given a lease timeout to finish it.
+            with self.disconnected:
+                if not self.disconnected.wait_for(
+                    lambda: self.connections == 0, self.lease_timeout
+                ):
+                    logging.warning('Closing %d worker connections', self.connections)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            thread.join()
+
+        if image_file is not None:
+            self.camera.write_image(self.framebuffer, image_file)
+        self.camera.log_done(self.framebuffer)
+        return self.framebuffer
+
+
+def run_worker(host: str, port: int, retry_s: float = 10):
+    '''Renders leased tiles for a coordinator until it reports the frame is done.'''
+    warm_up()
+    deadline = time.monotonic() + retry_s
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+    with sock:
+        _send(sock, {'type': 'hello'})
+        header, payload = _recv(sock)
+        camera = Camera.from_settings(header['camera'])
+        # Writable views of the payload, the compiled kernels take read-only arrays as a new type
+        scene = Scene.from_buffer(bytearray(payload))
+
+        waiting = False
+        while True:
+            try:
+                _send(sock, {'type': 'lease'})
+                header, _ = _recv(sock)
+            except ConnectionError:
+                if not waiting:
+                    raise
+                # The coordinator only closes a waiting worker's connection once the frame is done
+                logging.info('Coordinator closed the connection, the frame is done')
+                return
+            waiting = header['type'] == 'wait'
+            if header['type'] == 'done':
+                return
+            if header['type'] == 'wait':
+                time.sleep(header['delay'])
+                continue
+            pixels = camera.render_tile(scene, *header['tile'])
+            _send(
+                sock,
+                {'type': 'result', 'lease': header['lease'], 'tile': header['tile']},
+                pixels.tobytes(),
+            )
+            _recv(sock)
+
+
+def spawn_local_workers(address: tuple[str, int], count: int) -> list[subprocess.Popen]:
+    '''Starts `count` worker processes on this machine for a coordinator address.'''
+    host, port = address
+    return [
+        subprocess.Popen(
+            [sys.executable, Path(__file__).name, 'work', host, str(port)],
+            cwd=Path(__file__).parent,
+        )
+        for _ in range(count)
+    ]
+
+
+def main():
+    args = sys.argv[1:]
+    public = '--public' in args
+    if public:
+        args.remove('--public')
+    if len(args) == 3 and args[0] == 'work' and not public:
+        logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+        run_worker(args[1], int(args[2]))
+    elif len(args) in (2, 3, 4) and args[0] == 'serve':
+        logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+        port = int(args[1])
+        image_file = Path(args[2]) if len(args) > 2 else Path('image.ppm')
+        local_workers = int(args[3]) if len(args) > 3 else 0
+
+        cam = Camera(
+            aspect_ratio=16 / 9,
+            image_width=320,
+            samples_per_pixel=10,
+            max_depth=5,
+            vfov=20,
+            lookfrom=Point3(13, 2, 3),
+            lookat=Point3(0, 0, 0),
+            vup=Vector3(0, 1, 0),
+            defocus_angle=0.6,
+            focus_dist=10,
+        )
+        # The protocol has no authentication: only listen on other machines' reach when asked
+        host = '0.0.0.0' if public else '127.0.0.1'
+        coordinator = Coordinator(random_world(), cam, host=host, port=port)
+        workers = spawn_local_workers(('127.0.0.1', coordinator.address[1]), local_workers)
+        coordinator.render(image_file)
+        for worker in workers:
+            worker.wait()
+    else:
+        print('Help: python farm.py serve [--public] port [image.ppm] [local_workers]')
+        print('      python farm.py work host port')
+        print('      --public listens on all interfaces instead of 127.0.0.1, with no')
+        print('      authentication: only on a trusted network')
+
+
+if __name__ == '__main__':
+    main()
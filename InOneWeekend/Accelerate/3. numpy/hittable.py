@@ -17,12 +17,14 @@ class HitRecord:
         mat: Material | None = None,
         t: float | None = None,
         front_face: bool | None = None,
+        obj: Hittable | None = None,
     ):
         self.p = p if p is not None else Point3()
         self.normal = normal if normal is not None else Vector3()
         self.mat = mat if mat is not None else Material()
         self.t = t if t is not None else 0
         self.front_face = front_face if front_face is not None else False
+        self.obj = obj  # The primitive that was hit
 
     def set_face_normal(self, r: Ray, outward_normal: Vector3):
         '''
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from camera import Camera
+from hittable import Hittable
+from jit import warm_up
+from kernel import CH_RAYS, TRACE_COLUMNS, TRACE_DIRECTION, TRACE_ORIGIN, TRACE_SPHERE, TRACE_T
+from main import random_world
+from scene import Scene
+from vector import Point3, Vector3
+
+
+def changed_spheres(old: Scene, new: Scene) -> np.ndarray:
+    '''
+    Returns the indices of the rows that differ between two scenes, in either: the spheres, kinds
+    or props of their common rows, and the rows past the end of the shorter one.
+    '''
+    n = min(len(old), len(new))
+    changed = (
+        np.any(old.spheres[:n] != new.spheres[:n], axis=1)
+        | (old.kinds[:n] != new.kinds[:n])
+        | np.any(old.props[:n] != new.props[:n], axis=1)
+    )
+    return np.concatenate((np.flatnonzero(changed), np.arange(n, max(len(old), len(new)))))
+
+
+def segments_reach(segments: np.ndarray, spheres: np.ndarray) -> bool:
+    '''
+    Returns whether any ray segment, from its origin to its hit (or to infinity if it escaped),
+    passes within one of the (center, radius) spheres, up to the float32 rounding of the trace.
+    '''
+    o = segments[:, TRACE_ORIGIN : TRACE_ORIGIN + 3].astype(np.float64)
+    d = segments[:, TRACE_DIRECTION : TRACE_DIRECTION + 3].astype(np.float64)
+    t_end = segments[:, TRACE_T].astype(np.float64)
+    dd = np.einsum('ij,ij->i', d, d)
+    scale = np.linalg.norm(o, axis=1)
+    for center, radius in zip(spheres[:, :3], spheres[:, 3]):
+        oc = center - o
+        # Closest point of each segment to the center
+        t = np.clip(np.einsum('ij,ij->i', oc, d) / dd, 0.0, t_end)
+        distance = np.linalg.norm(oc - t[:, np.newaxis] * d, axis=1)
+        margin = 1e-5 * (scale + np.linalg.norm(center) + abs(radius) + 1.0)
+        if np.any(distance <= abs(radius) + margin):
+            return True
+    return False
+
+
+class IncrementalRenderer:
+    '''
+    Re-renders a scene after edits by tracing again only the tiles the edits can change.
+
+    Every tile keeps the segments of all the rays traced for it. The tile kernels draw their
+    random values from the seed, the pixel and the sample number only, so a tile traces the same
+    paths again unless one of its rays meets an edited sphere: either a sphere it hit before the
+    edit, or the sphere after the edit anywhere along a segment. The other tiles are kept as
+    they are, and the result is the framebuffer a full render of the edited scene would give.
+    '''
+
+    def __init__(self, camera: Camera, max_workers: int | None = None):
+        self.camera = camera
+        self.max_workers = max_workers
+        self.scene: Scene | None = None  # Copy of the scene of the framebuffer
+        self.framebuffer = camera.new_framebuffer()
+        self.tiles = camera.tiles()
+        no_segments = np.empty((0, TRACE_COLUMNS), dtype=np.float32)
+        self.segments: list[np.ndarray] = [no_segments] * len(self.tiles)
+        # Spheres hit by the rays of each tile
+        self.touched: list[np.ndarray] = [np.empty(0, dtype=np.int64)] * len(self.tiles)
+        self.skipped_tiles = 0.0  # Fractions of the tiles and of the rays of the last render
+        self.skipped_rays = 0.0  # that were kept instead of traced again
+
+    def dirty_tiles(self, scene: Scene) -> list[int]:
+        '''Returns the indices of the tiles whose pixels can differ in a render of the scene.'''
+        if self.scene is None:
+            return list(range(len(self.tiles)))
+        changed = changed_spheres(self.scene, scene)
+        if len(changed) == 0:
+            return []
+        new_spheres = scene.spheres[changed[changed < len(scene)]]
+        return [
+            t
+            for t in range(len(self.tiles))
+            if np.intersect1d(self.touched[t], changed, assume_unique=True).size
+            or segments_reach(self.segments[t], new_spheres)
+        ]
+
+    def render(self, world: Hittable | Scene, image_file: Path | None = None) -> np.ndarray:
+        '''
+        Returns the framebuffer of the world, tracing only the tiles that changed since the
+        last render, and writes its image unless `image_file` is None.
+        '''
+
+        start_perf_counter_ns = time.perf_counter_ns()
+        scene = Scene.from_hittable(world)
+        dirty = self.dirty_tiles(scene)
+        kept_rays = self.framebuffer[..., CH_RAYS].sum()
+        for t in dirty:
+            x0, y0, x1, y1 = self.tiles[t]
+            kept_rays -= self.framebuffer[y0:y1, x0:x1, CH_RAYS].sum()
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {
+                # The last trace of a tile sizes the next one, which then rarely needs a retrace
+                executor.submit(
+                    self.camera.render_tile_traced,
+                    scene,
+                    *self.tiles[t],
+                    capacity=len(self.segments[t]) or None,
+                ): t
+                for t in dirty
+            }
+            for future in concurrent.futures.as_completed(futures):
+                t = futures[future]
+                x0, y0, x1, y1 = self.tiles[t]
+                pixels, segments = future.result()
+                self.framebuffer[y0:y1, x0:x1] = pixels
+                self.segments[t] = segments
+                touched = np.unique(segments[:, TRACE_SPHERE]).astype(np.int64)
+                self.touched[t] = touched[touched >= 0]
+
+        self.scene = Scene(scene.spheres.copy(), scene.kinds.copy(), scene.props.copy())
+        total_rays = self.framebuffer[..., CH_RAYS].sum()
+        self.skipped_tiles = 1 - len(dirty) / len(self.tiles)
+        self.skipped_rays = kept_rays / total_rays if total_rays else 0.0
+        elapsed_s = (time.perf_counter_ns() - start_perf_counter_ns) / 1e9
+        logging.info(
+            'Traced %d of %d tiles in %.2fs, skipped %.1f%% of the tiles and %.1f%% of the rays',
+            len(dirty),
+            len(self.tiles),
+            elapsed_s,
+            100 * self.skipped_tiles,
+            100 * self.skipped_rays,
+        )
+
+        if image_file is not None:
+            self.camera.write_image(self.framebuffer, image_file)
+        return self.framebuffer
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    warm_up()
+    cam = Camera(
+        aspect_ratio=16 / 9,
+        image_width=320,
+        samples_per_pixel=10,
+        max_depth=50,
+        vfov=20,
+        lookfrom=Point3(13, 2, 3),
+        lookat=Point3(0, 0, 0),
+        vup=Vector3(0, 1, 0),
+        defocus_angle=0.6,
+        focus_dist=10,
+    )
+    scene = Scene.from_hittable(random_world())
+    renderer = IncrementalRenderer(cam)
+    renderer.render(scene, Path('image.ppm'))
+
+    # Move the small sphere nearest the camera a little, then recolor it
+    small = np.flatnonzero(scene.spheres[:, 3] < 0.5)
+    k = small[np.argmax(scene.spheres[small, 0])]
+    scene.spheres[k, 2] += 0.3
+    renderer.render(scene, Path('image.ppm'))
+    scene.props[k, :3] = 1.0 - scene.props[k, :3]
+    renderer.render(scene, Path('image.ppm'))
+
+
+if __name__ == '__main__':
+    main()
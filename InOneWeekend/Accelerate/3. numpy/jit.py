@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+IMPORT_START_NS = time.perf_counter_ns()  # The compiled modules import this one first
+
+# Tile engines: the tile kernels compiled by numba, or the NumPy engine of vectorized.py, which
+# needs no compiler and starts at once but traces more slowly. Cameras that do not choose one use
+# PYRAYTRACING_ENGINE, else numba when it is installed.
+ENGINES = ('numba', 'numpy')
+ENGINE = os.environ.get('PYRAYTRACING_ENGINE') or (
+    'numba' if importlib.util.find_spec('numba') is not None else 'numpy'
+)
+if ENGINE not in ENGINES:
+    raise ValueError(f'Unknown engine: {ENGINE}')
+
+# Modules with compiled functions. Numba checks a cached function against its own source file
+# only, so a change in a function it calls from another module would go unnoticed: the cache
+# lives in a directory named after a digest of all of them instead.
+MODULES = (
+    'camera.py',
+    'denoise.py',
+    'jit.py',
+    'kernel.py',
+    'material.py',
+    'sampler.py',
+    'sphere.py',
+    'vector.py',
+)
+
+
+class Deferred:
+    '''
+    A function numba compiles once enable() is called, and the interpreter runs until then, so
+    that importing the compiled modules does not import numba.
+    '''
+
+    def __init__(self, function: Callable, signatures: tuple[str, ...], options: dict):
+        functools.update_wrapper(self, function)
+        self.py_func = function
+        self.signatures = signatures  # Argument types compiled by warm_up()
+        self.options = options  # Keyword arguments of numba.njit
+        self.dispatcher: Callable | None = None  # The compiled function once enabled
+
+    def __call__(self, *args, **kwargs):
+        if self.dispatcher is not None:
+            return self.dispatcher(*args, **kwargs)
+        return self.py_func(*args, **kwargs)
+
+
+_FUNCTIONS: list[Deferred] = []
+_LOCK = threading.Lock()
+_enabled = False
+
+
+def cache_root() -> Path:
+    '''
+    Parent directory of the caches, from PYRAYTRACING_CACHE_DIR, e.g. a volume mounted into a
+    container whose source tree is read-only, or $XDG_CACHE_HOME/pyraytracing by default
+    (~/.cache/pyraytracing).
+    '''
+
+    base = os.environ.get('PYRAYTRACING_CACHE_DIR')
+    if not base:
+        base = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'pyraytracing'
+    return Path(base)
+
+
+def source_digest() -> str:
+    '''Digest of the sources of the compiled modules, which changes with every edit to them.'''
+    digest = hashlib.sha256()
+    for name in MODULES:
+        digest.update((Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_dir() -> Path:
+    '''Directory of the compiled code of this version of the sources, under cache_root().'''
+    return cache_root() / source_digest()
+
+
+def njit(function: Callable | None = None, *, signatures: tuple[str, ...] = (), **options):
+    '''
+    numba.njit, deferred until enable() and with the compiled code cached on disk. warm_up()
+    compiles the `signatures` (numba argument type strings) ahead of the first call.
+    '''
+
+    def decorate(function: Callable) -> Callable:
+        deferred = Deferred(function, signatures, options)
+        with _LOCK:
+            _FUNCTIONS.append(deferred)
+            if _enabled:
+                # Imported after enable(): compiled callers need the compiled function itself
+                deferred.dispatcher = _compile(deferred)
+                return deferred.dispatcher
+        return deferred
+
+    return decorate(function) if function is not None else decorate
+
+
+def _compile(deferred: Deferred) -> Callable:
+    import numba
+
+    return numba.njit(cache=True, **deferred.options)(deferred.py_func)
+
+
+def enable():
+    '''
+    Imports numba and hands every deferred function to it, which loads the compiled code from the
+    disk cache or compiles it on first call. The module globals naming a deferred function are
+    rebound to the compiled one, which numba needs to compile its callers.
+    '''
+
+    global _enabled
+    if _enabled:
+        return
+    with _LOCK:
+        if _enabled:
+            return
+        import numba
+
+        # Read by numba when each function is decorated; if the directory cannot be created it
+        # falls back to its own cache locations.
+        numba.config.CACHE_DIR = str(cache_dir())
+        for deferred in _FUNCTIONS:
+            deferred.dispatcher = _compile(deferred)
+        for module in {sys.modules[deferred.__module__] for deferred in _FUNCTIONS}:
+            namespace = vars(module)
+            for name, value in list(namespace.items()):
+                if isinstance(value, Deferred):
+                    namespace[name] = value.dispatcher
+        _enabled = True
+
+
+def warm_up() -> tuple[float, float]:
+    '''
+    Enables numba when it is the default engine and compiles the signatures of every compiled
+    function, loading them from the disk cache when they are there, so that no thread compiles
+    mid-render. Returns the seconds spent importing (the modules from jit on, and numba) and
+    compiling.
+    '''
+
+    if ENGINE != 'numba':
+        return (time.perf_counter_ns() - IMPORT_START_NS) / 1e9, 0.0
+
+    enable()
+    start_perf_counter_ns = time.perf_counter_ns()
+    for deferred in _FUNCTIONS:
+        for signature in deferred.signatures:
+            deferred.dispatcher.compile(signature)
+    end_perf_counter_ns = time.perf_counter_ns()
+
+    import_s = (start_perf_counter_ns - IMPORT_START_NS) / 1e9
+    compile_s = (end_perf_counter_ns - start_perf_counter_ns) / 1e9
+    dispatchers = [deferred.dispatcher for deferred in _FUNCTIONS]
+    hits = sum(sum(dispatcher.stats.cache_hits.values()) for dispatcher in dispatchers)
+    misses = sum(sum(dispatcher.stats.cache_misses.values()) for dispatcher in dispatchers)
+    logging.info(
+        'Compiled in %.2fs: %d signatures loaded from %s, %d compiled',
+        compile_s,
+        hits,
+        sys.modules['numba'].config.CACHE_DIR,
+        misses,
+    )
+    return import_s, compile_s
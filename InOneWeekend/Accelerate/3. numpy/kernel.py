@@ -0,0 +1,804 @@
+from __future__ import annotations
+
+import numpy as np
+
+from jit import njit
+from sampler import (
+    GROUP_BOUNCE,
+    GROUP_CAMERA,
+    GROUP_PERMUTATION,
+    SAMPLER_RANDOM,
+    SAMPLER_STRATIFIED,
+    hash32,
+    hash_pixel,
+    sample_group,
+)
+from scene import DIELECTRIC, LAMBERTIAN, METAL
+
+# Layout of the flat camera parameter array passed to the kernels
+CAM_CENTER = 0
+CAM_PIXEL00 = 3
+CAM_DELTA_U = 6
+CAM_DELTA_V = 9
+CAM_DEFOCUS_U = 12
+CAM_DEFOCUS_V = 15
+CAM_DEFOCUS_ANGLE = 18
+CAM_SIZE = 19
+
+# Channels of the tiles and framebuffers written by the kernels
+CH_COLOR = 0  # Averaged linear color, 3 channels
+CH_SAMPLES = 3  # Number of samples taken by the pixel
+CH_RAYS = 4  # Number of rays traced by the samples of the pixel, the path lengths summed
+# First-hit features of the samples, the guides of the denoiser
+CH_ALBEDO = 5  # Mean albedo of the hit material, the background color for escaping samples
+CH_NORMAL = 8  # Mean unit normal facing the ray, 0 for escaping samples
+CH_INV_DEPTH = 11  # Mean inverse distance along the ray, 0 for escaping samples
+CH_MOMENT2 = 12  # Mean squared luminance of the samples, for the variance of the pixel mean
+CH_OBJECT = 13  # Sphere hit by the earliest sample of the pixel that hit one, -1 if none did
+CHANNELS = 14
+# Channels holding means over the samples of a pixel, as opposed to counts and indices
+MEAN_CHANNELS = [CH_COLOR, CH_COLOR + 1, CH_COLOR + 2, *range(CH_ALBEDO, CH_OBJECT)]
+
+# Columns of the ray segments recorded in a trace: the ray origin and direction, the ray
+# parameter of its hit (inf when it escapes) and the sphere it hit (-1 when none)
+TRACE_ORIGIN = 0
+TRACE_DIRECTION = 3
+TRACE_T = 6
+TRACE_SPHERE = 7
+TRACE_COLUMNS = 8
+
+# Coarse-grained kernels: each call traces a whole tile without holding the GIL, so the
+# Python threads of render_threading / render_concurrent run them on separate cores.
+
+
+@njit(nogil=True)
+def _unit_vector(u: float, v: float) -> tuple[float, float, float]:
+    """Uniform mapping of (u, v) in [0, 1)^2 onto the unit sphere"""
+    z = 1.0 - 2.0 * u
+    r = np.sqrt(max(0.0, 1.0 - z * z))
+    phi = 2.0 * np.pi * v
+    return r * np.cos(phi), r * np.sin(phi), z
+
+
+@njit(nogil=True)
+def _concentric_disk(u: float, v: float) -> tuple[float, float]:
+    """Shirley-Chiu concentric mapping of [0, 1)^2 onto the unit disk, without rejection"""
+    a = 2.0 * u - 1.0
+    b = 2.0 * v - 1.0
+    if a == 0.0 and b == 0.0:
+        return 0.0, 0.0
+    if abs(a) > abs(b):
+        r = a
+        phi = np.pi / 4 * (b / a)
+    else:
+        r = b
+        phi = np.pi / 2 - np.pi / 4 * (a / b)
+    return r * np.cos(phi), r * np.sin(phi)
+
+
+@njit(nogil=True)
+def _shuffle(perm: np.ndarray, pixel_seed: int):
+    """Fisher-Yates shuffle of the identity into perm, from the permutation stream of a pixel"""
+    seed = hash32(pixel_seed, GROUP_PERMUTATION)
+    for k in range(perm.shape[0]):
+        perm[k] = k
+    for k in range(perm.shape[0] - 1, 0, -1):
+        m = hash32(seed, k) % (k + 1)
+        perm[k], perm[m] = perm[m], perm[k]
+
+
+@njit(nogil=True)
+def _strata(samples: int) -> int:
+    """Edge of the largest square grid of strata with at most `samples` cells"""
+    n = int(np.sqrt(samples))
+    while (n + 1) * (n + 1) <= samples:
+        n += 1
+    while n * n > samples:
+        n -= 1
+    return n
+
+
+@njit(nogil=True)
+def _pixel_sample(
+    sampler: int, strata: int, perm: np.ndarray, pixel_seed: int, s: int
+) -> tuple[float, float, float, float]:
+    """
+    Pixel footprint and lens coordinates in [0, 1)^2 of the sample s of a pixel.
+    With stratified sampling the first strata * strata samples are jittered inside the cells of
+    a strata x strata grid, visiting the lens cells in the shuffled order of perm.
+    """
+    if sampler == SAMPLER_STRATIFIED and s < strata * strata:
+        jx, jy, jlx, jly = sample_group(SAMPLER_RANDOM, pixel_seed, s, GROUP_CAMERA)
+        px = (s % strata + jx) / strata
+        py = (s // strata + jy) / strata
+        cell = perm[s]
+        lx = (cell % strata + jlx) / strata
+        ly = (cell // strata + jly) / strata
+        return px, py, lx, ly
+    return sample_group(sampler, pixel_seed, s, GROUP_CAMERA)
+
+
+@njit(nogil=True, signatures=('(int64, int64, int64, int64, int64)',))
+def sample_block(
+    sampler: int, pixel_seed: int, first_sample: int, samples: int, groups: int
+) -> np.ndarray:
+    """
+    Sample values of `samples` samples of a pixel from first_sample on, drawn at once as a
+    (samples, groups, 4) block. Row [s, 0] holds the pixel footprint and lens coordinates of the
+    sample, as _pixel_sample returns them, and row [s, 1 + k] the values of its bounce k.
+    """
+    strata = _strata(samples)
+    perm = np.arange(strata * strata)
+    if sampler == SAMPLER_STRATIFIED:
+        _shuffle(perm, pixel_seed)
+    block = np.empty((samples, groups, 4))
+    for s in range(samples):
+        sample = first_sample + s
+        block[s, 0, 0], block[s, 0, 1], block[s, 0, 2], block[s, 0, 3] = _pixel_sample(
+            sampler, strata, perm, pixel_seed, sample
+        )
+        for g in range(1, groups):
+            block[s, g, 0], block[s, g, 1], block[s, g, 2], block[s, g, 3] = sample_group(
+                sampler, pixel_seed, sample, GROUP_BOUNCE + g - 1
+            )
+    return block
+
+
+@njit(nogil=True)
+def _reflectance(cosine: float, refraction_index: float) -> float:
+    """Schlick's approximation for reflectance"""
+    r0 = (1 - refraction_index) / (1 + refraction_index)
+    r0 = r0 * r0
+    return r0 + (1 - r0) * (1 - cosine) ** 5
+
+
+@njit(nogil=True)
+def _hit_spheres(
+    spheres: np.ndarray,
+    ox: float,
+    oy: float,
+    oz: float,
+    dx: float,
+    dy: float,
+    dz: float,
+    t_min: float,
+    t_max: float,
+) -> tuple[int, float]:
+    """
+    Closest sphere hit along the ray.
+    Returns (index, t) where index is -1 when nothing is hit.
+    """
+    hit_index = -1
+    closest = t_max
+    a = dx * dx + dy * dy + dz * dz
+    for k in range(spheres.shape[0]):
+        ocx = spheres[k, 0] - ox
+        ocy = spheres[k, 1] - oy
+        ocz = spheres[k, 2] - oz
+        radius = spheres[k, 3]
+        h = dx * ocx + dy * ocy + dz * ocz
+        c = ocx * ocx + ocy * ocy + ocz * ocz - radius * radius
+
+        discriminant = h * h - a * c
+        if discriminant < 0:
+            continue
+
+        sqrtd = np.sqrt(discriminant)
+
+        # Find the nearest root that lies in the acceptable range
+        root = (h - sqrtd) / a
+        if root <= t_min or root >= closest:
+            root = (h + sqrtd) / a
+            if root <= t_min or root >= closest:
+                continue
+
+        closest = root
+        hit_index = k
+
+    return hit_index, closest
+
+
+@njit(nogil=True)
+def _background(dx: float, dy: float, dz: float) -> tuple[float, float, float]:
+    """Sky color seen along a ray direction"""
+    length = np.sqrt(dx * dx + dy * dy + dz * dz)
+    a = 0.5 * (dy / length + 1.0)
+    return 1.0 - a + a * 0.5, 1.0 - a + a * 0.7, 1.0
+
+
+@njit(nogil=True)
+def _hit_point(
+    spheres: np.ndarray,
+    k: int,
+    t: float,
+    ox: float,
+    oy: float,
+    oz: float,
+    dx: float,
+    dy: float,
+    dz: float,
+) -> tuple[float, float, float, float, float, float, bool]:
+    """Point, unit normal facing the ray and front face flag of the hit of sphere k at t"""
+    px = ox + t * dx
+    py = oy + t * dy
+    pz = oz + t * dz
+    radius = spheres[k, 3]
+    nx = (px - spheres[k, 0]) / radius
+    ny = (py - spheres[k, 1]) / radius
+    nz = (pz - spheres[k, 2]) / radius
+    front_face = dx * nx + dy * ny + dz * nz < 0
+    if not front_face:
+        nx, ny, nz = -nx, -ny, -nz
+    return px, py, pz, nx, ny, nz, front_face
+
+
+@njit(nogil=True)
+def _record_segment(
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+    ox: float,
+    oy: float,
+    oz: float,
+    dx: float,
+    dy: float,
+    dz: float,
+    t: float,
+    k: int,
+):
+    """Counts a ray segment and appends it while the trace has rows left (no rows turn it off)"""
+    c = trace_count[0]
+    if trace.shape[0] == 0:
+        return
+    trace_count[0] = c + 1
+    if c >= trace.shape[0]:
+        return
+    trace[c, TRACE_ORIGIN] = ox
+    trace[c, TRACE_ORIGIN + 1] = oy
+    trace[c, TRACE_ORIGIN + 2] = oz
+    trace[c, TRACE_DIRECTION] = dx
+    trace[c, TRACE_DIRECTION + 1] = dy
+    trace[c, TRACE_DIRECTION + 2] = dz
+    trace[c, TRACE_T] = t
+    trace[c, TRACE_SPHERE] = k
+
+
+@njit(nogil=True)
+def _trace_path(
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    ox: float,
+    oy: float,
+    oz: float,
+    dx: float,
+    dy: float,
+    dz: float,
+    k: int,
+    t: float,
+    max_depth: int,
+    rr_depth: int,
+    sampler: int,
+    pixel_seed: int,
+    s: int,
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+) -> tuple[float, float, float, int]:
+    """
+    Iterative equivalent of Camera.ray_color over the flat scene arrays from the hit of sphere k
+    at t along the ray, taking the random values of each bounce from the sample s of the pixel.
+    Returns the color and the number of rays traced after the given one, which are appended to
+    the trace.
+    """
+    tr, tg, tb = 1.0, 1.0, 1.0  # Product of the attenuations along the path
+
+    for depth in range(max_depth):
+        u1, u2, u3, u4 = sample_group(sampler, pixel_seed, s, GROUP_BOUNCE + depth)
+        if depth > 0:
+            k, t = _hit_spheres(spheres, ox, oy, oz, dx, dy, dz, 0.001, np.inf)
+            _record_segment(trace, trace_count, ox, oy, oz, dx, dy, dz, t, k)
+            if k < 0:
+                r, g, b = _background(dx, dy, dz)
+                return tr * r, tg * g, tb * b, depth
+
+        px, py, pz, nx, ny, nz, front_face = _hit_point(spheres, k, t, ox, oy, oz, dx, dy, dz)
+        kind = kinds[k]
+        if kind == LAMBERTIAN:
+            rx, ry, rz = _unit_vector(u1, u2)
+            sx, sy, sz = nx + rx, ny + ry, nz + rz
+
+            # Catch degenerate scatter direction
+            if abs(sx) < 1e-8 and abs(sy) < 1e-8 and abs(sz) < 1e-8:
+                sx, sy, sz = nx, ny, nz
+
+            tr *= props[k, 0]
+            tg *= props[k, 1]
+            tb *= props[k, 2]
+        elif kind == METAL:
+            dn = dx * nx + dy * ny + dz * nz
+            fx, fy, fz = dx - 2 * dn * nx, dy - 2 * dn * ny, dz - 2 * dn * nz
+            length = np.sqrt(fx * fx + fy * fy + fz * fz)
+            fuzz = props[k, 3]
+            rx, ry, rz = _unit_vector(u1, u2)
+            sx = fx / length + fuzz * rx
+            sy = fy / length + fuzz * ry
+            sz = fz / length + fuzz * rz
+
+            if sx * nx + sy * ny + sz * nz <= 0:
+                return 0.0, 0.0, 0.0, depth
+
+            tr *= props[k, 0]
+            tg *= props[k, 1]
+            tb *= props[k, 2]
+        elif kind == DIELECTRIC:
+            ri = 1 / props[k, 3] if front_face else props[k, 3]
+
+            length = np.sqrt(dx * dx + dy * dy + dz * dz)
+            ux, uy, uz = dx / length, dy / length, dz / length
+            cos_theta = min(-(ux * nx + uy * ny + uz * nz), 1.0)
+            sin_theta = np.sqrt(1 - cos_theta * cos_theta)
+
+            cannot_refract = ri * sin_theta > 1
+
+            if cannot_refract or _reflectance(cos_theta, ri) > u3:
+                un = ux * nx + uy * ny + uz * nz
+                sx, sy, sz = ux - 2 * un * nx, uy - 2 * un * ny, uz - 2 * un * nz
+            else:
+                perp_x = ri * (ux + cos_theta * nx)
+                perp_y = ri * (uy + cos_theta * ny)
+                perp_z = ri * (uz + cos_theta * nz)
+                perp_lensq = perp_x * perp_x + perp_y * perp_y + perp_z * perp_z
+                parallel = -np.sqrt(abs(1.0 - perp_lensq))
+                sx = perp_x + parallel * nx
+                sy = perp_y + parallel * ny
+                sz = perp_z + parallel * nz
+        else:
+            return 0.0, 0.0, 0.0, depth
+
+        if depth + 1 >= rr_depth:
+            # Russian roulette: the path survives with the probability of its throughput and the
+            # survivors are weighted up by its inverse, which keeps the estimate unbiased.
+            q = min(max(tr, tg, tb), 0.95)
+            if u4 >= q:
+                return 0.0, 0.0, 0.0, depth
+            tr /= q
+            tg /= q
+            tb /= q
+
+        ox, oy, oz = px, py, pz
+        dx, dy, dz = sx, sy, sz
+
+    # If we've exceeded the ray bounce limit, no more light is gathered.
+    return 0.0, 0.0, 0.0, max_depth - 1
+
+
+@njit(nogil=True)
+def _ray_color(
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    ox: float,
+    oy: float,
+    oz: float,
+    dx: float,
+    dy: float,
+    dz: float,
+    max_depth: int,
+    rr_depth: int,
+    splits: np.ndarray,
+    sampler: int,
+    pixel_seed: int,
+    s: int,
+    first_hit: np.ndarray,
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+) -> tuple[float, float, float, int]:
+    """
+    Color of the camera ray of sample s of a pixel and the number of rays traced along its path,
+    which are appended to the trace.
+    Adds the features of the first hit to the CH_ALBEDO, CH_NORMAL and CH_INV_DEPTH sums of the
+    first_hit channels, and its sphere to CH_OBJECT unless an earlier sample hit one.
+    A hit on a material of kind m splits the path into splits[m] paths averaged together, whose
+    bounces take the random values of the samples s * stride to s * stride + splits[m] - 1, with
+    the largest split as the stride so that no two samples share one whatever their materials.
+    """
+    k, t = _hit_spheres(spheres, ox, oy, oz, dx, dy, dz, 0.001, np.inf)
+    _record_segment(trace, trace_count, ox, oy, oz, dx, dy, dz, t, k)
+    if k < 0:
+        r, g, b = _background(dx, dy, dz)
+        first_hit[CH_ALBEDO] += r
+        first_hit[CH_ALBEDO + 1] += g
+        first_hit[CH_ALBEDO + 2] += b
+        return r, g, b, 1
+
+    _, _, _, nx, ny, nz, _ = _hit_point(spheres, k, t, ox, oy, oz, dx, dy, dz)
+    kind = kinds[k]
+    if kind == DIELECTRIC:
+        first_hit[CH_ALBEDO] += 1.0
+        first_hit[CH_ALBEDO + 1] += 1.0
+        first_hit[CH_ALBEDO + 2] += 1.0
+    else:
+        first_hit[CH_ALBEDO] += props[k, 0]
+        first_hit[CH_ALBEDO + 1] += props[k, 1]
+        first_hit[CH_ALBEDO + 2] += props[k, 2]
+    first_hit[CH_NORMAL] += nx
+    first_hit[CH_NORMAL + 1] += ny
+    first_hit[CH_NORMAL + 2] += nz
+    first_hit[CH_INV_DEPTH] += 1.0 / (t * np.sqrt(dx * dx + dy * dy + dz * dz))
+    if first_hit[CH_OBJECT] < 0:
+        first_hit[CH_OBJECT] = k
+
+    n = splits[kind]
+    stride = splits.max()
+    r, g, b = 0.0, 0.0, 0.0
+    rays = 1
+    for branch in range(n):
+        cr, cg, cb, path_rays = _trace_path(
+            spheres,
+            kinds,
+            props,
+            ox,
+            oy,
+            oz,
+            dx,
+            dy,
+            dz,
+            k,
+            t,
+            max_depth,
+            rr_depth,
+            sampler,
+            pixel_seed,
+            s * stride + branch,
+            trace,
+            trace_count,
+        )
+        r += cr
+        g += cg
+        b += cb
+        rays += path_rays
+    return r / n, g / n, b / n, rays
+
+
+@njit(nogil=True)
+def _camera_ray(
+    cam: np.ndarray, i: int, j: int, px: float, py: float, lx: float, ly: float
+) -> tuple[float, float, float, float, float, float]:
+    """
+    Camera ray through the point (px, py) in [0, 1)^2 of pixel i, j, leaving the defocus disk at
+    the concentric mapping of (lx, ly), as (origin, direction) components
+    """
+    fi = i + px - 0.5
+    fj = j + py - 0.5
+    sx = cam[CAM_PIXEL00] + fi * cam[CAM_DELTA_U] + fj * cam[CAM_DELTA_V]
+    sy = cam[CAM_PIXEL00 + 1] + fi * cam[CAM_DELTA_U + 1] + fj * cam[CAM_DELTA_V + 1]
+    sz = cam[CAM_PIXEL00 + 2] + fi * cam[CAM_DELTA_U + 2] + fj * cam[CAM_DELTA_V + 2]
+
+    ox = cam[CAM_CENTER]
+    oy = cam[CAM_CENTER + 1]
+    oz = cam[CAM_CENTER + 2]
+    if cam[CAM_DEFOCUS_ANGLE] > 0:
+        du, dv = _concentric_disk(lx, ly)
+        ox += du * cam[CAM_DEFOCUS_U] + dv * cam[CAM_DEFOCUS_V]
+        oy += du * cam[CAM_DEFOCUS_U + 1] + dv * cam[CAM_DEFOCUS_V + 1]
+        oz += du * cam[CAM_DEFOCUS_U + 2] + dv * cam[CAM_DEFOCUS_V + 2]
+
+    return ox, oy, oz, sx - ox, sy - oy, sz - oz
+
+
+@njit(nogil=True)
+def _sample_pixel(
+    cam: np.ndarray,
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    i: int,
+    j: int,
+    max_depth: int,
+    rr_depth: int,
+    splits: np.ndarray,
+    sampler: int,
+    strata: int,
+    perm: np.ndarray,
+    pixel_seed: int,
+    s: int,
+    first_hit: np.ndarray,
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+) -> tuple[float, float, float, int]:
+    """
+    Color and number of rays of the camera path of sample s through pixel i, j, adding its
+    first-hit features to first_hit and its rays to the trace
+    """
+    px, py, lx, ly = _pixel_sample(sampler, strata, perm, pixel_seed, s)
+    ox, oy, oz, dx, dy, dz = _camera_ray(cam, i, j, px, py, lx, ly)
+    return _ray_color(
+        spheres,
+        kinds,
+        props,
+        ox,
+        oy,
+        oz,
+        dx,
+        dy,
+        dz,
+        max_depth,
+        rr_depth,
+        splits,
+        sampler,
+        pixel_seed,
+        s,
+        first_hit,
+        trace,
+        trace_count,
+    )
+
+
+@njit(nogil=True)
+def _add_sample(
+    sums: np.ndarray,
+    counts: np.ndarray,
+    means: np.ndarray,
+    m2s: np.ndarray,
+    p: int,
+    r: float,
+    g: float,
+    b: float,
+):
+    """Accumulates a sample of pixel p and updates its Welford luminance statistics"""
+    sums[p, 0] += r
+    sums[p, 1] += g
+    sums[p, 2] += b
+    counts[p] += 1
+    luminance = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    delta = luminance - means[p]
+    means[p] += delta / counts[p]
+    m2s[p] += delta * (luminance - means[p])
+
+
+@njit(nogil=True)
+def _render_tile_adaptive(
+    cam: np.ndarray,
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    x0: int,
+    y0: int,
+    x1: int,
+    y1: int,
+    samples_per_pixel: int,
+    first_sample: int,
+    max_depth: int,
+    rr_depth: int,
+    splits: np.ndarray,
+    min_spp: int,
+    max_spp: int,
+    tolerance: float,
+    sampler: int,
+    seed: int,
+    out: np.ndarray,
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+):
+    """
+    Adaptive sampling of a tile with a budget of samples_per_pixel samples per pixel.
+    Every pixel takes min_spp samples, then the remaining budget goes to the pixels whose 95%
+    confidence half-width of the luminance mean (Welford running variance) still exceeds the
+    tolerance, noisiest first, until they converge, reach max_spp or the budget runs out.
+    """
+    width = x1 - x0
+    n = (y1 - y0) * width
+    sums = np.zeros((n, 3))
+    counts = np.zeros(n, dtype=np.int64)
+    means = np.zeros(n)
+    m2s = np.zeros(n)
+    rays = np.zeros(n, dtype=np.int64)
+    errors = np.empty(n)
+    pixel_seeds = np.empty(n, dtype=np.int64)
+    for p in range(n):
+        pixel_seeds[p] = hash_pixel(seed, x0 + p % width, y0 + p // width)
+    strata = _strata(min(min_spp, max_spp))
+    perm = np.arange(strata * strata)
+    # Past the stratified first phase the samples are plain random
+    later_sampler = SAMPLER_RANDOM if sampler == SAMPLER_STRATIFIED else sampler
+
+    for p in range(n):
+        i = x0 + p % width
+        j = y0 + p // width
+        if sampler == SAMPLER_STRATIFIED:
+            _shuffle(perm, pixel_seeds[p])
+        for s in range(first_sample, first_sample + min(min_spp, max_spp)):
+            r, g, b, path_rays = _sample_pixel(
+                cam,
+                spheres,
+                kinds,
+                props,
+                i,
+                j,
+                max_depth,
+                rr_depth,
+                splits,
+                sampler,
+                strata,
+                perm,
+                pixel_seeds[p],
+                s,
+                out[p // width, p % width],
+                trace,
+                trace_count,
+            )
+            _add_sample(sums, counts, means, m2s, p, r, g, b)
+            rays[p] += path_rays
+
+    budget = samples_per_pixel * n - counts.sum()
+    step = max(min_spp, 1)  # Samples given to each noisy pixel per round
+    while budget > 0:
+        for p in range(n):
+            c = counts[p]
+            if c >= max_spp:
+                errors[p] = 0.0
+            elif c < 2:
+                errors[p] = np.inf
+            else:
+                errors[p] = 1.96 * np.sqrt(m2s[p] / (c - 1) / c)
+
+        order = np.argsort(-errors, kind='stable')
+        if errors[order[0]] <= tolerance:
+            break  # The whole tile has converged
+
+        for p in order:
+            if errors[p] <= tolerance or budget <= 0:
+                break
+            i = x0 + p % width
+            j = y0 + p // width
+            take = min(step, max_spp - counts[p], budget)
+            for _ in range(take):
+                r, g, b, path_rays = _sample_pixel(
+                    cam,
+                    spheres,
+                    kinds,
+                    props,
+                    i,
+                    j,
+                    max_depth,
+                    rr_depth,
+                    splits,
+                    later_sampler,
+                    strata,
+                    perm,
+                    pixel_seeds[p],
+                    first_sample + counts[p],
+                    out[p // width, p % width],
+                    trace,
+                    trace_count,
+                )
+                _add_sample(sums, counts, means, m2s, p, r, g, b)
+                rays[p] += path_rays
+            budget -= take
+
+    for p in range(n):
+        scale = 1.0 / counts[p]
+        out[p // width, p % width, CH_ALBEDO:CH_OBJECT] *= scale
+        out[p // width, p % width, CH_COLOR] = sums[p, 0] * scale
+        out[p // width, p % width, CH_COLOR + 1] = sums[p, 1] * scale
+        out[p // width, p % width, CH_COLOR + 2] = sums[p, 2] * scale
+        out[p // width, p % width, CH_SAMPLES] = counts[p]
+        out[p // width, p % width, CH_RAYS] = rays[p]
+        out[p // width, p % width, CH_MOMENT2] = m2s[p] * scale + means[p] * means[p]
+
+
+@njit(
+    nogil=True,
+    signatures=(
+        '(float64[::1], float64[:, ::1], uint8[::1], float64[:, ::1], int64, int64, int64, int64,'
+        ' int64, int64, int64, int64, int64, int64[::1], int64, int64, float64, int64, int64,'
+        ' float64[:, :, ::1], float32[:, ::1], int64[::1])',
+    ),
+)
+def render_tile_kernel(
+    cam: np.ndarray,
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    x0: int,
+    y0: int,
+    x1: int,
+    y1: int,
+    samples_per_pixel: int,
+    first_sample: int,
+    frame_spp: int,
+    max_depth: int,
+    rr_depth: int,
+    splits: np.ndarray,
+    min_spp: int,
+    max_spp: int,
+    tolerance: float,
+    sampler: int,
+    seed: int,
+    out: np.ndarray,
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+):
+    """
+    Traces all samples of the pixels in [x0, x1) x [y0, y1) into out[j - y0, i - x0].
+    A positive tolerance switches to adaptive sampling. Paths may end by Russian roulette from
+    rr_depth bounces on, max_depth only caps their length, and a primary hit on a material of
+    kind m continues along splits[m] paths. Samples are numbered from first_sample and all
+    random values come from the streams of the seed, the pixel and the sample number, so a
+    pixel renders the same whatever thread or tile traces it. The stratified sampler lays its
+    grid out for the frame_spp samples of the whole frame, so that passes tracing a part of
+    them each draw the samples a single pass would. Every ray segment is appended to
+    the TRACE_COLUMNS rows of trace from trace_count[0] on while rows are left, and counted
+    even when they are not, so a count past the rows tells the size a complete trace needs.
+    An empty trace turns the recording off.
+    """
+    out[:, :, CH_ALBEDO:CH_OBJECT] = 0.0
+    out[:, :, CH_OBJECT] = -1.0
+    if tolerance > 0:
+        _render_tile_adaptive(
+            cam,
+            spheres,
+            kinds,
+            props,
+            x0,
+            y0,
+            x1,
+            y1,
+            samples_per_pixel,
+            first_sample,
+            max_depth,
+            rr_depth,
+            splits,
+            min_spp,
+            max_spp,
+            tolerance,
+            sampler,
+            seed,
+            out,
+            trace,
+            trace_count,
+        )
+        return
+
+    strata = _strata(frame_spp)
+    perm = np.arange(strata * strata)
+    for j in range(y0, y1):
+        for i in range(x0, x1):
+            pixel_seed = hash_pixel(seed, i, j)
+            if sampler == SAMPLER_STRATIFIED:
+                _shuffle(perm, pixel_seed)
+            r, g, b = 0.0, 0.0, 0.0
+            moment2 = 0.0
+            rays = 0
+            for s in range(first_sample, first_sample + samples_per_pixel):
+                cr, cg, cb, path_rays = _sample_pixel(
+                    cam,
+                    spheres,
+                    kinds,
+                    props,
+                    i,
+                    j,
+                    max_depth,
+                    rr_depth,
+                    splits,
+                    sampler,
+                    strata,
+                    perm,
+                    pixel_seed,
+                    s,
+                    out[j - y0, i - x0],
+                    trace,
+                    trace_count,
+                )
+                r += cr
+                g += cg
+                b += cb
+                rays += path_rays
+                luminance = 0.2126 * cr + 0.7152 * cg + 0.0722 * cb
+                moment2 += luminance * luminance
+            out[j - y0, i - x0, CH_COLOR] = r / samples_per_pixel
+            out[j - y0, i - x0, CH_COLOR + 1] = g / samples_per_pixel
+            out[j - y0, i - x0, CH_COLOR + 2] = b / samples_per_pixel
+            out[j - y0, i - x0, CH_SAMPLES] = samples_per_pixel
+            out[j - y0, i - x0, CH_RAYS] = rays
+            out[j - y0, i - x0, CH_ALBEDO:CH_OBJECT] /= samples_per_pixel
+            out[j - y0, i - x0, CH_MOMENT2] = moment2 / samples_per_pixel
@@ -3,27 +3,23 @@ from __future__ import annotations
 import logging
 import random
 import sys
+import time
+from collections.abc import Iterator
 from pathlib import Path
 
+import numpy as np
+
 from camera import Camera
 from color import Color
 from hittable_list import HittableList
+from jit import warm_up
 from material import Dielectric, Lambertian, Metal
+from scene import DIELECTRIC, LAMBERTIAN, METAL, Scene
 from sphere import Sphere
 from vector import Point3, Vector3
 
 
-def main():
-    if len(sys.argv) == 1:
-        image_file = Path('image.ppm')
-    elif len(sys.argv) == 2:
-        image_file = Path(sys.argv[1])
-    else:
-        print('Help: python main.py image.ppm')
-        return
-
-    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
-
+def random_world() -> HittableList:
     world = HittableList()
 
     ground_material = Lambertian(Color(0.5, 0.5, 0.5))
@@ -60,20 +56,156 @@ def main():
     material3 = Metal(Color(0.7, 0.6, 0.5), 0)
     world.add(Sphere(Point3(4, 1, 0), 1, material3))
 
-    cam = Camera(
-        aspect_ratio=16 / 9,
-        image_width=320,
-        samples_per_pixel=10,
-        max_depth=5,
-        vfov=20,
-        lookfrom=Point3(13, 2, 3),
-        lookat=Point3(0, 0, 0),
-        vup=Vector3(0, 1, 0),
-        defocus_angle=0.6,
-        focus_dist=10,
+    return world
+
+
+# Uniform values drawn per grid cell of random_scene_chunks: the material choice, the center
+# jitter in x and z, two albedo triples (one for metal) and the metal fuzz, padded to 12 so that
+# a cell takes exactly 3 steps of the Philox counter.
+_CELL_DRAWS = 12
+
+
+def random_scene_chunks(
+    extent: int = 11, seed: int | None = None, chunk_cells: int = 1 << 16
+) -> Iterator[Scene]:
+    '''
+    Yields the random_world of a (2 * extent)^2 grid of small spheres as scene arrays, drawn
+    with NumPy `chunk_cells` grid cells at a time: the same material mix, jitter and exclusion
+    zone around (4, 0.2, 0), between the ground sphere in the first chunk and the three large
+    spheres in the last. Cell k draws from Philox counter 3k on, so the spheres of a seed do not
+    depend on the chunk size.
+    '''
+
+    key = np.random.SeedSequence(seed).generate_state(2, dtype=np.uint64)
+    side = 2 * extent
+    cells = side * side
+    yield Scene(
+        np.array([[0, -1000, 0, 1000]], dtype=np.float64),
+        np.array([LAMBERTIAN], dtype=np.uint8),
+        np.array([[0.5, 0.5, 0.5, 0]], dtype=np.float64),
+    )
+
+    for c0 in range(0, cells, chunk_cells):
+        c1 = min(c0 + chunk_cells, cells)
+        bit_generator = np.random.Philox(key=key)
+        bit_generator.advance(3 * c0)
+        u = np.random.Generator(bit_generator).random((c1 - c0, _CELL_DRAWS))
+
+        index = np.arange(c0, c1)
+        x = index // side - extent + 0.9 * u[:, 1]
+        z = index % side - extent + 0.9 * u[:, 2]
+        keep = (x - 4) ** 2 + z**2 > 0.9 * 0.9
+        choose_mat, u = u[keep, 0], u[keep]
+        n = len(u)
+
+        spheres = np.empty((n, 4))
+        spheres[:, 0] = x[keep]
+        spheres[:, 1] = 0.2
+        spheres[:, 2] = z[keep]
+        spheres[:, 3] = 0.2
+        kinds = np.full(n, DIELECTRIC, dtype=np.uint8)
+        kinds[choose_mat < 0.95] = METAL
+        kinds[choose_mat < 0.8] = LAMBERTIAN
+        props = np.empty((n, 4))
+        props[:] = (1, 1, 1, 1.5)
+        diffuse = kinds == LAMBERTIAN
+        props[diffuse, :3] = u[diffuse, 3:6] * u[diffuse, 6:9]
+        props[diffuse, 3] = 0
+        metal = kinds == METAL
+        props[metal, :3] = 0.5 + 0.5 * u[metal, 3:6]
+        props[metal, 3] = 0.5 + 0.5 * u[metal, 9]
+        yield Scene(spheres, kinds, props)
+
+    yield Scene(
+        np.array([[0, 1, 0, 1], [-4, 1, 0, 1], [4, 1, 0, 1]], dtype=np.float64),
+        np.array([DIELECTRIC, LAMBERTIAN, METAL], dtype=np.uint8),
+        np.array([[1, 1, 1, 1.5], [0.4, 0.2, 0.1, 0], [0.7, 0.6, 0.5, 0]], dtype=np.float64),
+    )
+
+
+def random_scene(extent: int = 11, seed: int | None = None) -> Scene:
+    '''The spheres of random_scene_chunks as one scene.'''
+    chunks = list(random_scene_chunks(extent, seed))
+    return Scene(
+        np.concatenate([chunk.spheres for chunk in chunks]),
+        np.concatenate([chunk.kinds for chunk in chunks]),
+        np.concatenate([chunk.props for chunk in chunks]),
     )
 
-    cam.render_concurrent(world, image_file, max_workers=8)
+
+def main():
+    checkpoint_file = None
+    samples_per_pixel = None
+    args = sys.argv[1:]
+    estimate_first = '--estimate' in args
+    if estimate_first:
+        args.remove('--estimate')
+    checkpoint = '--checkpoint' in args
+    if checkpoint:
+        args.remove('--checkpoint')
+    if len(args) == 0:
+        image_file = Path('image.ppm')
+    elif len(args) == 1:
+        image_file = Path(args[0])
+    elif len(args) in (2, 3, 4) and args[0] == 'resume' and not (estimate_first or checkpoint):
+        checkpoint_file = Path(args[1])
+        image_file = Path(args[2]) if len(args) > 2 else Path('image.ppm')
+        samples_per_pixel = int(args[3]) if len(args) > 3 else None
+    else:
+        print('Help: python main.py [--estimate] [--checkpoint] image.ppm')
+        print('      python main.py resume image.ckpt.npz [image.ppm] [samples_per_pixel]')
+        print('      --estimate logs the predicted render time and starts the slowest tiles first')
+        print('      --checkpoint saves the render to image.ckpt.npz as it goes, to resume it')
+        return
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+    # Compile the kernels, or load them from the disk cache, before the render timer starts
+    import_s, compile_s = warm_up()
+
+    estimate_s = 0.0
+    start_perf_counter_ns = time.perf_counter_ns()
+    if checkpoint_file is not None:
+        # The checkpoint holds the camera and the scene of the interrupted render
+        Camera.resume(checkpoint_file, image_file, samples_per_pixel, max_workers=8)
+    else:
+        world = random_world()
+
+        cam = Camera(
+            aspect_ratio=16 / 9,
+            image_width=320,
+            samples_per_pixel=10,
+            max_depth=50,
+            vfov=20,
+            lookfrom=Point3(13, 2, 3),
+            lookat=Point3(0, 0, 0),
+            vup=Vector3(0, 1, 0),
+            defocus_angle=0.6,
+            focus_dist=10,
+        )
+
+        estimate = None
+        if estimate_first:
+            estimate = cam.estimate(world, max_workers=8)
+            estimate_s = estimate.estimate_s
+        start_perf_counter_ns = time.perf_counter_ns()
+        # e.g. image.ckpt.npz, for `python main.py resume image.ckpt.npz` after a crash
+        checkpoint_file = image_file.with_suffix('.ckpt.npz') if checkpoint else None
+        cam.render_concurrent(
+            world,
+            image_file,
+            max_workers=8,
+            checkpoint_file=checkpoint_file,
+            estimate=estimate,
+        )
+    render_s = (time.perf_counter_ns() - start_perf_counter_ns) / 1e9
+    logging.info(
+        'Import %.2fs, compile %.2fs, estimate %.2fs, render %.2fs',
+        import_s,
+        compile_s,
+        estimate_s,
+        render_s,
+    )
 
 
 if __name__ == '__main__':
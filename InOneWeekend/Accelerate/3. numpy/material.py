@@ -3,19 +3,17 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import numpy as np
-from numba import njit
 
 from color import Color
+from jit import njit
 from ray import Ray
 from vector import dot, random_unit_vector, reflect, refract, unit_vector
 
 if TYPE_CHECKING:
     from hittable import HitRecord
 
-RNG = np.random.default_rng()
 
-
-@njit
+@njit(signatures=('(float64, float64)',))
 def _dielectric_reflectance(cosine: float, refraction_index: float) -> float:
     """Optimized Schlick's approximation for reflectance"""
     r0 = (1 - refraction_index) / (1 + refraction_index)
@@ -24,8 +22,21 @@ def _dielectric_reflectance(cosine: float, refraction_index: float) -> float:
 
 
 class Material:
-
-    def scatter(self, r_in: Ray, rec: HitRecord, attenuation: Color, scattered: Ray) -> bool:
+    '''
+    Materials scatter with the values in [0, 1) of a `sample` from the camera sampler: two for
+    the scatter direction and one for the dielectric reflect / refract choice.
+    '''
+
+    albedo = Color(1, 1, 1)  # Reflectance seen by the denoiser, white for clear materials
+
+    def scatter(
+        self,
+        r_in: Ray,
+        rec: HitRecord,
+        attenuation: Color,
+        scattered: Ray,
+        sample: np.ndarray,
+    ) -> bool:
         return False
 
 
@@ -34,8 +45,15 @@ class Lambertian(Material):
     def __init__(self, albedo: Color):
         self.albedo = albedo
 
-    def scatter(self, r_in: Ray, rec: HitRecord, attenuation: Color, scattered: Ray) -> bool:
-        scatter_direction = rec.normal + random_unit_vector()
+    def scatter(
+        self,
+        r_in: Ray,
+        rec: HitRecord,
+        attenuation: Color,
+        scattered: Ray,
+        sample: np.ndarray,
+    ) -> bool:
+        scatter_direction = rec.normal + random_unit_vector(*sample[:2])
 
         # Catch degenerate scatter direction
         if scatter_direction.near_zero():
@@ -52,9 +70,16 @@ class Metal(Material):
         self.albedo = albedo
         self.fuzz = fuzz if fuzz < 1 else 1
 
-    def scatter(self, r_in: Ray, rec: HitRecord, attenuation: Color, scattered: Ray) -> bool:
+    def scatter(
+        self,
+        r_in: Ray,
+        rec: HitRecord,
+        attenuation: Color,
+        scattered: Ray,
+        sample: np.ndarray,
+    ) -> bool:
         reflected = reflect(r_in.direction, rec.normal)
-        reflected = unit_vector(reflected) + (self.fuzz * random_unit_vector())
+        reflected = unit_vector(reflected) + (self.fuzz * random_unit_vector(*sample[:2]))
         scattered.set(rec.p, reflected)
         attenuation.set(self.albedo.x, self.albedo.y, self.albedo.z)
         return dot(scattered.direction, rec.normal) > 0
@@ -72,7 +97,14 @@ class Dielectric(Material):
         '''Use Schlick's approximation for reflectance.'''
         return _dielectric_reflectance(cosine, refraction_index)
 
-    def scatter(self, r_in: Ray, rec: HitRecord, attenuation: Color, scattered: Ray) -> bool:
+    def scatter(
+        self,
+        r_in: Ray,
+        rec: HitRecord,
+        attenuation: Color,
+        scattered: Ray,
+        sample: np.ndarray,
+    ) -> bool:
         attenuation.set(1, 1, 1)
         ri = 1 / self.refraction_index if rec.front_face else self.refraction_index
 
@@ -82,7 +114,7 @@ class Dielectric(Material):
 
         cannot_refract = (ri * sin_theta) > 1
 
-        if cannot_refract or self.reflectance(cos_theta, ri) > RNG.random():
+        if cannot_refract or self.reflectance(cos_theta, ri) > sample[2]:
             direction = reflect(unit_direction, rec.normal)
         else:
             direction = refract(unit_direction, rec.normal, ri)
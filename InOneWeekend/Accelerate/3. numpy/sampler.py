@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import numpy as np
+
+from jit import njit
+
+# Sample patterns. Every one is a pure function of the render seed, the pixel, the sample index
+# and the dimension group: random values come from a counter-based hash stream and the
+# quasi-Monte Carlo sequences are randomized with the same hash, so images do not depend on the
+# engine, the number of threads or the order in which tiles are traced.
+SAMPLER_RANDOM = 0
+SAMPLER_STRATIFIED = 1
+SAMPLER_SOBOL = 2
+SAMPLER_HALTON = 3
+
+# Every sample consumes 4-dimensional groups of sample values: group 0 for the pixel footprint
+# (2) and the lens (2), group 1 + k for bounce k (2 for the scatter direction, 1 for the
+# dielectric reflect / refract choice and 1 unused). Each group is a differently scrambled
+# 4D sequence, which pads the dimensions up to any path length (Burley 2020, "Practical
+# Hash-based Owen Scrambling").
+GROUP_CAMERA = 0
+GROUP_BOUNCE = 1
+GROUP_PERMUTATION = 0xFFFFFFFF  # Shuffle of the stratified lens cells of a pixel
+
+MASK32 = 0xFFFFFFFF
+
+
+def _sobol_directions() -> np.ndarray:
+    '''Direction numbers of the first 4 Sobol dimensions (Joe and Kuo) as 32-bit integers.'''
+    # Degree s, coefficients a and initial m of the primitive polynomials of dimensions 2-4
+    polynomials = [(1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1])]
+    directions = np.zeros((4, 32), dtype=np.int64)
+    directions[0] = [1 << (31 - k) for k in range(32)]  # Van der Corput
+    for dim, (s, a, m_init) in enumerate(polynomials, 1):
+        m = list(m_init)
+        for k in range(s, 32):
+            value = m[k - s] ^ (m[k - s] << s)
+            for i in range(1, s):
+                if (a >> (s - 1 - i)) & 1:
+                    value ^= m[k - i] << i
+            m.append(value)
+        directions[dim] = [m[k] << (31 - k) for k in range(32)]
+    return directions
+
+
+def _sobol_tables(directions: np.ndarray) -> np.ndarray:
+    '''
+    Byte lookup tables of the Sobol generator matrices: tables[dim, b, v] is the XOR of the
+    direction numbers selected by the bits of the value v of byte b of a point index.
+    '''
+    values = np.arange(256)
+    tables = np.zeros((4, 4, 256), dtype=np.int64)
+    for b in range(4):
+        for bit in range(8):
+            selected = ((values >> bit) & 1).astype(bool)
+            tables[:, b, selected] ^= directions[:, 8 * b + bit, np.newaxis]
+    return tables
+
+
+def _halton_tables(bases: np.ndarray, size: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Radical inverses of all the values with up to k digits in the base of each Halton dimension,
+    for the largest chunk base**k of at most `size` values, and the chunk of each dimension.
+    '''
+    chunks = np.array([base ** int(np.log(size) / np.log(base) + 1e-9) for base in bases])
+    tables = np.zeros((len(bases), size))
+    for dim, (base, chunk) in enumerate(zip(bases, chunks)):
+        index = np.arange(chunk)
+        scale = 1.0 / base
+        while index.any():
+            tables[dim, :chunk] += index % base * scale
+            index //= base
+            scale /= base
+    return tables, chunks
+
+
+SOBOL_DIRECTIONS = _sobol_directions()
+SOBOL_TABLES = _sobol_tables(SOBOL_DIRECTIONS)
+HALTON_BASES = np.array([2, 3, 5, 7], dtype=np.int64)
+HALTON_TABLES, HALTON_CHUNKS = _halton_tables(HALTON_BASES)
+
+
+@njit(nogil=True)
+def hash32(a: int, b: int) -> int:
+    """Mixes two 32-bit integers into a well distributed 32-bit hash"""
+    x = (a ^ (b * 0x9E3779B9)) & MASK32
+    x ^= x >> 16
+    x = (x * 0x21F0AAAD) & MASK32
+    x ^= x >> 15
+    x = (x * 0x735A2D97) & MASK32
+    x ^= x >> 15
+    return x
+
+
+@njit(nogil=True, signatures=('(int64, int64, int64)',))
+def hash_pixel(seed: int, i: int, j: int) -> int:
+    """Key of the random streams of pixel i, j in a render with the given seed"""
+    return hash32(hash32(seed & MASK32, i), j)
+
+
+@njit(nogil=True)
+def uniform(key: int, n: int) -> float:
+    """The n-th value in [0, 1) of the counter-based random stream of a key"""
+    return hash32(key, n) * 2.0**-32
+
+
+@njit(nogil=True)
+def _reverse_bits(x: int) -> int:
+    """Reverses the bits of a 32-bit integer"""
+    x = ((x >> 1) & 0x55555555) | ((x & 0x55555555) << 1)
+    x = ((x >> 2) & 0x33333333) | ((x & 0x33333333) << 2)
+    x = ((x >> 4) & 0x0F0F0F0F) | ((x & 0x0F0F0F0F) << 4)
+    x = ((x >> 8) & 0x00FF00FF) | ((x & 0x00FF00FF) << 8)
+    return ((x >> 16) | (x << 16)) & MASK32
+
+
+@njit(nogil=True)
+def _laine_karras_permutation(x: int, seed: int) -> int:
+    """Hash that only lets lower bits affect higher bits, an Owen scramble of reversed bits"""
+    x ^= (x * 0x3D20ADEA) & MASK32
+    x = (x + seed) & MASK32
+    x = (x * ((seed >> 16) | 1)) & MASK32
+    x ^= (x * 0x05526C56) & MASK32
+    x ^= (x * 0x53A22864) & MASK32
+    return x
+
+
+@njit(nogil=True)
+def _nested_uniform_scramble(x: int, seed: int) -> int:
+    """Owen scrambling of a 32-bit fixed point value in [0, 1)"""
+    return _reverse_bits(_laine_karras_permutation(_reverse_bits(x), seed))
+
+
+@njit(nogil=True)
+def _sobol(index: int, dim: int) -> int:
+    """
+    Unscrambled 32-bit Sobol value of a point index in one of the first 4 dimensions, a byte of
+    the index at a time
+    """
+    return (
+        SOBOL_TABLES[dim, 0, index & 0xFF]
+        ^ SOBOL_TABLES[dim, 1, (index >> 8) & 0xFF]
+        ^ SOBOL_TABLES[dim, 2, (index >> 16) & 0xFF]
+        ^ SOBOL_TABLES[dim, 3, (index >> 24) & 0xFF]
+    )
+
+
+@njit(nogil=True)
+def _radical_inverse(index: int, dim: int) -> float:
+    """
+    Van der Corput radical inverse of an index in the base of one of the first 4 Halton
+    dimensions, a table chunk of digits at a time
+    """
+    chunk = HALTON_CHUNKS[dim]
+    inv_chunk = 1.0 / chunk
+    scale = 1.0
+    x = 0.0
+    while index:
+        x += HALTON_TABLES[dim, index % chunk] * scale
+        index //= chunk
+        scale *= inv_chunk
+    return x
+
+
+@njit(nogil=True)
+def _rotated_halton(index: int, dim: int, seed: int) -> float:
+    """Halton value of a point index in one of the first 4 dimensions, randomly rotated"""
+    x = _radical_inverse(index, dim) + hash32(seed, dim) * 2.0**-32
+    return x - 1.0 if x >= 1.0 else x
+
+
+@njit(nogil=True)
+def sample_group(
+    sampler: int, pixel_seed: int, s: int, group: int
+) -> tuple[float, float, float, float]:
+    """
+    The 4 sample values in [0, 1) of a dimension group for the sample s of a pixel.
+    Random values are the stream of the (pixel, sample, group) key.
+    Sobol points are shuffled and Owen scrambled per pixel and group; Halton points use the
+    first four prime bases with a per-pixel and per-group Cranley-Patterson rotation and
+    start offset.
+    """
+    seed = hash32(pixel_seed, group)
+    if sampler == SAMPLER_SOBOL:
+        index = _nested_uniform_scramble(s, seed)
+        x0 = _nested_uniform_scramble(_sobol(index, 0), hash32(seed, 0))
+        x1 = _nested_uniform_scramble(_sobol(index, 1), hash32(seed, 1))
+        x2 = _nested_uniform_scramble(_sobol(index, 2), hash32(seed, 2))
+        x3 = _nested_uniform_scramble(_sobol(index, 3), hash32(seed, 3))
+        return x0 * 2.0**-32, x1 * 2.0**-32, x2 * 2.0**-32, x3 * 2.0**-32
+    if sampler == SAMPLER_HALTON:
+        index = s + (seed & 0xFFFF) if group > GROUP_CAMERA else s
+        return (
+            _rotated_halton(index, 0, seed),
+            _rotated_halton(index, 1, seed),
+            _rotated_halton(index, 2, seed),
+            _rotated_halton(index, 3, seed),
+        )
+    key = hash32(seed, s)
+    return uniform(key, 0), uniform(key, 1), uniform(key, 2), uniform(key, 3)
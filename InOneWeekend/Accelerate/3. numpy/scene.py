@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from collections.abc import Iterable
+from pathlib import Path
+
+import numpy as np
+
+from hittable import Hittable
+from hittable_list import HittableList
+from material import Dielectric, Lambertian, Material, Metal
+from sphere import Sphere
+
+# Material kinds understood by the compiled kernels
+LAMBERTIAN = 0
+METAL = 1
+DIELECTRIC = 2
+
+# Binary scene file: a little-endian header of the magic, the format version, the header size
+# and the sphere count, zero-padded to FILE_HEADER_SIZE bytes, then the spheres, props and kinds
+# arrays back to back in C order. The float arrays start 8-byte aligned so they map in place.
+FILE_MAGIC = b'PYRTSCN\0'
+FILE_VERSION = 1
+FILE_HEADER_SIZE = 64
+_FILE_HEADER = struct.Struct('<8sIIQ')
+
+
+class Scene:
+    '''
+    Flat array form of a world made of spheres, as consumed by the compiled kernels.
+
+    spheres: (n, 4) float64 rows of center x, y, z and radius
+    kinds:   (n,) uint8 material kind of each sphere
+    props:   (n, 4) float64 rows of albedo r, g, b and the material parameter
+             (fuzz for metal, refraction index for dielectric)
+    '''
+
+    def __init__(self, spheres: np.ndarray, kinds: np.ndarray, props: np.ndarray):
+        self.spheres = spheres
+        self.kinds = kinds
+        self.props = props
+
+    def __len__(self) -> int:
+        return self.spheres.shape[0]
+
+    def __repr__(self) -> str:
+        return f'Scene({len(self)} spheres)'
+
+    @staticmethod
+    def lower_material(mat: Material) -> tuple[int, float, float, float, float]:
+        '''Returns the (kind, r, g, b, parameter) row describing a material.'''
+        if isinstance(mat, Lambertian):
+            return LAMBERTIAN, mat.albedo.x, mat.albedo.y, mat.albedo.z, 0
+        if isinstance(mat, Metal):
+            return METAL, mat.albedo.x, mat.albedo.y, mat.albedo.z, mat.fuzz
+        if isinstance(mat, Dielectric):
+            return DIELECTRIC, 1, 1, 1, mat.refraction_index
+        raise TypeError(f'Unsupported material: {type(mat).__name__}')
+
+    @staticmethod
+    def flatten(world: Hittable) -> list[Sphere]:
+        '''
+        Returns the spheres of a world of (possibly nested) hittable lists in depth-first order,
+        the order of the Scene rows.
+        '''
+        spheres = []
+        stack = [world]
+        while stack:
+            hittable = stack.pop()
+            if isinstance(hittable, HittableList):
+                stack.extend(reversed(hittable.hittables))
+            elif isinstance(hittable, Sphere):
+                spheres.append(hittable)
+            else:
+                raise TypeError(f'Unsupported hittable: {type(hittable).__name__}')
+        return spheres
+
+    @classmethod
+    def from_hittable(cls, world: Hittable | Scene) -> Scene:
+        '''Lowers a world of (possibly nested) hittable lists of spheres into a Scene.'''
+        if isinstance(world, Scene):
+            return world
+
+        spheres = []
+        rows = []
+        for sphere in cls.flatten(world):
+            c = sphere.center
+            spheres.append((c.x, c.y, c.z, sphere.radius))
+            rows.append(cls.lower_material(sphere.mat))
+
+        spheres_array = np.array(spheres, dtype=np.float64).reshape(-1, 4)
+        rows_array = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        return cls(
+            spheres_array,
+            rows_array[:, 0].astype(np.uint8),
+            np.ascontiguousarray(rows_array[:, 1:]),
+        )
+
+    @staticmethod
+    def file_header(n: int) -> bytes:
+        '''Returns the header of a binary scene file of n spheres.'''
+        header = _FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, FILE_HEADER_SIZE, n)
+        return header.ljust(FILE_HEADER_SIZE, b'\0')
+
+    def to_bytes(self) -> bytes:
+        '''Returns the scene in the binary scene file format.'''
+        return b''.join(
+            (
+                self.file_header(len(self)),
+                np.ascontiguousarray(self.spheres, dtype='<f8').tobytes(),
+                np.ascontiguousarray(self.props, dtype='<f8').tobytes(),
+                np.ascontiguousarray(self.kinds, dtype=np.uint8).tobytes(),
+            )
+        )
+
+    @classmethod
+    def from_buffer(cls, buffer) -> Scene:
+        '''
+        Returns the scene of a buffer in the binary scene file format, whose arrays are views of
+        the buffer: nothing is copied, and they are read-only when the buffer is.
+        '''
+
+        magic, version, header_size, n = _FILE_HEADER.unpack_from(buffer)
+        if magic != FILE_MAGIC:
+            raise ValueError('Not a scene file')
+        if version != FILE_VERSION:
+            raise ValueError(f'Unsupported scene file version: {version}')
+        spheres = np.frombuffer(buffer, dtype='<f8', count=4 * n, offset=header_size)
+        props = np.frombuffer(buffer, dtype='<f8', count=4 * n, offset=header_size + 32 * n)
+        kinds = np.frombuffer(buffer, dtype=np.uint8, count=n, offset=header_size + 64 * n)
+        return cls(spheres.reshape(n, 4), kinds, props.reshape(n, 4))
+
+    def save(self, path: Path):
+        '''Writes the scene as a binary scene file, which replaces `path` atomically.'''
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        tmp_path.write_bytes(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def save_chunks(cls, path: Path, chunks: Iterable[Scene]) -> int:
+        '''
+        Writes the concatenation of a stream of scenes as one binary scene file, holding one chunk
+        in memory at a time, and returns its sphere count. The props and kinds sections follow
+        all the spheres, so they wait in temporary files until the stream ends.
+        '''
+
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        n = 0
+        with (
+            tmp_path.open('w+b') as f,
+            tempfile.TemporaryFile() as props_file,
+            tempfile.TemporaryFile() as kinds_file,
+        ):
+            f.write(cls.file_header(0))
+            for chunk in chunks:
+                f.write(np.ascontiguousarray(chunk.spheres, dtype='<f8').tobytes())
+                props_file.write(np.ascontiguousarray(chunk.props, dtype='<f8').tobytes())
+                kinds_file.write(np.ascontiguousarray(chunk.kinds, dtype=np.uint8).tobytes())
+                n += len(chunk)
+            for section in (props_file, kinds_file):
+                section.seek(0)
+                shutil.copyfileobj(section, f)
+            f.seek(0)
+            f.write(cls.file_header(n))
+        os.replace(tmp_path, path)
+        return n
+
+    @classmethod
+    def load(cls, path: Path) -> Scene:
+        '''
+        Maps a binary scene file into memory. The pages are read on first use and shared with
+        every process mapping the same file until one writes to its arrays, which copies only the
+        written pages for that process.
+        '''
+
+        with path.open('rb') as f:
+            return cls.from_buffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from camera import Camera
+from hittable import Hittable
+from hittable_list import HittableList
+from jit import warm_up
+from scene import Scene
+from vector import Point3, Vector3
+
+
+class RenderJob:
+    '''Result of one RenderSession.render call.'''
+
+    def __init__(self, framebuffer: np.ndarray, setup_s: float, trace_s: float, write_s: float):
+        self.framebuffer = framebuffer
+        self.setup_s = setup_s  # Settings, scene lookup, framebuffer and tile preparation
+        self.trace_s = trace_s  # Tracing the tiles on the worker pool
+        self.write_s = write_s  # Writing the image file, 0 when no file was requested
+
+    def __repr__(self) -> str:
+        return (
+            f'RenderJob(setup = {self.setup_s:.4f}s, trace = {self.trace_s:.4f}s, '
+            f'write = {self.write_s:.4f}s)'
+        )
+
+
+class RenderSession:
+    '''
+    Long-lived renderer for many small jobs back to back.
+
+    The session owns a worker pool whose threads are started up front, the compiled tile kernel,
+    the scene arrays of the current world and one framebuffer per image size, so that successive
+    render calls only pay for tracing.
+    '''
+
+    # Camera attributes a job may override without rebuilding the camera
+    SETTINGS = (
+        'samples_per_pixel',
+        'max_depth',
+        'rr_depth',
+        'tile_size',
+        'min_spp',
+        'max_spp',
+        'tolerance',
+        'sampler',
+        'seed',
+        'denoise',
+        'aux',
+        'splits',
+        'engine',
+    )
+
+    def __init__(self, world: Hittable | Scene | None = None, max_workers: int | None = None):
+        start_perf_counter_ns = time.perf_counter_ns()
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        self.scene: Scene | None = None
+        self.framebuffers: dict[tuple[int, int], np.ndarray] = {}
+        if world is not None:
+            self.load(world)
+        self.warm_up()
+        self.startup_s = (time.perf_counter_ns() - start_perf_counter_ns) / 1e9
+        logging.info('Session ready in %.2fs with %d workers', self.startup_s, self.max_workers)
+
+    def __enter__(self) -> RenderSession:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def load(self, world: Hittable | Scene):
+        '''Uploads a world as scene arrays, reused by every following job.'''
+        self.scene = Scene.from_hittable(world)
+
+    def warm_up(self):
+        '''Compiles the kernels, or loads them from disk, and starts every worker thread.'''
+        warm_up()
+        camera = Camera(
+            image_width=1,
+            samples_per_pixel=1,
+            max_depth=1,
+            lookfrom=Point3(0, 0, 1),
+            vup=Vector3(0, 1, 0),
+        )
+        scene = self.scene if self.scene is not None else Scene.from_hittable(HittableList())
+        # The pool reuses an idle thread before it starts another one, so each warm-up task holds
+        # its thread until all of them run
+        barrier = threading.Barrier(self.max_workers)
+
+        def warm_up_thread():
+            barrier.wait()
+            camera.render_tile(scene, 0, 0, 1, 1)
+
+        futures = [self.executor.submit(warm_up_thread) for _ in range(self.max_workers)]
+        concurrent.futures.wait(futures)
+
+    def framebuffer(self, camera: Camera) -> np.ndarray:
+        '''Returns the session framebuffer for the camera image size, allocating it on first use.'''
+        key = camera.image_height, camera.image_width
+        framebuffer = self.framebuffers.get(key)
+        if framebuffer is None:
+            framebuffer = self.framebuffers[key] = camera.new_framebuffer()
+        return framebuffer
+
+    def render(
+        self,
+        camera: Camera,
+        image_file: Path | None = None,
+        framebuffer: np.ndarray | None = None,
+        **settings,
+    ) -> RenderJob:
+        '''
+        Renders one job with optional overrides of the camera SETTINGS, checked by the Camera
+        constructor. A max_spp left to its default follows an overridden samples_per_pixel.
+        NOTE: unless a `framebuffer` is given, the returned one is reused by the next job of the
+        same image size.
+        '''
+
+        start_perf_counter_ns = time.perf_counter_ns()
+        if self.scene is None:
+            raise RuntimeError('No world loaded, call load() first')
+        unknown = settings.keys() - set(self.SETTINGS)
+        if unknown:
+            raise TypeError(f'Unknown render settings: {", ".join(sorted(unknown))}')
+        if settings:
+            camera_settings = camera.settings()
+            if 'max_spp' not in settings and camera.max_spp == 4 * camera.samples_per_pixel:
+                del camera_settings['max_spp']  # The default, derived again from the overrides
+            camera = Camera.from_settings({**camera_settings, **settings})
+
+        scene = self.scene
+        if framebuffer is None:
+            framebuffer = self.framebuffer(camera)
+        tiles = camera.tiles()
+
+        def render_tile(x0: int, y0: int, x1: int, y1: int):
+            framebuffer[y0:y1, x0:x1] = camera.render_tile(scene, x0, y0, x1, y1)
+
+        trace_perf_counter_ns = time.perf_counter_ns()
+        futures = [self.executor.submit(render_tile, *tile) for tile in tiles]
+        for future in futures:
+            future.result()
+        write_perf_counter_ns = time.perf_counter_ns()
+
+        if image_file is not None:
+            camera.write_image(framebuffer, image_file)
+        end_perf_counter_ns = time.perf_counter_ns()
+
+        job = RenderJob(
+            framebuffer,
+            (trace_perf_counter_ns - start_perf_counter_ns) / 1e9,
+            (write_perf_counter_ns - trace_perf_counter_ns) / 1e9,
+            (end_perf_counter_ns - write_perf_counter_ns) / 1e9,
+        )
+        logging.info('%dx%d: %s', camera.image_width, camera.image_height, job)
+        return job
@@ -1,16 +1,21 @@
 from __future__ import annotations
 
 import numpy as np
-from numba import njit
 
 from hittable import HitRecord, Hittable
 from interval import Interval
+from jit import njit
 from material import Material
 from ray import Ray
 from vector import Point3, _vector_dot, _vector_length_squared
 
 
-@njit
+@njit(
+    signatures=(
+        '(float64[::1], float64[::1], float64[::1], float64, float64, float64)',
+        '(float64[::1], float64[::1], float64[::1], int64, float64, float64)',
+    )
+)
 def _sphere_hit_optimized(
     ray_origin: np.ndarray,
     ray_direction: np.ndarray,
@@ -63,5 +68,6 @@ class Sphere(Hittable):
         outward_normal = (rec.p - self.center) / self.radius
         rec.set_face_normal(r, outward_normal)
         rec.mat = self.mat
+        rec.obj = self
 
         return True
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import concurrent.futures
+import copy
+import logging
+import time
+
+import numpy as np
+
+from camera import Camera, merge_samples
+from kernel import (
+    CH_ALBEDO,
+    CH_COLOR,
+    CH_INV_DEPTH,
+    CH_MOMENT2,
+    CH_OBJECT,
+    CH_RAYS,
+    CH_SAMPLES,
+)
+from scene import Scene
+
+_LUMINANCE = np.array([0.2126, 0.7152, 0.0722])
+
+
+def reproject(
+    history: np.ndarray,
+    previous: Camera,
+    frame: np.ndarray,
+    camera: Camera,
+    depth_tolerance: float = 0.05,
+) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the history framebuffer of the previous camera gathered into the pixels of a frame
+    of the camera, and the mask of the pixels that found a valid history.
+
+    The first hit of each frame pixel, at the depth the frame measured along its center ray, is
+    projected into the previous camera, or its direction when the pixel saw the background.
+    The history is rejected where it falls outside the previous image or behind its camera, and
+    where the previous pixel hit another sphere or a surface at another depth (disocclusion).
+    '''
+
+    _, directions = camera.ray_tables()
+    directions = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+    inv_depth = frame[..., CH_INV_DEPTH]
+    hit = inv_depth > 0
+    # Hit points relative to the previous camera center, or directions for the background
+    depth = np.divide(1.0, inv_depth, out=np.zeros_like(inv_depth), where=hit)
+    offset = camera.center.e - previous.center.e
+    q = np.where(hit[..., np.newaxis], directions * depth[..., np.newaxis] + offset, directions)
+
+    # Intersection with the previous viewport plane, focus_dist in front of its center
+    w = previous.w.e
+    forward = -(q @ w)
+    valid = forward > 1e-9
+    scale = np.divide(previous.focus_dist, forward, out=np.zeros_like(forward), where=valid)
+    plane = q * scale[..., np.newaxis] + (previous.center.e - previous.pixel00_loc.e)
+    du, dv = previous.pixel_delta_u.e, previous.pixel_delta_v.e
+    x = plane @ du / (du @ du)
+    y = plane @ dv / (dv @ dv)
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = x - x0
+    fy = y - y0
+    expected_inv_depth = 1.0 / np.maximum(np.linalg.norm(q, axis=-1), 1e-12)
+
+    # Bilinear interpolation between the previous pixels that saw the same surface
+    gathered = np.zeros_like(frame)
+    weights = np.zeros(inv_depth.shape)
+    for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        i = x0 + dx
+        j = y0 + dy
+        tap = valid & (i >= 0) & (i < previous.image_width) & (j >= 0) & (j < previous.image_height)
+        i = np.where(tap, i, 0).astype(np.int64)
+        j = np.where(tap, j, 0).astype(np.int64)
+        pixels = history[j, i]
+        previous_inv_depth = pixels[..., CH_INV_DEPTH]
+        same_depth = np.abs(previous_inv_depth - expected_inv_depth) <= (
+            depth_tolerance * expected_inv_depth
+        )
+        tap &= np.where(hit, same_depth, previous_inv_depth == 0)
+        tap &= pixels[..., CH_OBJECT] == frame[..., CH_OBJECT]
+        weight = np.where(tap, (fx if dx else 1 - fx) * (fy if dy else 1 - fy), 0.0)
+        gathered += weight[..., np.newaxis] * pixels
+        weights += weight
+
+    valid &= weights > 0
+    gathered[valid, :] /= weights[valid, np.newaxis]
+    # Partly covered pixels keep their share of the samples, in whole samples
+    gathered[..., CH_SAMPLES] = np.floor(gathered[..., CH_SAMPLES] * weights)
+    gathered[..., CH_OBJECT] = frame[..., CH_OBJECT]
+    return gathered, valid
+
+
+def short_runs(missing: np.ndarray) -> list[tuple[int, int, int, int]]:
+    '''
+    Returns the (x0, y, x1, samples) runs of consecutive pixels [x0, x1) of row y that miss
+    samples, with the largest number of samples missing in each run.
+    '''
+    height, width = missing.shape
+    short = np.zeros((height, width + 2), dtype=np.int8)
+    short[:, 1:-1] = missing > 0
+    edges = np.diff(short, axis=1)
+    starts = np.argwhere(edges == 1)
+    ends = np.argwhere(edges == -1)  # Row-major like the starts, so they pair up
+    return [
+        (int(x0), int(y), int(x1), int(missing[y, x0:x1].max()))
+        for (y, x0), (_, x1) in zip(starts, ends)
+    ]
+
+
+class TemporalAccumulator:
+    '''
+    Renders the frames of a moving camera on top of the reprojected accumulation of the previous
+    frames.
+
+    Every frame traces `refresh_spp` new samples per pixel, and the pixels that keep a valid
+    history (see reproject) add the previous samples to them, up to `history_spp`. History whose
+    luminance differs from the new samples by more than `color_sigmas` standard deviations of
+    their means is rejected as changed shading, e.g. reflections seen from elsewhere. The
+    pixels still short of the camera samples_per_pixel take the samples they miss, so the first
+    frame and disoccluded regions cost a full render. The color is accumulated over the frames,
+    the first-hit features only come from the samples of the current frame.
+    '''
+
+    def __init__(
+        self,
+        refresh_spp: int = 2,  # New samples per pixel of every frame
+        history_spp: int | None = None,  # Cap of the samples kept, default the camera spp
+        depth_tolerance: float = 0.05,  # Relative first-hit depth change rejecting history
+        color_sigmas: float = 4.0,  # Luminance change in standard deviations rejecting history
+        executor: concurrent.futures.Executor | None = None,  # Default: a pool per frame
+    ):
+        self.refresh_spp = refresh_spp
+        self.history_spp = history_spp
+        self.depth_tolerance = depth_tolerance
+        self.color_sigmas = color_sigmas
+        self.executor = executor
+        self.camera: Camera | None = None  # Camera and framebuffer of the previous frame
+        self.history: np.ndarray | None = None
+        self.next_sample = 0  # Sample numbers of later frames start here
+        self.accepted = 0.0  # Fraction of the pixels of the last frame that kept their history
+
+    def reset(self):
+        '''Drops the history, so that the next frame is rendered from scratch.'''
+        self.camera = None
+        self.history = None
+
+    def render_tiles(
+        self,
+        scene: Scene,
+        jobs: list[tuple[Camera, tuple[int, int, int, int]]],
+        first_sample: int,
+        frame_spp: int,
+    ) -> list[np.ndarray]:
+        '''
+        Returns the render_tile pixels of the (camera, tile) jobs, traced in parallel with the
+        strata of frame_spp samples.
+        '''
+
+        def render_tile(camera: Camera, tile: tuple[int, int, int, int]) -> np.ndarray:
+            return camera.render_tile(scene, *tile, first_sample, frame_spp)
+
+        if self.executor is not None:
+            return list(self.executor.map(render_tile, *zip(*jobs)))
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            return list(executor.map(render_tile, *zip(*jobs)))
+
+    def render(self, camera: Camera, scene: Scene) -> np.ndarray:
+        '''Returns the framebuffer of the next frame, seen by the camera.'''
+
+        start_perf_counter_ns = time.perf_counter_ns()
+        spp = camera.samples_per_pixel
+        tiles = camera.tiles()
+        refresh_camera = copy.copy(camera)
+        refresh_camera.tolerance = 0
+        refresh_camera.samples_per_pixel = min(self.refresh_spp, spp)
+        if self.history is None or (
+            (self.camera.image_height, self.camera.image_width)
+            != (camera.image_height, camera.image_width)
+        ):
+            refresh_camera.samples_per_pixel = spp
+
+        framebuffer = camera.new_framebuffer()
+        first_sample = self.next_sample
+        jobs = [(refresh_camera, tile) for tile in tiles]
+        refreshed = self.render_tiles(scene, jobs, first_sample, spp)
+        for (x0, y0, x1, y1), pixels in zip(tiles, refreshed):
+            framebuffer[y0:y1, x0:x1] = pixels
+        first_sample += refresh_camera.samples_per_pixel
+
+        self.accepted = 0.0
+        if refresh_camera.samples_per_pixel < spp:
+            gathered, valid = reproject(
+                self.history, self.camera, framebuffer, camera, self.depth_tolerance
+            )
+            # Changed shading: the luminance means differ by more than their noise
+            samples = framebuffer[..., CH_SAMPLES]
+            history_samples = gathered[..., CH_SAMPLES]
+            luminance = framebuffer[..., CH_COLOR : CH_COLOR + 3] @ _LUMINANCE
+            history_luminance = gathered[..., CH_COLOR : CH_COLOR + 3] @ _LUMINANCE
+            variance = np.maximum(
+                np.maximum(framebuffer[..., CH_MOMENT2] - luminance**2, 0),
+                np.maximum(gathered[..., CH_MOMENT2] - history_luminance**2, 0),
+            )
+            error = np.sqrt(variance / samples + variance / np.maximum(history_samples, 1))
+            valid &= np.abs(history_luminance - luminance) <= self.color_sigmas * error + 1e-6
+            self.accepted = valid.mean()
+
+            history_spp = self.history_spp if self.history_spp is not None else spp
+            gathered[..., CH_SAMPLES] = np.where(valid, np.minimum(history_samples, history_spp), 0)
+            gathered[..., CH_RAYS] = 0  # Traced for earlier frames
+            # Keep the first-hit features of this frame
+            gathered[..., CH_ALBEDO:CH_MOMENT2] = framebuffer[..., CH_ALBEDO:CH_MOMENT2]
+            merge_samples(framebuffer, gathered)
+
+            # Top up the pixels whose history fell short, by runs along the rows
+            top_up_cameras: dict[int, Camera] = {}
+            jobs = []
+            for x0, y0, x1, missing in short_runs(spp - framebuffer[..., CH_SAMPLES]):
+                if missing not in top_up_cameras:
+                    top_up_cameras[missing] = copy.copy(refresh_camera)
+                    top_up_cameras[missing].samples_per_pixel = missing
+                jobs.append((top_up_cameras[missing], (x0, y0, x1, y0 + 1)))
+            if jobs:
+                for (_, (x0, y0, x1, y1)), pixels in zip(
+                    jobs, self.render_tiles(scene, jobs, first_sample, spp)
+                ):
+                    merge_samples(framebuffer[y0:y1, x0:x1], pixels)
+                first_sample += max(camera.samples_per_pixel for camera, _ in jobs)
+
+        self.camera = camera
+        self.history = framebuffer
+        self.next_sample = first_sample
+        elapsed_s = (time.perf_counter_ns() - start_perf_counter_ns) / 1e9
+        rays = framebuffer[..., CH_RAYS].sum()
+        logging.info(
+            'Temporal frame in %.2fs: %.1f%% of the history kept, %.2f rays per pixel',
+            elapsed_s,
+            100 * self.accepted,
+            rays / (camera.image_width * camera.image_height),
+        )
+        return framebuffer
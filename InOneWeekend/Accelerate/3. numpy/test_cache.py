@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import os
+
+import numpy as np
+import pytest
+
+from cache import RenderCache
+from kernel import CH_RAYS, CH_SAMPLES
+from scene import Scene
+from test_camera import render_frame, small_camera, small_world
+
+
+def test_key_includes_the_engine():
+    scene = Scene.from_hittable(small_world())
+    numba_key = RenderCache.key(small_camera(engine='numba'), scene)
+    assert numba_key != RenderCache.key(small_camera(engine='numpy'), scene)
+    assert numba_key == RenderCache.key(small_camera(engine='numba', samples_per_pixel=2), scene)
+
+
+def test_top_up_matches_a_straight_render(tmp_path):
+    scene = Scene.from_hittable(small_world())
+    cache = RenderCache(tmp_path)
+    cache.render(small_camera(samples_per_pixel=4), scene)
+    framebuffer = cache.render(small_camera(samples_per_pixel=8), scene)
+    assert (cache.misses, cache.top_ups) == (1, 1)
+    expected = render_frame(small_camera(samples_per_pixel=8), scene)
+    for channel in (CH_SAMPLES, CH_RAYS):
+        np.testing.assert_array_equal(framebuffer[..., channel], expected[..., channel])
+    # The merged means only differ by the rounding of their weighting
+    np.testing.assert_allclose(framebuffer, expected, rtol=1e-12, atol=1e-12)
+
+    # Fewer samples than the entry holds: a hit returning the 8 spp framebuffer
+    hit = cache.render(small_camera(samples_per_pixel=6), scene)
+    np.testing.assert_array_equal(hit, framebuffer)
+    assert cache.hits == 1
+
+
+@pytest.mark.parametrize('damage', ['truncate', 'garbage', 'empty'])
+def test_corrupt_entry_is_rendered_again(tmp_path, damage):
+    camera = small_camera(samples_per_pixel=2)
+    scene = Scene.from_hittable(small_world())
+    cache = RenderCache(tmp_path)
+    expected = cache.render(camera, scene)
+    path = cache.path(cache.key(camera, scene))
+    data = path.read_bytes()
+    damaged = {'truncate': data[: len(data) // 2], 'garbage': b'x' * 100, 'empty': b''}
+    path.write_bytes(damaged[damage])
+
+    np.testing.assert_array_equal(cache.render(camera, scene), expected)
+    assert cache.misses == 2
+    np.testing.assert_array_equal(cache.render(camera, scene), expected)
+    assert cache.hits == 1
+
+
+def test_evict_drops_the_least_recently_used(tmp_path):
+    cache = RenderCache(tmp_path, max_bytes=250)
+    for name, mtime in (('a', 1000), ('b', 3000), ('c', 2000)):
+        path = tmp_path / f'{name}.npz'
+        path.write_bytes(bytes(100))
+        os.utime(path, (mtime, mtime))
+    cache.evict()
+    assert sorted(path.stem for path in tmp_path.glob('*.npz')) == ['b', 'c']
+
+    os.utime(tmp_path / 'c.npz', (4000, 4000))  # As a cache hit does
+    cache.max_bytes = 150
+    cache.evict()
+    assert [path.stem for path in tmp_path.glob('*.npz')] == ['c']
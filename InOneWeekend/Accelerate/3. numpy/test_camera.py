@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+import vectorized
+from camera import SAMPLERS, Camera, Checkpoint
+from color import Color
+from hittable_list import HittableList
+from jit import ENGINES
+from kernel import CH_COLOR, CH_RAYS, CH_SAMPLES
+from material import Dielectric, Lambertian, Metal
+from sampler import hash_pixel
+from scene import Scene
+from sphere import Sphere
+from vector import Point3, Vector3
+
+
+def small_world() -> HittableList:
+    world = HittableList()
+    world.add(Sphere(Point3(0, -1000, 0), 1000, Lambertian(Color(0.5, 0.5, 0.5))))
+    world.add(Sphere(Point3(0, 1, 0), 1, Dielectric(1.5)))
+    world.add(Sphere(Point3(-4, 1, 0), 1, Lambertian(Color(0.4, 0.2, 0.1))))
+    world.add(Sphere(Point3(4, 1, 0), 1, Metal(Color(0.7, 0.6, 0.5), 0)))
+    return world
+
+
+def small_camera(**settings) -> Camera:
+    return Camera(
+        **{
+            'aspect_ratio': 16 / 9,
+            'image_width': 32,
+            'samples_per_pixel': 9,
+            'max_depth': 8,
+            'vfov': 20,
+            'lookfrom': Point3(13, 2, 3),
+            'lookat': Point3(0, 0, 0),
+            'vup': Vector3(0, 1, 0),
+            'defocus_angle': 0.6,
+            'focus_dist': 10,
+            **settings,
+        }
+    )
+
+
+def render_frame(camera: Camera, scene: Scene) -> np.ndarray:
+    return camera.render_tile(scene, 0, 0, camera.image_width, camera.image_height)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('sampler', SAMPLERS)
+def test_progressive_matches_fixed_spp(tmp_path, engine, sampler):
+    camera = small_camera(sampler=sampler, engine=engine)
+    scene = Scene.from_hittable(small_world())
+    framebuffer = camera.render_progressive(scene, tmp_path / 'image.ppm', max_workers=2)
+    expected = render_frame(camera, scene)
+    np.testing.assert_array_equal(framebuffer[..., CH_SAMPLES], expected[..., CH_SAMPLES])
+    np.testing.assert_array_equal(framebuffer[..., CH_RAYS], expected[..., CH_RAYS])
+    np.testing.assert_allclose(
+        framebuffer[..., CH_COLOR : CH_COLOR + 3], expected[..., CH_COLOR : CH_COLOR + 3]
+    )
+
+
+def test_progressive_deadline_finishes_the_first_pass(tmp_path):
+    camera = small_camera(tile_size=8)
+    scene = Scene.from_hittable(small_world())
+    framebuffer = camera.render_progressive(
+        scene, tmp_path / 'image.ppm', time_budget=0, max_workers=2
+    )
+    np.testing.assert_array_equal(framebuffer[..., CH_SAMPLES], 1)
+    expected = render_frame(small_camera(samples_per_pixel=1), scene)
+    np.testing.assert_allclose(
+        framebuffer[..., CH_COLOR : CH_COLOR + 3], expected[..., CH_COLOR : CH_COLOR + 3]
+    )
+
+
+def test_checkpoint_save_failure_keeps_the_render_error(tmp_path, monkeypatch):
+    camera = small_camera()
+    checkpoint = camera.new_checkpoint(Scene.from_hittable(small_world()))
+
+    def fail(*args):
+        raise RuntimeError('tile failed')
+
+    monkeypatch.setattr(camera, 'render_tile', fail)
+    with pytest.raises(RuntimeError, match='tile failed'):
+        camera.render_checkpoint(checkpoint, checkpoint_file=tmp_path / 'missing' / 'x.npz')
+
+
+def test_resume_matches_an_uninterrupted_render(tmp_path, monkeypatch):
+    camera = small_camera(tile_size=8)
+    scene = Scene.from_hittable(small_world())
+    checkpoint_file = tmp_path / 'image.ckpt.npz'
+    render_tile = camera.render_tile
+    calls = []
+
+    def crash_after_three_tiles(*args):
+        calls.append(args)
+        if len(calls) > 3:
+            raise RuntimeError('preempted')
+        return render_tile(*args)
+
+    monkeypatch.setattr(camera, 'render_tile', crash_after_three_tiles)
+    with pytest.raises(RuntimeError):
+        camera.render_concurrent(
+            scene, tmp_path / 'image.ppm', max_workers=1, checkpoint_file=checkpoint_file
+        )
+    assert 0 < np.count_nonzero(Checkpoint.load(checkpoint_file).tile_spp) < len(camera.tiles())
+
+    framebuffer = Camera.resume(checkpoint_file, tmp_path / 'image.ppm', max_workers=2)
+    np.testing.assert_array_equal(framebuffer, render_frame(small_camera(tile_size=8), scene))
+
+
+def test_split_paths_take_distinct_samples(monkeypatch):
+    camera = small_camera(splits={'lambertian': 3}, samples_per_pixel=4, engine='numpy')
+    scene = Scene.from_hittable(small_world())
+    branches = []
+    trace_paths = vectorized._trace_paths
+
+    def record_paths(*args):
+        pixel_seed, s = args[10], args[11]
+        branches.extend(zip(pixel_seed.tolist(), s.tolist()))
+        return trace_paths(*args)
+
+    monkeypatch.setattr(vectorized, '_trace_paths', record_paths)
+    render_frame(camera, scene)
+    assert len(set(branches)) == len(branches)
+
+
+def test_split_one_material_matches_engines():
+    world = small_world()
+    scene = Scene.from_hittable(world)
+    framebuffers = []
+    for engine in ENGINES:
+        camera = small_camera(splits={'lambertian': 3}, samples_per_pixel=4, engine=engine)
+        framebuffers.append(render_frame(camera, scene))
+    # The engines agree up to rounding
+    for framebuffer in framebuffers[1:]:
+        np.testing.assert_allclose(framebuffer, framebuffers[0], rtol=1e-9, atol=1e-12)
+    for j in range(0, camera.image_height, 5):
+        for i in range(0, camera.image_width, 5):
+            _, _, color = camera.render_pixel(i, j, world)
+            np.testing.assert_allclose(color.e, framebuffers[0][j, i, CH_COLOR : CH_COLOR + 3])
+
+
+def test_split_primary_ray_needs_its_pixel_sample():
+    world = small_world()
+    camera = small_camera(splits={'lambertian': 3})
+    i, j = camera.image_width // 2, camera.image_height // 2
+    sample = camera.sample_block(hash_pixel(camera.seed, i, j), 1)[0]
+    ray = camera.get_ray(i, j, sample[0])
+    with pytest.raises(ValueError):
+        camera.ray_color(ray, camera.max_depth, world, sample[1:])
+
+
+def test_adaptive_matches_engines():
+    scene = Scene.from_hittable(small_world())
+    framebuffers = []
+    for engine in ENGINES:
+        camera = small_camera(min_spp=2, max_spp=16, tolerance=0.05, engine=engine)
+        framebuffers.append(render_frame(camera, scene))
+    # The engines agree up to rounding
+    for framebuffer in framebuffers[1:]:
+        np.testing.assert_allclose(framebuffer, framebuffers[0], rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('capacity', [None, 1])
+def test_traced_tile_records_every_ray(engine, capacity):
+    camera = small_camera(engine=engine)
+    scene = Scene.from_hittable(small_world())
+    pixels, segments = camera.render_tile_traced(scene, 8, 4, 24, 12, capacity=capacity)
+    np.testing.assert_array_equal(pixels, camera.render_tile(scene, 8, 4, 24, 12))
+    assert len(segments) == pixels[..., CH_RAYS].sum()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import json
+import socket
+import threading
+
+import numpy as np
+
+from farm import _LENGTH, Coordinator, _recv, _send, run_worker
+from kernel import CHANNELS
+from scene import Scene
+from test_camera import render_frame, small_camera, small_world
+
+
+def send_raw(sock: socket.socket, data: bytes):
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def assert_closed(sock: socket.socket):
+    sock.settimeout(10)
+    assert sock.recv(1) == b''
+
+
+def test_coordinator_drops_bad_messages():
+    camera = small_camera(samples_per_pixel=2)
+    scene = Scene.from_hittable(small_world())
+    coordinator = Coordinator(scene, camera, lease_timeout=1)
+    thread = threading.Thread(target=coordinator.render)
+    thread.start()
+    try:
+        address = coordinator.address
+        bad_messages = [
+            b'not json',
+            b'[1, 2]',
+            json.dumps({'type': 'lease'}).encode(),  # No size
+            json.dumps({'type': 'unknown', 'size': 0}).encode(),
+            json.dumps({'type': 'lease', 'size': coordinator.max_payload + 1}).encode(),
+        ]
+        for data in bad_messages:
+            with socket.create_connection(address) as sock:
+                send_raw(sock, data)
+                assert_closed(sock)
+
+        with socket.create_connection(address) as sock:
+            _send(sock, {'type': 'lease'})
+            header, _ = _recv(sock)
+            x0, y0, x1, y1 = header['tile']
+            # The pixels of another tile size, then a tile outside the frame
+            _send(
+                sock,
+                {'type': 'result', 'lease': header['lease'], 'tile': header['tile']},
+                bytes((y1 - y0) * (x1 - x0) * CHANNELS * 8 - 8),
+            )
+            assert_closed(sock)
+        with socket.create_connection(address) as sock:
+            _send(sock, {'type': 'lease'})
+            header, _ = _recv(sock)
+            _send(
+                sock,
+                {'type': 'result', 'lease': header['lease'], 'tile': [0, 0, 1, 1]},
+                bytes(CHANNELS * 8),
+            )
+            assert_closed(sock)
+        assert not coordinator.done
+
+        run_worker(*address)
+    finally:
+        coordinator.finished.set()  # Stops the coordinator if the worker failed
+        thread.join()
+    np.testing.assert_array_equal(coordinator.framebuffer, render_frame(camera, scene))
+
+
+def test_waiting_worker_is_told_the_frame_is_done():
+    camera = small_camera(samples_per_pixel=2, tile_size=16)
+    scene = Scene.from_hittable(small_world())
+    expected = render_frame(camera, scene)
+    coordinator = Coordinator(scene, camera, lease_timeout=30)
+    waiting = threading.Event()
+    lease = coordinator.lease
+
+    def lease_or_wait() -> dict:
+        reply = lease()
+        if reply['type'] == 'wait':
+            waiting.set()
+            reply['delay'] = 2  # Past the end of the frame
+        return reply
+
+    coordinator.lease = lease_or_wait
+    replies = []
+    coordinator_thread = threading.Thread(target=coordinator.render)
+    coordinator_thread.start()
+    try:
+        with socket.create_connection(coordinator.address) as sock:
+            # Lease every tile, so that the worker waits until they are complete
+            tiles = []
+            for _ in camera.tiles():
+                _send(sock, {'type': 'lease'})
+                header, _ = _recv(sock)
+                tiles.append(header)
+            worker_thread = threading.Thread(
+                target=lambda: replies.append(run_worker(*coordinator.address))
+            )
+            worker_thread.start()
+            assert waiting.wait(30)
+            for header in tiles:
+                x0, y0, x1, y1 = header['tile']
+                result = {'type': 'result', 'lease': header['lease'], 'tile': header['tile']}
+                _send(sock, result, expected[y0:y1, x0:x1].tobytes())
+                _recv(sock)
+        coordinator_thread.join(30)
+        # The coordinator, whose process may exit next, waited for the worker's done message
+        assert replies == [None]
+    finally:
+        coordinator.finished.set()
+        coordinator_thread.join()
+    np.testing.assert_array_equal(coordinator.framebuffer, expected)
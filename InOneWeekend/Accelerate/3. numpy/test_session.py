@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from kernel import CH_SAMPLES
+from session import RenderSession
+from test_camera import small_camera, small_world
+
+
+def test_render_overrides_rebuild_the_camera():
+    camera = small_camera(samples_per_pixel=2, tolerance=0.05, min_spp=1)
+    with RenderSession(small_world(), max_workers=2) as session:
+        job = session.render(camera, samples_per_pixel=4)
+        # max_spp follows samples_per_pixel as in the constructor, 16 instead of 8
+        assert job.framebuffer[..., CH_SAMPLES].max() > 8
+        job = session.render(camera, samples_per_pixel=3, tolerance=0)
+        np.testing.assert_array_equal(job.framebuffer[..., CH_SAMPLES], 3)
+        with pytest.raises(ValueError):
+            session.render(camera, sampler='unknown')
+        with pytest.raises(ValueError):
+            session.render(camera, splits={'lambertian': 0})
+
+
+def test_warm_up_starts_every_worker_thread():
+    with RenderSession(small_world(), max_workers=3) as session:
+        assert len(session.executor._threads) == 3
@@ -1,55 +1,60 @@
 from __future__ import annotations
 
+import random
+
 import numpy as np
-from numba import njit
 
-RNG = np.random.default_rng()
+from jit import njit
+
+# Argument types of the compiled functions, compiled ahead of use by jit.warm_up()
+_VECTOR = '(float64[::1],)'
+_VECTOR_PAIR = '(float64[::1], float64[::1])'
 
 
 # Numba optimized functions for vector operations
-@njit
+@njit(signatures=(_VECTOR_PAIR,))
 def _vector_add(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     """Optimized vector addition"""
     return a + b
 
 
-@njit
+@njit(signatures=(_VECTOR_PAIR,))
 def _vector_sub(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     """Optimized vector subtraction"""
     return a - b
 
 
-@njit
+@njit(signatures=('(float64[::1], float64)',))
 def _vector_mul_scalar(a: np.ndarray, scalar: float) -> np.ndarray:
     """Optimized vector-scalar multiplication"""
     return a * scalar
 
 
-@njit
+@njit(signatures=(_VECTOR_PAIR,))
 def _vector_mul_vector(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     """Optimized element-wise vector multiplication"""
     return a * b
 
 
-@njit
+@njit(signatures=(_VECTOR,))
 def _vector_length_squared(a: np.ndarray) -> float:
     """Optimized vector length squared calculation"""
     return a[0] * a[0] + a[1] * a[1] + a[2] * a[2]
 
 
-@njit
+@njit(signatures=(_VECTOR,))
 def _vector_length(a: np.ndarray) -> float:
     """Optimized vector length calculation"""
     return np.sqrt(a[0] * a[0] + a[1] * a[1] + a[2] * a[2])
 
 
-@njit
+@njit(signatures=(_VECTOR_PAIR,))
 def _vector_dot(a: np.ndarray, b: np.ndarray) -> float:
     """Optimized dot product"""
     return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
 
 
-@njit
+@njit(signatures=(_VECTOR_PAIR,))
 def _vector_cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     """Optimized cross product"""
     result = np.empty(3, dtype=np.float64)
@@ -59,20 +64,20 @@ def _vector_cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
     return result
 
 
-@njit
+@njit(signatures=(_VECTOR,))
 def _vector_near_zero(a: np.ndarray) -> bool:
     """Optimized check if vector is near zero"""
     s = 1e-8
     return abs(a[0]) < s and abs(a[1]) < s and abs(a[2]) < s
 
 
-@njit
+@njit(signatures=(_VECTOR_PAIR,))
 def _reflect(v: np.ndarray, n: np.ndarray) -> np.ndarray:
     """Optimized reflection calculation"""
     return v - 2 * _vector_dot(v, n) * n
 
 
-@njit
+@njit(signatures=('(float64[::1], float64[::1], float64)',))
 def _refract(uv: np.ndarray, n: np.ndarray, etai_over_etat: float) -> np.ndarray:
     """Optimized refraction calculation"""
     cos_theta = min(_vector_dot(-uv, n), 1.0)
@@ -183,9 +188,14 @@ class Vector3:
 
     @staticmethod
     def random(min_val: float | None = None, max_val: float | None = None) -> Vector3:
+        '''Random vector for scene setup, drawn like the scenes from the `random` module.'''
         if min_val is None and max_val is None:
-            return Vector3(RNG.random(3))
-        return Vector3(RNG.uniform(min_val, max_val, (3)))
+            return Vector3(random.random(), random.random(), random.random())
+        return Vector3(
+            random.uniform(min_val, max_val),
+            random.uniform(min_val, max_val),
+            random.uniform(min_val, max_val),
+        )
 
     def near_zero(self) -> bool:
         '''Return True if the vector is close to zero in all dimensions.'''
@@ -204,40 +214,22 @@ def unit_vector(v: Vector3) -> Vector3:
     return v / v.length()
 
 
-@njit
-def _random_in_unit_disk_optimized() -> tuple[float, float]:
-    """Optimized random point in unit disk"""
-    while True:
-        x = np.random.uniform(-1.0, 1.0)
-        y = np.random.uniform(-1.0, 1.0)
-        if x * x + y * y < 1.0:
-            return x, y
-
-
-@njit
-def _random_unit_vector_optimized() -> np.ndarray:
-    """Optimized random unit vector"""
-    while True:
-        x = np.random.uniform(-1.0, 1.0)
-        y = np.random.uniform(-1.0, 1.0)
-        z = np.random.uniform(-1.0, 1.0)
-        lensq = x * x + y * y + z * z
-        if 1e-160 < lensq <= 1.0:
-            inv_sqrt = 1.0 / np.sqrt(lensq)
-            return np.array([x * inv_sqrt, y * inv_sqrt, z * inv_sqrt], dtype=np.float64)
-
-
-def random_in_unit_disk() -> Vector3:
-    x, y = _random_in_unit_disk_optimized()
-    return Vector3(x, y, 0)
+@njit(signatures=('(float64, float64)',))
+def _square_to_unit_vector(u: float, v: float) -> np.ndarray:
+    """Optimized uniform mapping of (u, v) in [0, 1)^2 onto the unit sphere"""
+    z = 1.0 - 2.0 * u
+    r = np.sqrt(max(0.0, 1.0 - z * z))
+    phi = 2.0 * np.pi * v
+    return np.array([r * np.cos(phi), r * np.sin(phi), z], dtype=np.float64)
 
 
-def random_unit_vector() -> Vector3:
-    return Vector3(_random_unit_vector_optimized())
+def random_unit_vector(u: float, v: float) -> Vector3:
+    '''Returns the unit vector the sample (u, v) in [0, 1)^2 maps to.'''
+    return Vector3(_square_to_unit_vector(u, v))
 
 
-def random_on_hemisphere(normal: Vector3) -> Vector3:
-    on_unit_sphere = random_unit_vector()
+def random_on_hemisphere(normal: Vector3, u: float, v: float) -> Vector3:
+    on_unit_sphere = random_unit_vector(u, v)
     if dot(on_unit_sphere, normal) > 0:  # In the same hemisphere as the normal
         return on_unit_sphere
     return -on_unit_sphere
@@ -0,0 +1,595 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+from kernel import (
+    CAM_CENTER,
+    CAM_DEFOCUS_ANGLE,
+    CAM_DEFOCUS_U,
+    CAM_DEFOCUS_V,
+    CAM_DELTA_U,
+    CAM_DELTA_V,
+    CAM_PIXEL00,
+    CH_ALBEDO,
+    CH_COLOR,
+    CH_INV_DEPTH,
+    CH_MOMENT2,
+    CH_NORMAL,
+    CH_OBJECT,
+    CH_RAYS,
+    CH_SAMPLES,
+    CHANNELS,
+)
+from sampler import (
+    GROUP_BOUNCE,
+    GROUP_CAMERA,
+    GROUP_PERMUTATION,
+    HALTON_CHUNKS,
+    HALTON_TABLES,
+    MASK32,
+    SAMPLER_HALTON,
+    SAMPLER_RANDOM,
+    SAMPLER_SOBOL,
+    SAMPLER_STRATIFIED,
+    SOBOL_TABLES,
+)
+from scene import DIELECTRIC, LAMBERTIAN, METAL
+
+_Segments = list[np.ndarray] | None  # Recorded ray segments in TRACE_COLUMNS rows, None when off
+
+# NumPy engine: the tile kernels of kernel.py over arrays of rays, tracing one bounce of all the
+# live paths of a batch of samples at a time. The sample values are those of sampler.py computed
+# element-wise, so both engines trace the same paths and render the same image up to rounding.
+# It needs no compiler, which makes it start at once where numba takes seconds to import and
+# load its kernels, but it traces several times more slowly.
+
+_BATCH_RAYS = 1 << 14  # Camera rays traced together, bounding the memory of a batch
+_CHUNK_PAIRS = 1 << 20  # Ray-sphere pairs intersected at once by _hit_spheres
+
+# Per-ray first-hit features, in the order of the CH_ALBEDO:CH_MOMENT2 channels
+_FEATURES = CH_MOMENT2 - CH_ALBEDO
+
+
+def _hash32(a: np.ndarray, b: np.ndarray | int) -> np.ndarray:
+    '''sampler.hash32 of int64 arrays, which wrap around on overflow as the compiled one does.'''
+    b = np.asarray(b, dtype=np.int64)
+    x = (a ^ (b * 0x9E3779B9)) & MASK32
+    x ^= x >> 16
+    x = (x * 0x21F0AAAD) & MASK32
+    x ^= x >> 15
+    x = (x * 0x735A2D97) & MASK32
+    x ^= x >> 15
+    return x
+
+
+def _reverse_bits(x: np.ndarray) -> np.ndarray:
+    x = ((x >> 1) & 0x55555555) | ((x & 0x55555555) << 1)
+    x = ((x >> 2) & 0x33333333) | ((x & 0x33333333) << 2)
+    x = ((x >> 4) & 0x0F0F0F0F) | ((x & 0x0F0F0F0F) << 4)
+    x = ((x >> 8) & 0x00FF00FF) | ((x & 0x00FF00FF) << 8)
+    return ((x >> 16) | (x << 16)) & MASK32
+
+
+def _nested_uniform_scramble(x: np.ndarray, seed: np.ndarray) -> np.ndarray:
+    x = _reverse_bits(x)
+    # Laine-Karras permutation
+    x ^= (x * 0x3D20ADEA) & MASK32
+    x = (x + seed) & MASK32
+    x = (x * ((seed >> 16) | 1)) & MASK32
+    x ^= (x * 0x05526C56) & MASK32
+    x ^= (x * 0x53A22864) & MASK32
+    return _reverse_bits(x)
+
+
+def _radical_inverse(index: np.ndarray, dim: int) -> np.ndarray:
+    chunk = HALTON_CHUNKS[dim]
+    inv_chunk = 1.0 / chunk
+    scale = 1.0
+    x = np.zeros(index.shape)
+    while index.any():
+        x += HALTON_TABLES[dim, index % chunk] * scale
+        index = index // chunk
+        scale *= inv_chunk
+    return x
+
+
+def _sample_group(
+    sampler: int, pixel_seed: np.ndarray, s: np.ndarray, group: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''sampler.sample_group of arrays of pixel seeds and sample numbers.'''
+    seed = _hash32(pixel_seed, group)
+    if sampler == SAMPLER_SOBOL:
+        index = _nested_uniform_scramble(s, seed)
+        return tuple(
+            _nested_uniform_scramble(
+                SOBOL_TABLES[dim, 0, index & 0xFF]
+                ^ SOBOL_TABLES[dim, 1, (index >> 8) & 0xFF]
+                ^ SOBOL_TABLES[dim, 2, (index >> 16) & 0xFF]
+                ^ SOBOL_TABLES[dim, 3, (index >> 24) & 0xFF],
+                _hash32(seed, dim),
+            )
+            * 2.0**-32
+            for dim in range(4)
+        )
+    if sampler == SAMPLER_HALTON:
+        index = s + (seed & 0xFFFF) if group > GROUP_CAMERA else s
+        values = []
+        for dim in range(4):
+            x = _radical_inverse(index, dim) + _hash32(seed, dim) * 2.0**-32
+            values.append(np.where(x >= 1.0, x - 1.0, x))
+        return tuple(values)
+    key = _hash32(seed, s)
+    return tuple(_hash32(key, n) * 2.0**-32 for n in range(4))
+
+
+def _shuffle(pixel_seeds: np.ndarray, size: int) -> np.ndarray:
+    '''The kernel's Fisher-Yates shuffles of range(size) of each pixel, as rows.'''
+    seed = _hash32(pixel_seeds, GROUP_PERMUTATION)
+    perm = np.tile(np.arange(size), (len(pixel_seeds), 1))
+    rows = np.arange(len(pixel_seeds))
+    for k in range(size - 1, 0, -1):
+        m = _hash32(seed, k) % (k + 1)
+        perm[rows, k], perm[rows, m] = perm[rows, m], perm[rows, k]
+    return perm
+
+
+def _unit_vector(u: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    z = 1.0 - 2.0 * u
+    r = np.sqrt(np.maximum(0.0, 1.0 - z * z))
+    phi = 2.0 * np.pi * v
+    return r * np.cos(phi), r * np.sin(phi), z
+
+
+def _concentric_disk(u: np.ndarray, v: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    a = 2.0 * u - 1.0
+    b = 2.0 * v - 1.0
+    horizontal = np.abs(a) > np.abs(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(horizontal, a, b)
+        phi = np.where(horizontal, np.pi / 4 * (b / a), np.pi / 2 - np.pi / 4 * (a / b))
+    center = (a == 0.0) & (b == 0.0)
+    return np.where(center, 0.0, r * np.cos(phi)), np.where(center, 0.0, r * np.sin(phi))
+
+
+def _background(d: np.ndarray) -> np.ndarray:
+    length = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2])
+    a = 0.5 * (d[:, 1] / length + 1.0)
+    return np.stack([1.0 - a + a * 0.5, 1.0 - a + a * 0.7, np.ones_like(a)], axis=-1)
+
+
+def _hit_spheres(
+    spheres: np.ndarray, o: np.ndarray, d: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Closest sphere hit beyond 0.001 along each ray, as (index, t) arrays where the index is -1
+    when nothing is hit. The discriminants of all the ray-sphere pairs, _CHUNK_PAIRS at a time,
+    are expanded into dot products that BLAS computes fast. They only cull the pairs, with a
+    margin far above their rounding errors; the pairs left are intersected as in the kernel.
+    '''
+    n = len(o)
+    k = np.full(n, -1, dtype=np.int64)
+    t = np.full(n, np.inf)
+    if len(spheres) == 0:
+        return k, t
+    centers = spheres[:, :3]
+    radius_sq = spheres[:, 3] * spheres[:, 3]
+    center_sq = (centers * centers).sum(axis=1)
+    step = max(1, _CHUNK_PAIRS // len(spheres))
+    for start in range(0, n, step):
+        oc, dc = o[start : start + step], d[start : start + step]
+        a = dc[:, 0] * dc[:, 0] + dc[:, 1] * dc[:, 1] + dc[:, 2] * dc[:, 2]
+        origin_sq = (oc * oc).sum(axis=1)[:, np.newaxis]
+        h = dc @ centers.T - (dc * oc).sum(axis=1)[:, np.newaxis]
+        c = center_sq - 2 * (oc @ centers.T) + origin_sq - radius_sq
+        h *= h
+        margin = 1e-6 * (h + a[:, np.newaxis] * (center_sq + radius_sq + origin_sq))
+        h -= a[:, np.newaxis] * c
+        ray, sphere = np.nonzero(h >= -margin)
+
+        ocx = spheres[sphere, 0] - oc[ray, 0]
+        ocy = spheres[sphere, 1] - oc[ray, 1]
+        ocz = spheres[sphere, 2] - oc[ray, 2]
+        dx, dy, dz = dc[ray, 0], dc[ray, 1], dc[ray, 2]
+        h = dx * ocx + dy * ocy + dz * ocz
+        c = ocx * ocx + ocy * ocy + ocz * ocz - radius_sq[sphere]
+        discriminant = h * h - a[ray] * c
+        sqrtd = np.sqrt(np.maximum(discriminant, 0.0))
+        near = (h - sqrtd) / a[ray]
+        far = (h + sqrtd) / a[ray]
+        root = np.where(near > 0.001, near, np.where(far > 0.001, far, np.inf))
+        root[discriminant < 0] = np.inf
+
+        # Nearest root of each ray, the first sphere on ties as in the kernel
+        order = np.lexsort((root, ray))
+        ray, sphere, root = ray[order], sphere[order], root[order]
+        nearest = np.ones(len(ray), dtype=bool)
+        nearest[1:] = ray[1:] != ray[:-1]
+        nearest &= root < np.inf
+        t[start + ray[nearest]] = root[nearest]
+        k[start + ray[nearest]] = sphere[nearest]
+    return k, t
+
+
+def _hit_point(
+    spheres: np.ndarray, k: np.ndarray, t: np.ndarray, o: np.ndarray, d: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Points, unit normals facing the rays and front face flags of the hits of spheres k at t.'''
+    p = o + t[:, np.newaxis] * d
+    n = (p - spheres[k, :3]) / spheres[k, 3][:, np.newaxis]
+    front_face = d[:, 0] * n[:, 0] + d[:, 1] * n[:, 1] + d[:, 2] * n[:, 2] < 0
+    n[~front_face] = -n[~front_face]
+    return p, n, front_face
+
+
+def _record_segments(
+    segments: _Segments, o: np.ndarray, d: np.ndarray, t: np.ndarray, k: np.ndarray
+):
+    '''kernel._record_segment of arrays of rays.'''
+    if segments is not None:
+        segments.append(np.column_stack((o, d, t, k)).astype(np.float32))
+
+
+def _write_trace(segments: _Segments, trace: np.ndarray, trace_count: np.ndarray):
+    '''Copies the recorded segments into the rows left in the trace and counts all of them.'''
+    if not segments:
+        return
+    rows = np.concatenate(segments)
+    start = trace_count[0]
+    kept = rows[: max(len(trace) - start, 0)]
+    trace[start : start + len(kept)] = kept
+    trace_count[0] += len(rows)
+
+
+def _trace_paths(
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    o: np.ndarray,
+    d: np.ndarray,
+    k: np.ndarray,
+    t: np.ndarray,
+    max_depth: int,
+    rr_depth: int,
+    sampler: int,
+    pixel_seed: np.ndarray,
+    s: np.ndarray,
+    segments: _Segments,
+) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    kernel._trace_path of arrays of paths from the hits of spheres k at t along their rays.
+    Returns their colors and the numbers of rays traced after the given ones, which are
+    appended to the segments.
+    '''
+    n = len(o)
+    color = np.zeros((n, 3))
+    rays = np.full(n, max_depth - 1, dtype=np.int64)
+    throughput = np.ones((n, 3))  # Product of the attenuations along each path
+    live = np.arange(n)  # Paths still bouncing, the rows of the per-path arrays below
+
+    for depth in range(max_depth):
+        if len(live) == 0:
+            break
+        u = np.stack(_sample_group(sampler, pixel_seed, s, GROUP_BOUNCE + depth), axis=-1)
+        if depth > 0:
+            k, t = _hit_spheres(spheres, o, d)
+            _record_segments(segments, o, d, t, k)
+            missed = k < 0
+            color[live[missed]] = throughput[missed] * _background(d[missed])
+            rays[live[missed]] = depth
+            hit = ~missed
+            live, o, d, k, t = live[hit], o[hit], d[hit], k[hit], t[hit]
+            throughput, pixel_seed, s, u = throughput[hit], pixel_seed[hit], s[hit], u[hit]
+
+        p, normal, front_face = _hit_point(spheres, k, t, o, d)
+        kind = kinds[k]
+        scattered = np.empty_like(d)
+        ended = np.zeros(len(live), dtype=bool)  # Absorbed paths, gathering no more light
+
+        lambertian = kind == LAMBERTIAN
+        if lambertian.any():
+            nl = normal[lambertian]
+            scatter = nl + np.stack(_unit_vector(u[lambertian, 0], u[lambertian, 1]), axis=-1)
+            # Catch degenerate scatter direction
+            degenerate = (np.abs(scatter) < 1e-8).all(axis=1)
+            scatter[degenerate] = nl[degenerate]
+            scattered[lambertian] = scatter
+
+        metal = kind == METAL
+        if metal.any():
+            dm, nm = d[metal], normal[metal]
+            dn = dm[:, 0] * nm[:, 0] + dm[:, 1] * nm[:, 1] + dm[:, 2] * nm[:, 2]
+            f = dm - 2 * dn[:, np.newaxis] * nm
+            length = np.sqrt(f[:, 0] * f[:, 0] + f[:, 1] * f[:, 1] + f[:, 2] * f[:, 2])
+            fuzz = props[k[metal], 3][:, np.newaxis]
+            fuzzed = np.stack(_unit_vector(u[metal, 0], u[metal, 1]), axis=-1)
+            scatter = f / length[:, np.newaxis] + fuzz * fuzzed
+            scattered[metal] = scatter
+            sn = scatter[:, 0] * nm[:, 0] + scatter[:, 1] * nm[:, 1] + scatter[:, 2] * nm[:, 2]
+            ended[metal] = sn <= 0
+
+        dielectric = kind == DIELECTRIC
+        if dielectric.any():
+            dd, nd = d[dielectric], normal[dielectric]
+            index = props[k[dielectric], 3]
+            ri = np.where(front_face[dielectric], 1 / index, index)
+            length = np.sqrt(dd[:, 0] * dd[:, 0] + dd[:, 1] * dd[:, 1] + dd[:, 2] * dd[:, 2])
+            ud = dd / length[:, np.newaxis]
+            un = ud[:, 0] * nd[:, 0] + ud[:, 1] * nd[:, 1] + ud[:, 2] * nd[:, 2]
+            cos_theta = np.minimum(-un, 1.0)
+            sin_theta = np.sqrt(1 - cos_theta * cos_theta)
+            r0 = (1 - ri) / (1 + ri)
+            r0 = r0 * r0
+            reflectance = r0 + (1 - r0) * (1 - cos_theta) ** 5
+            reflect = (ri * sin_theta > 1) | (reflectance > u[dielectric, 2])
+            perp = ri[:, np.newaxis] * (ud + cos_theta[:, np.newaxis] * nd)
+            perp_lensq = perp[:, 0] * perp[:, 0] + perp[:, 1] * perp[:, 1] + perp[:, 2] * perp[:, 2]
+            parallel = -np.sqrt(np.abs(1.0 - perp_lensq))
+            scattered[dielectric] = np.where(
+                reflect[:, np.newaxis],
+                ud - 2 * un[:, np.newaxis] * nd,
+                perp + parallel[:, np.newaxis] * nd,
+            )
+
+        ended |= ~(lambertian | metal | dielectric)
+        attenuated = lambertian | metal
+        throughput[attenuated] *= props[k[attenuated], :3]
+        if depth + 1 >= rr_depth:
+            # Russian roulette: the path survives with the probability of its throughput and the
+            # survivors are weighted up by its inverse, which keeps the estimate unbiased.
+            q = np.minimum(throughput.max(axis=1), 0.95)
+            killed = ~ended & (u[:, 3] >= q)
+            ended |= killed
+            throughput[~ended] /= q[~ended, np.newaxis]
+
+        rays[live[ended]] = depth
+        going = ~ended
+        live, o, d, throughput = live[going], p[going], scattered[going], throughput[going]
+        pixel_seed, s = pixel_seed[going], s[going]
+
+    return color, rays
+
+
+def _sample_pixels(
+    cam: np.ndarray,
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    i: np.ndarray,
+    j: np.ndarray,
+    max_depth: int,
+    rr_depth: int,
+    splits: np.ndarray,
+    sampler: int,
+    strata: int,
+    perm: np.ndarray,
+    pixel_seed: np.ndarray,
+    s: np.ndarray,
+    segments: _Segments,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    kernel._sample_pixel of arrays of samples s of pixels i, j, with `perm` the lens cell orders
+    of their pixels under stratified sampling. Returns the colors, the numbers of rays, the
+    first-hit features in the order of the CH_ALBEDO:CH_MOMENT2 channels and the spheres hit,
+    and appends the rays to the segments.
+    '''
+    n = len(s)
+    px, py, lx, ly = _sample_group(sampler, pixel_seed, s, GROUP_CAMERA)
+    if sampler == SAMPLER_STRATIFIED:
+        # The first strata * strata samples jitter the same random values inside grid cells
+        stratified = s < strata * strata
+        cell = perm[np.arange(n), np.where(stratified, s, 0)]
+        px = np.where(stratified, (s % strata + px) / strata, px)
+        py = np.where(stratified, (s // strata + py) / strata, py)
+        lx = np.where(stratified, (cell % strata + lx) / strata, lx)
+        ly = np.where(stratified, (cell // strata + ly) / strata, ly)
+
+    # Camera rays, as in kernel._camera_ray
+    fi = (i + px - 0.5)[:, np.newaxis]
+    fj = (j + py - 0.5)[:, np.newaxis]
+    target = (
+        cam[CAM_PIXEL00 : CAM_PIXEL00 + 3]
+        + fi * cam[CAM_DELTA_U : CAM_DELTA_U + 3]
+        + fj * cam[CAM_DELTA_V : CAM_DELTA_V + 3]
+    )
+    o = np.tile(cam[CAM_CENTER : CAM_CENTER + 3], (n, 1))
+    if cam[CAM_DEFOCUS_ANGLE] > 0:
+        du, dv = _concentric_disk(lx, ly)
+        o += (
+            du[:, np.newaxis] * cam[CAM_DEFOCUS_U : CAM_DEFOCUS_U + 3]
+            + dv[:, np.newaxis] * cam[CAM_DEFOCUS_V : CAM_DEFOCUS_V + 3]
+        )
+    d = target - o
+
+    # Primary hits and their features, as in kernel._ray_color
+    k, t = _hit_spheres(spheres, o, d)
+    _record_segments(segments, o, d, t, k)
+    color = _background(d)
+    rays = np.ones(n, dtype=np.int64)
+    features = np.zeros((n, _FEATURES))
+    features[:, :3] = color
+    hit = k >= 0
+    if not hit.any():
+        return color, rays, features, k
+
+    kh, th, oh, dh = k[hit], t[hit], o[hit], d[hit]
+    _, normal, _ = _hit_point(spheres, kh, th, oh, dh)
+    kind = kinds[kh]
+    features[hit, :3] = np.where((kind == DIELECTRIC)[:, np.newaxis], 1.0, props[kh, :3])
+    features[hit, CH_NORMAL - CH_ALBEDO : CH_NORMAL - CH_ALBEDO + 3] = normal
+    length = np.sqrt(dh[:, 0] * dh[:, 0] + dh[:, 1] * dh[:, 1] + dh[:, 2] * dh[:, 2])
+    features[hit, CH_INV_DEPTH - CH_ALBEDO] = 1.0 / (th * length)
+
+    # A hit on a material of kind m splits into the splits[m] paths s * splits.max() + branch
+    counts = splits[kind]
+    path = np.repeat(np.arange(len(kh)), counts)
+    branch = np.arange(len(path)) - np.repeat(np.cumsum(counts) - counts, counts)
+    path_color, path_rays = _trace_paths(
+        spheres,
+        kinds,
+        props,
+        oh[path],
+        dh[path],
+        kh[path],
+        th[path],
+        max_depth,
+        rr_depth,
+        sampler,
+        pixel_seed[hit][path],
+        s[hit][path] * splits.max() + branch,
+        segments,
+    )
+    for c in range(3):
+        color[hit, c] = np.bincount(path, path_color[:, c], minlength=len(kh)) / counts
+    rays[hit] += np.bincount(path, path_rays, minlength=len(kh)).astype(np.int64)
+    return color, rays, features, k
+
+
+def render_tile_vectorized(
+    cam: np.ndarray,
+    spheres: np.ndarray,
+    kinds: np.ndarray,
+    props: np.ndarray,
+    x0: int,
+    y0: int,
+    x1: int,
+    y1: int,
+    samples_per_pixel: int,
+    first_sample: int,
+    frame_spp: int,
+    max_depth: int,
+    rr_depth: int,
+    splits: np.ndarray,
+    min_spp: int,
+    max_spp: int,
+    tolerance: float,
+    sampler: int,
+    seed: int,
+    out: np.ndarray,
+    trace: np.ndarray,
+    trace_count: np.ndarray,
+):
+    '''
+    kernel.render_tile_kernel in NumPy, with the same arguments and output channels. Samples are
+    traced in rounds of one sample of each of a set of pixels, several rounds at a time up to
+    _BATCH_RAYS rays, and added to the pixel sums in the order the kernel adds them. The trace
+    receives the same ray segments in another order.
+    '''
+    width = x1 - x0
+    n = (y1 - y0) * width
+    pixels = np.arange(n)
+    i = x0 + pixels % width
+    j = y0 + pixels // width
+    pixel_seeds = _hash32(_hash32(np.full(n, seed & MASK32, dtype=np.int64), i), j)
+
+    sums = np.zeros((n, 3))
+    counts = np.zeros(n, dtype=np.int64)
+    rays = np.zeros(n, dtype=np.int64)
+    features = np.zeros((n, _FEATURES))
+    objects = np.full(n, -1, dtype=np.int64)
+    moment2 = np.zeros(n)  # Sum of squared luminances
+    means = np.zeros(n)  # Welford running luminance mean and sum of squared differences
+    m2s = np.zeros(n)
+    segments: _Segments = [] if len(trace) else None
+
+    def trace_rounds(rounds: list[tuple[np.ndarray, np.ndarray]], sampler: int, strata: int):
+        '''Traces rounds of (pixels, sample numbers), each pixel at most once per round.'''
+        perm = _shuffle(pixel_seeds, strata * strata) if sampler == SAMPLER_STRATIFIED else None
+        start = 0
+        while start < len(rounds):
+            end = start + 1
+            size = len(rounds[start][0])
+            while end < len(rounds) and size + len(rounds[end][0]) <= _BATCH_RAYS:
+                size += len(rounds[end][0])
+                end += 1
+            batch = np.concatenate([rows for rows, _ in rounds[start:end]])
+            color, path_rays, sample_features, k = _sample_pixels(
+                cam,
+                spheres,
+                kinds,
+                props,
+                i[batch],
+                j[batch],
+                max_depth,
+                rr_depth,
+                splits,
+                sampler,
+                strata,
+                perm[batch] if perm is not None else None,
+                pixel_seeds[batch],
+                np.concatenate([s for _, s in rounds[start:end]]),
+                segments,
+            )
+            offset = 0
+            for rows, _ in rounds[start:end]:
+                sample = slice(offset, offset + len(rows))
+                offset += len(rows)
+                r, g, b = color[sample, 0], color[sample, 1], color[sample, 2]
+                sums[rows] += color[sample]
+                counts[rows] += 1
+                rays[rows] += path_rays[sample]
+                features[rows] += sample_features[sample]
+                objects[rows] = np.where(objects[rows] < 0, k[sample], objects[rows])
+                luminance = 0.2126 * r + 0.7152 * g + 0.0722 * b
+                moment2[rows] += luminance * luminance
+                delta = luminance - means[rows]
+                means[rows] += delta / counts[rows]
+                m2s[rows] += delta * (luminance - means[rows])
+            start = end
+
+    if tolerance <= 0:
+        samples = range(first_sample, first_sample + samples_per_pixel)
+        rounds = [(pixels, np.full(n, s)) for s in samples]
+        trace_rounds(rounds, sampler, math.isqrt(frame_spp))
+        tile = np.empty((n, CHANNELS))
+        tile[:, CH_COLOR : CH_COLOR + 3] = sums / samples_per_pixel
+        tile[:, CH_SAMPLES] = samples_per_pixel
+        tile[:, CH_RAYS] = rays
+        tile[:, CH_ALBEDO:CH_MOMENT2] = features / samples_per_pixel
+        tile[:, CH_MOMENT2] = moment2 / samples_per_pixel
+        tile[:, CH_OBJECT] = objects
+        out[...] = tile.reshape(out.shape)
+        _write_trace(segments, trace, trace_count)
+        return
+
+    # Adaptive sampling, as in kernel._render_tile_adaptive
+    first = min(min_spp, max_spp)
+    strata = math.isqrt(first)
+    samples = range(first_sample, first_sample + first)
+    trace_rounds([(pixels, np.full(n, s)) for s in samples], sampler, strata)
+    # Past the stratified first phase the samples are plain random
+    later_sampler = SAMPLER_RANDOM if sampler == SAMPLER_STRATIFIED else sampler
+
+    budget = samples_per_pixel * n - counts.sum()
+    step = max(min_spp, 1)  # Samples given to each noisy pixel per round
+    while budget > 0:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            errors = 1.96 * np.sqrt(m2s / (counts - 1) / counts)
+        errors[counts < 2] = np.inf
+        errors[counts >= max_spp] = 0.0
+
+        order = np.argsort(-errors, kind='stable')
+        noisy = order[errors[order] > tolerance]
+        if len(noisy) == 0:
+            break  # The whole tile has converged
+        # Noisiest first, each taking up to `step` samples of what is left of the budget
+        take = np.minimum(step, max_spp - counts[noisy])
+        take = np.clip(budget - (np.cumsum(take) - take), 0, take)
+        rounds = [
+            (noisy[take > t], first_sample + counts[noisy[take > t]] + t)
+            for t in range(take.max())
+        ]
+        trace_rounds(rounds, later_sampler, strata)
+        budget -= take.sum()
+
+    scale = 1.0 / counts
+    tile = np.empty((n, CHANNELS))
+    tile[:, CH_COLOR : CH_COLOR + 3] = sums * scale[:, np.newaxis]
+    tile[:, CH_SAMPLES] = counts
+    tile[:, CH_RAYS] = rays
+    tile[:, CH_ALBEDO:CH_MOMENT2] = features * scale[:, np.newaxis]
+    tile[:, CH_MOMENT2] = m2s * scale + means * means
+    tile[:, CH_OBJECT] = objects
+    out[...] = tile.reshape(out.shape)
+    _write_trace(segments, trace, trace_count)